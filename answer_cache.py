@@ -0,0 +1,154 @@
+import os, re, json, time, sqlite3, hashlib, threading, logging
+
+from config import ANSWER_CACHE_TTL, ANSWER_CACHE_MAX
+from car_compat import MODEL_ALIAS_PATTERN
+
+log = logging.getLogger("kai")
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BASE_DIR, "data")
+os.makedirs(DATA_DIR, exist_ok=True)
+DB_PATH = os.getenv("ANSWER_CACHE_DB_PATH", os.path.join(DATA_DIR, "answer_cache.db"))
+
+# Follow-up turns ("what about that one?", "yang 2020 pula?", "and the
+# city?") depend on earlier messages, so their answers must not be shared
+# between users.
+_FOLLOW_UP = re.compile(
+    r"\b(it|its|that|this|these|those|them|they|one|same|above|previous|"
+    r"ini|itu|tu|dia|tadi|tersebut|sama|juga|pula|pulak)\b"
+    r"|\b(what|how)\s+about\b|^\W*(and|or|but|then|dan|atau|kalau|kalo)\b",
+    re.I
+)
+# A bare year and/or model ("2019?", "x70", "myvi 2020") only makes sense after a question
+_BARE_CAR = re.compile(
+    rf"^\W*(?:(?:{MODEL_ALIAS_PATTERN}|(?:19|20)\d{{2}})\W*){{1,3}}$",
+    re.I
+)
+
+
+def is_follow_up(text: str) -> bool:
+    text = text or ""
+    return bool(_FOLLOW_UP.search(text) or _BARE_CAR.match(text))
+
+
+def _norm_question(text: str) -> str:
+    return " ".join(re.sub(r"[^\w\s]", " ", (text or "").lower()).split())
+
+
+class AnswerCache:
+    """
+    Persistent LLM answer cache. Entries are keyed on language, index
+    version, the retrieved entry IDs and the normalized question, expire
+    after `ttl` seconds and are evicted least-recently-used past `max_entries`.
+    """
+
+    def __init__(self, db_path: str, ttl: int = 7 * 86400, max_entries: int = 5000):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.stores = 0
+
+    def connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        # A connection opened before a fork (gunicorn --preload) belongs to the parent
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def init(self):
+        conn = self.connect()
+        with conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS answers (
+                    key TEXT PRIMARY KEY,
+                    index_version TEXT,
+                    lang TEXT,
+                    question TEXT,
+                    answer TEXT,
+                    created_at REAL,
+                    last_used REAL,
+                    hits INTEGER DEFAULT 0
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_answers_last_used ON answers (last_used)")
+
+    @staticmethod
+    def make_key(lang: str, index_version: str, entry_ids, question: str) -> str:
+        raw = json.dumps([lang, index_version, list(entry_ids), _norm_question(question)])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> str | None:
+        now = time.time()
+        conn = self.connect()
+        row = conn.execute("SELECT answer, created_at FROM answers WHERE key=?", (key,)).fetchone()
+        if not row or now - row[1] > self.ttl:
+            self.misses += 1
+            return None
+        with conn:
+            conn.execute("UPDATE answers SET last_used=?, hits=hits+1 WHERE key=?", (now, key))
+        self.hits += 1
+        return row[0]
+
+    def put(self, key: str, index_version: str, lang: str, question: str, answer: str):
+        now = time.time()
+        conn = self.connect()
+        with conn:
+            conn.execute(
+                "REPLACE INTO answers (key, index_version, lang, question, answer, created_at, last_used, hits) "
+                "VALUES (?,?,?,?,?,?,?,0)",
+                (key, index_version, lang, question, answer, now, now)
+            )
+            conn.execute("DELETE FROM answers WHERE created_at < ?", (now - self.ttl,))
+            conn.execute("""
+                DELETE FROM answers WHERE key IN (
+                    SELECT key FROM answers ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                )
+            """, (self.max_entries,))
+        self.stores += 1
+
+    def skip(self):
+        """Count a turn that bypassed the cache (history-dependent)."""
+        self.bypassed += 1
+
+    def retain_versions(self, versions):
+        """Drop answers built on any index other than the ones now loaded."""
+        versions = [v for v in versions if v]
+        if not versions:
+            return
+        conn = self.connect()
+        with conn:
+            cur = conn.execute(
+                f"DELETE FROM answers WHERE index_version NOT IN ({','.join('?' * len(versions))})",
+                versions
+            )
+        if cur.rowcount:
+            log.info(f"[AnswerCache] Invalidated {cur.rowcount} answers from old indexes")
+
+    def clear(self):
+        conn = self.connect()
+        with conn:
+            conn.execute("DELETE FROM answers")
+        log.info("[AnswerCache] Cleared")
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        entries = self.connect().execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+        return {
+            "entries": entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "llm_calls_saved": self.hits,
+        }
+
+
+ANSWER_CACHE = AnswerCache(DB_PATH, ttl=ANSWER_CACHE_TTL, max_entries=ANSWER_CACHE_MAX)
@@ -1,33 +1,48 @@
 from fastapi import FastAPI, Request, Query, Header
-from fastapi.responses import PlainTextResponse, JSONResponse
+from fastapi.responses import PlainTextResponse, JSONResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
+from starlette.concurrency import run_in_threadpool
 from datetime import datetime
-import pytz, re, os, json, traceback, logging, sqlite3
+import pytz, re, os, json, time, traceback, logging, threading, hashlib, asyncio
 from logging.handlers import RotatingFileHandler
-import requests
-from deep_translator import GoogleTranslator
 from fastapi_utils.tasks import repeat_every
 
 from config import (
     TZ_REGION, OFFICE_START, OFFICE_END, PORT,
     SOP_DOC_URL, WARRANTY_CSV_URL,
     RAG_DIR, SOP_JSON_PATH, ADMIN_TOKEN,
-    MIN_SUPPORTED_YEAR
+    MIN_SUPPORTED_YEAR,
+    WEBHOOK_MODE, WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE, WEBHOOK_DRAIN_SECONDS,
+    EVENT_HEARTBEAT_SECONDS, WORKERS
 )
-from lang_detect import is_malay
-from deepseek_client import chat_completion
-from rag.rag import RAGEngine
+from lang_detect import is_malay, stats as lang_detect_stats
+from deepseek_client import chat_completion, stats as llm_stats, start as start_llm, close as close_llm
+from prompt_builder import build_prompt, PROMPT_STATS
+from rag.rag import RAGEngine, QUERY_CACHE, RETRIEVAL_STATS, multi_search
 from rag.rebuild_index_combined import rebuild as rebuild_rag
+from rag.index_store import resolve_index_dir, FAISS_INDEX_FILE
 from sop_doc_loader import fetch_sop_doc_text, parse_qas_from_text
 from google_sheets import (
-    fetch_warranty_all, warranty_lookup_by_dongle, warranty_text_from_row
+    fetch_warranty_all, load_warranty_snapshot, warranty_find_dongle, warranty_text_from_row,
+    warranty_stats, warranty_snapshot_stale
 )
 from session_state import (
     get_session, set_lang, freeze, update_reply_state,
     log_qna, init_db, set_last_intent, get_last_intent,
-    add_message_to_history, get_history, reset_memory
+    add_message_to_history, get_history, reset_memory,
+    session_unit, SESSION_STORE, list_sessions_page, get_chat_page, sessions_version, chat_version
 )
 from media_handler import handle_incoming_media, init_media_log
+from webhook_queue import WebhookQueue
+from whatsapp_sender import WA_SENDER, TYPING
+from answer_cache import ANSWER_CACHE, is_follow_up
+from translator import TRANSLATOR
+from warmup import WARMUP
+from car_compat import CAR_COMPAT, load_compat, load_compat_source, format_verdict
+from intent_router import INTENT_ROUTER, TEMPLATE_REPLIES, CAR_KEYWORDS
+from templates import FALLBACK_EN, FALLBACK_BM
+from events import EVENTS, STREAM_TICKETS, format_sse
+from worker_sync import FileLock, run_once, STATE_WATCHER, LOCK_DIR
 
 
 os.makedirs("logs", exist_ok=True)
@@ -40,6 +55,8 @@ app = FastAPI(title="Kai - Kommu Chatbot")
 # Initialize databases
 init_db()
 init_media_log()
+ANSWER_CACHE.init()
+TRANSLATOR.init()
 
 # Serve media and dashboard UI
 app.mount("/media", StaticFiles(directory="media"), name="media")
@@ -51,11 +68,6 @@ FOOTER_BM = "\n\nSaya Kai, chatbot sokongan Kommu (beta). Sila hantar soalan and
 
 # ----------------- Constants -----------------
 MEMORY_LAYERS = 5
-CAR_KEYWORDS = [
-    "myvi", "alza", "ativa", "perodua", "proton", "s70", "x50", "x70",
-    "honda", "city", "accord", "hrv", "crv", "toyota", "vios", "cross",
-    "byd", "lexus", "kereta", "support", "compatible"
-]
 
 # ----------------- Utility Functions -----------------
 def is_office_hours(now=None):
@@ -68,42 +80,13 @@ def after_hours_suffix(lang="EN"):
             if lang == "BM"
             else "\n\nPS: We’re currently outside office hours. A live agent will follow up later.")
 
-def norm(text: str) -> str:
-    return re.sub(r"\s+", " ", (text or "").lower()).strip()
-
-def has_any(words, text: str) -> bool:
-    return any(re.search(rf"\b{w}\b", text) for w in words)
-
 def add_footer(answer: str, lang: str) -> str:
     footer = FOOTER_BM if lang == "BM" else FOOTER_EN
     return (answer or "").rstrip() + footer
 
-def detect_car_support_query(text: str) -> bool:
-    return any(k in text.lower() for k in CAR_KEYWORDS)
-
-def extract_year(text: str) -> int | None:
-    m = re.search(r"\b(19|20)\d{2}\b", text)
-    return int(m.group()) if m else None
-
-def parse_year_range(text: str):
-    match = re.search(r"(\d{4})[–-](\d{4})", text)
-    if match:
-        return int(match.group(1)), int(match.group(2))
-    return None, None
 # ----------------- WhatsApp Send -----------------
 def send_whatsapp_message(to: str, text: str):
-    url = f"https://graph.facebook.com/v17.0/{os.getenv('META_PHONE_NUMBER_ID')}/messages"
-    headers = {
-        "Authorization": f"Bearer {os.getenv('META_PERMANENT_TOKEN','')}",
-        "Content-Type": "application/json"
-    }
-    payload = {"messaging_product": "whatsapp","to": to,"type": "text","text": {"body": text}}
-    try:
-        r = requests.post(url, headers=headers, json=payload, timeout=10)
-        if r.status_code >= 400:
-            log.error(f"[Kai] Send fail {r.status_code}: {r.text}")
-    except Exception as e:
-        log.error(f"[Kai] Send error: {e}")
+    WA_SENDER.send_text(to, text)
 
 # ----------------- RAG Dual Engine -----------------
 def run_rag_dual(user_text: str, lang_hint: str = "EN", user_id: str | None = None) -> str:
@@ -119,78 +102,165 @@ def run_rag_dual(user_text: str, lang_hint: str = "EN", user_id: str | None = No
     )
     lang_instruction = "Jawab dalam BM dengan nada mesra." if lang_hint == "BM" else "Answer politely in English."
 
-    history_text = ""
-    if user_id:
-        history = get_history(user_id)
-        if history:
-            limited = history[-MEMORY_LAYERS:]
-            history_text = "\n".join([f"{h['role']}: {h['text']}" for h in limited])
-
-    context = rag_sop.build_context(user_text, topk=4) if rag_sop else ""
-    if context.strip():
-        # Combine prompts into a single string
-        full_prompt = f"{sys_prompt}\n\n{history_text}\nUser: {user_text}\n\nContext:\n{context}\n\n{lang_instruction}"
-        llm = chat_completion(full_prompt)
+    # The LLM always sees the recent turns. Only an opening question (no
+    # earlier turns, not worded as a follow-up) gets an answer that depends
+    # on nothing but the question, so only those are shared via the cache.
+    history = get_history(user_id)[-MEMORY_LAYERS:] if user_id else []
+    earlier = history
+    if history and history[-1]["role"] == "user" and history[-1]["text"] == user_text:
+        earlier = history[:-1]  # the turn being answered
+    cacheable = not earlier and not is_follow_up(user_text)
+    if not cacheable:
+        ANSWER_CACHE.skip()
+
+    # BM25 first; the question is embedded at most once, and only when the lexical match is weak
+    engines = (rag_sop, rag_web)
+    for engine, hits in zip(engines, multi_search(engines, user_text, topk=4)):
+        if not engine or not hits:
+            continue
+        cache_key = None
+        if cacheable:
+            cache_key = ANSWER_CACHE.make_key(lang_hint, engine.version, [h["id"] for h in hits], user_text)
+            cached = ANSWER_CACHE.get(cache_key)
+            if cached:
+                return cached
+        system, user_prompt = build_prompt(sys_prompt, user_text, hits, engine.format_context,
+                                           history=history, lang_instruction=lang_instruction)
+        llm = chat_completion(system, user_prompt)
         if llm:
-            try:
-                if lang_hint == "BM":
-                    llm = GoogleTranslator(source="auto", target="ms").translate(llm)
-            except Exception as e:
-                log.warning(f"[Translate] BM translation failed: {e}")
-            return llm.strip()
-
-    context = rag_web.build_context(user_text, topk=4) if rag_web else ""
-    if context.strip():
-        full_prompt = f"{sys_prompt}\n\n{history_text}\nUser: {user_text}\n\nContext:\n{context}\n\n{lang_instruction}"
-        llm = chat_completion(full_prompt)
-        if llm:
-            try:
-                if lang_hint == "BM":
-                    llm = GoogleTranslator(source="auto", target="ms").translate(llm)
-            except Exception as e:
-                log.warning(f"[Translate] BM translation failed: {e}")
-            return llm.strip()
+            if lang_hint == "BM":
+                llm = TRANSLATOR.translate(llm, "BM")
+            llm = llm.strip()
+            if cache_key:
+                ANSWER_CACHE.put(cache_key, engine.version, lang_hint, user_text, llm)
+            return llm
 
     return ""
 
 # ----------------- RAG Loader -----------------
-def load_rag():
-    global rag_sop, rag_web
-    try:
-        rag_sop = RAGEngine(k=4, base_dir=os.path.join(RAG_DIR, "faiss_index"))
-        log.info("[Kai] SOP RAG loaded")
-    except Exception as e:
-        log.info(f"[Kai] SOP RAG not available: {e}")
-        rag_sop = None
+_RAG_SWAP_LOCK = threading.Lock()
+# Held while an index is being built so warm-up and /admin/reindex never
+# overlap, in this worker or any other
+_BUILD_LOCK = FileLock("rebuild")
+# Import time; with --preload the gunicorn master's, shared by every worker
+_BOOT_TIME = time.time()
+RAG_INDEXES = (("SOP", "faiss_index"), ("Website", "faiss_index_web"))
+
+def _load_engine(label: str, dirname: str, current):
     try:
-        rag_web = RAGEngine(k=4, base_dir=os.path.join(RAG_DIR, "faiss_index_web"))
-        log.info("[Kai] Website RAG loaded")
+        engine = RAGEngine(k=4, base_dir=os.path.join(RAG_DIR, dirname))
+        log.info(f"[Kai] {label} RAG loaded ({engine.version})")
+        return engine
     except Exception as e:
-        log.info(f"[Kai] Website RAG not available: {e}")
-        rag_web = None
+        log.info(f"[Kai] {label} RAG not available: {e}")
+        return current  # keep serving the previous build, if any
+
+def load_rag():
+    """
+    Load the live index builds and swap the module-level engines. Requests
+    that already picked up the old engines finish on them.
+    """
+    global rag_sop, rag_web
+    with _RAG_SWAP_LOCK:
+        (sop_label, sop_dir), (web_label, web_dir) = RAG_INDEXES
+        sop = _load_engine(sop_label, sop_dir, rag_sop)
+        web = _load_engine(web_label, web_dir, rag_web)
+        rag_sop, rag_web = sop, web
+        CAR_COMPAT.install({
+            "compat_list": load_compat_source(),
+            **{os.path.basename(e.base_dir): load_compat(e.index_dir, e.meta) for e in (sop, web) if e},
+        })
+    QUERY_CACHE.clear()
+    ANSWER_CACHE.retain_versions([e.version for e in (sop, web) if e])
+
+
+def rag_stale() -> bool:
+    """True when a build published by another worker isn't the one this process serves."""
+    for engine, (_, dirname) in zip((rag_sop, rag_web), RAG_INDEXES):
+        live = resolve_index_dir(os.path.join(RAG_DIR, dirname))
+        if engine is not None:
+            if engine.index_dir != live:
+                return True
+        elif os.path.exists(os.path.join(live, FAISS_INDEX_FILE)):
+            return True
+    return False
 
 
 rag_sop, rag_web = None, None
-try:
-    if SOP_DOC_URL:
-        txt = fetch_sop_doc_text()
-        qas = parse_qas_from_text(txt)
-        if qas:
-            os.makedirs(RAG_DIR, exist_ok=True)
-            with open(SOP_JSON_PATH, "w", encoding="utf-8") as f:
-                json.dump(qas, f, ensure_ascii=False, indent=2)
-            rebuild_rag()
-            load_rag()
-            log.info(f"[Startup] Loaded {len(qas)} SOP QAs")
+
+
+# ----------------- Startup Warm-up -----------------
+def refresh_sop_json() -> int:
+    """Fetch the published SOP doc and rewrite sop_data.json; returns Q/A count."""
+    qas = parse_qas_from_text(fetch_sop_doc_text())
+    if qas:
+        os.makedirs(RAG_DIR, exist_ok=True)
+        with open(SOP_JSON_PATH, "w", encoding="utf-8") as f:
+            json.dump(qas, f, ensure_ascii=False, indent=2)
+    return len(qas)
+
+def load_local_state():
+    """Load the on-disk index builds and warranty snapshot; the app can serve after this."""
+    WARMUP.run_stage("load_index", load_rag)
+    WARMUP.run_stage("load_warranty_snapshot", load_warranty_snapshot)
+    WARMUP.mark_ready()
+
+def preload():
+    """
+    gunicorn --preload hook (see gunicorn.conf.py): load shared read-only
+    state once in the master so forked workers share it copy-on-write.
+    """
+    load_local_state()
+
+def _refresh_sop_index():
+    ok, count = WARMUP.run_stage("fetch_sop", refresh_sop_json)
+    if ok and count:
+        with _BUILD_LOCK:
+            ok, stats = WARMUP.run_stage("rebuild_index", rebuild_rag)
+            if ok:
+                WARMUP.run_stage("reload_index", load_rag)
+                log.info(f"[Startup] Loaded {count} SOP QAs "
+                         f"(vectors reused={stats['reused']} computed={stats['computed']})")
+
+def warm_up():
+    """Serve from the last on-disk index first, then refresh sources in the background."""
+    if not WARMUP.ready:
+        load_local_state()
     else:
-        load_rag()
-    fetch_warranty_all()
-except Exception as e:
-    log.error(f"[Startup] Error: {e}")
+        # Preloaded in the master; catch up on anything published since it forked us
+        STATE_WATCHER.poll()
+    # Embedding models load per worker: their runtimes' thread pools don't survive fork
+    WARMUP.run_stage("load_embedder", lambda: [e.embedder for e in (rag_sop, rag_web) if e])
+    # Source refreshes run in one worker per boot; the others reload its results via STATE_WATCHER
+    if SOP_DOC_URL:
+        run_once("sop_refresh", _refresh_sop_index, since=_BOOT_TIME)
+    run_once("warranty_fetch", lambda: WARMUP.run_stage("fetch_warranty", fetch_warranty_all), since=_BOOT_TIME)
+
+STATE_WATCHER.watch("rag_index", rag_stale, load_rag)
+STATE_WATCHER.watch("warranty", warranty_snapshot_stale, load_warranty_snapshot)
+
 # ----------------- Scheduler -----------------
 @app.on_event("startup")
-def startup_event():
+async def startup_event():
     log.info("[Kai] sessions.db initialized")
+    WARMUP.start(warm_up)
+    if WORKERS > 1:
+        EVENTS.start()
+        STATE_WATCHER.start()
+    await WA_SENDER.start()
+    await start_llm()
+    if WEBHOOK_MODE == "queue":
+        await webhook_queue.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    EVENTS.close()
+    STATE_WATCHER.stop()
+    if WEBHOOK_MODE == "queue":
+        await webhook_queue.drain(timeout=WEBHOOK_DRAIN_SECONDS)
+    await TYPING.drain()
+    await WA_SENDER.drain()
+    await close_llm()
 
 @repeat_every(seconds=86400)
 def auto_refresh():
@@ -208,99 +278,123 @@ async def admin_reset_memory(request: Request):
     user_id = request.query_params.get("user_id") or (await request.form()).get("user_id")
     if token != ADMIN_TOKEN:
         return PlainTextResponse("Forbidden", 403)
-    reset_memory(user_id)
+    await run_in_threadpool(reset_memory, user_id)
     log.info(f"[ADMIN] Memory reset for {user_id or 'ALL'}")
     return PlainTextResponse("Memory reset completed")
 
 
-# ----------------- Agent Dashboard API -----------------
-AGENT_TOKENS = {}
-for pair in os.getenv("AGENT_TOKENS", "").split(","):
-    if ":" in pair:
-        token, name = pair.split(":", 1)
-        AGENT_TOKENS[token.strip()] = name.strip()
+@app.get("/admin/stats")
+async def admin_stats(token: str = Query("")):
+    if token != ADMIN_TOKEN:
+        return PlainTextResponse("Forbidden", 403)
+    return {
+        "webhook_mode": WEBHOOK_MODE,
+        "queue": webhook_queue.stats(),
+        "whatsapp_sender": WA_SENDER.stats(),
+        "agent_typing": TYPING.stats(),
+        "sessions": SESSION_STORE.stats(),
+        "rag_query_cache": QUERY_CACHE.stats(),
+        "retrieval": RETRIEVAL_STATS.snapshot(),
+        "car_compat": CAR_COMPAT.stats(),
+        "intents": INTENT_ROUTER.stats(),
+        "events": EVENTS.stats(),
+        "stream_tickets": STREAM_TICKETS.stats(),
+        "answer_cache": ANSWER_CACHE.stats(),
+        "llm": llm_stats(),
+        "translation": TRANSLATOR.stats(),
+        "prompt": PROMPT_STATS.snapshot(),
+        "warranty": warranty_stats(),
+        "lang_detect": lang_detect_stats(),
+        "warmup": WARMUP.snapshot(),
+        "workers": {"configured": WORKERS, "state_sync": STATE_WATCHER.stats()},
+    }
 
-def verify_agent_token(token: str) -> str | None:
-    return AGENT_TOKENS.get(token)
 
-def list_sessions():
-    """Return all valid sessions, cleaning corrupted ones automatically."""
-    db_path = "/app/data/sessions.db"
-    rows = []
-    try:
-        if not os.path.exists(db_path):
-            print(f"[WARN] Database not found: {db_path}", flush=True)
-            return []
+# ----------------- Admin Reindex -----------------
+REINDEX_JOB: dict = {"state": "idle"}
+# The job runs in whichever worker took the POST; status polls may land on another
+REINDEX_JOB_PATH = os.path.join(LOCK_DIR, "reindex_job.json")
 
-        conn = sqlite3.connect(db_path)
-        cur = conn.cursor()
-        cur.execute("SELECT user_id, data FROM sessions")
-        all_sessions = cur.fetchall()
+def _save_job(job: dict):
+    tmp = f"{REINDEX_JOB_PATH}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(job, f)
+    os.replace(tmp, REINDEX_JOB_PATH)
 
-        for user_id, data in all_sessions:
-            try:
-                sess = json.loads(data)
-                hist = sess.get("history", [])
-                last = hist[-1]["text"] if hist else ""
-
-                #  Safe timestamp fallback
-                last_time = (
-                    hist[-1].get("time")
-                    if hist and isinstance(hist[-1], dict)
-                    else datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                )
-
-                #  Append valid session
-                rows.append({
-                    "user_id": user_id,
-                    "name": sess.get("name", user_id),
-                    "profile_pic": sess.get("profile_pic", ""),
-                    "lastMessage": last,
-                    "lastMessageTime": last_time,
-                    "frozen": sess.get("frozen", False),
-                    "lang": sess.get("lang", "EN")
-                })
+def _load_job() -> dict:
+    try:
+        with open(REINDEX_JOB_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return REINDEX_JOB
+
+def _run_reindex(job: dict):
+    def progress(stage: str):
+        job["stage"] = stage
+        _save_job(job)
+        log.info(f"[Reindex] {job['id']} → {stage}")
+    try:
+        if SOP_DOC_URL:
+            progress("fetch_sop")
+            job["qas"] = refresh_sop_json()
+        progress("build")
+        job["stats"] = rebuild_rag(progress=progress)
+        progress("reload")
+        load_rag()
+        job["state"] = "done"
+    except (Exception, SystemExit) as e:
+        job["state"] = "failed"
+        job["error"] = str(e)
+        log.error(f"[Reindex] {job['id']} failed: {e}")
+    finally:
+        job["finished_at"] = datetime.now().isoformat(timespec="seconds")
+        _save_job(job)
+        _BUILD_LOCK.release()
+
+@app.post("/admin/reindex")
+async def admin_reindex(token: str = Query("")):
+    """Start an index rebuild in the background; poll GET /admin/reindex for progress."""
+    global REINDEX_JOB
+    if token != ADMIN_TOKEN:
+        return PlainTextResponse("Forbidden", 403)
+    if not _BUILD_LOCK.acquire(blocking=False):
+        return JSONResponse({"error": "reindex already running", "job": _load_job()}, status_code=409)
+    REINDEX_JOB = {
+        "id": datetime.now().strftime("%Y%m%d-%H%M%S"),
+        "state": "running",
+        "stage": "queued",
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+    }
+    _save_job(REINDEX_JOB)
+    threading.Thread(target=_run_reindex, args=(REINDEX_JOB,), name="kai-reindex", daemon=True).start()
+    return JSONResponse(REINDEX_JOB, status_code=202)
 
-            except Exception as e:
-                print(f"[CLEANUP] Removing corrupted session {user_id}: {e}", flush=True)
-                try:
-                    cur.execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
-                    conn.commit()
-                except Exception as db_err:
-                    print(f"[CLEANUP ERROR] Failed to delete {user_id}: {db_err}", flush=True)
-                continue
+@app.get("/admin/reindex")
+async def admin_reindex_status(token: str = Query("")):
+    if token != ADMIN_TOKEN:
+        return PlainTextResponse("Forbidden", 403)
+    return {
+        "job": _load_job(),
+        "sop_version": rag_sop.version if rag_sop else None,
+        "web_version": rag_web.version if rag_web else None,
+    }
 
-        conn.close()
 
-    except Exception as e:
-        print(f"[ERROR] list_sessions failed: {e}", flush=True)
+@app.get("/ready")
+async def readiness():
+    """503 until the on-disk index is loaded; includes per-stage boot timings."""
+    return JSONResponse(WARMUP.snapshot(), status_code=200 if WARMUP.ready else 503)
 
-    return rows
 
+# ----------------- Agent Dashboard API -----------------
+AGENT_TOKENS = {}
+for pair in os.getenv("AGENT_TOKENS", "").split(","):
+    if ":" in pair:
+        token, name = pair.split(":", 1)
+        AGENT_TOKENS[token.strip()] = name.strip()
 
-def get_chat_history(user_id: str):
-    db_path = "/app/data/sessions.db"
-    if not os.path.exists(db_path):
-        log.error(f"[get_chat_history] DB not found at {db_path}")
-        return []
-
-    try:
-        conn = sqlite3.connect(db_path)
-        cur = conn.cursor()
-        cur.execute("SELECT data FROM sessions WHERE user_id=?", (user_id,))
-        row = cur.fetchone()
-        conn.close()
-        if not row:
-            return []
-        sess = json.loads(row[0])
-        hist = sess.get("history", [])
-        return [
-            {"sender": h.get("role", "bot"), "content": h.get("text", "")}
-            for h in hist
-        ]
-    except Exception as e:
-        log.error(f"[get_chat_history] Error for {user_id}: {e}")
-        return []
+def verify_agent_token(token: str) -> str | None:
+    return AGENT_TOKENS.get(token)
 
 @app.get("/api/agent/me")
 async def get_agent_me(authorization: str = Header("")):
@@ -310,19 +404,94 @@ async def get_agent_me(authorization: str = Header("")):
         return JSONResponse({"error": "unauthorized"}, status_code=401)
     return {"name": name}
 
+async def _etag_json(request: Request, version, params: tuple, build):
+    """
+    Serve `build()` with a weak ETag derived from a cheap `version()` stamp;
+    a matching If-None-Match gets an empty 304 without running the query.
+    Both run on the threadpool: SQLite can block on another worker's write.
+    """
+    stamp = await run_in_threadpool(version)
+    etag = 'W/"' + hashlib.sha1(repr((stamp, params)).encode()).hexdigest()[:20] + '"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    sent = request.headers.get("if-none-match", "")
+    if etag in (t.strip() for t in sent.split(",")):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(await run_in_threadpool(build), headers=headers)
+
 @app.get("/api/chats")
-async def get_chats(authorization: str = Header("")):
+async def get_chats(request: Request, authorization: str = Header(""), limit: int = 50,
+                    cursor: str | None = None, since: str | None = None):
     token = authorization.replace("Bearer ", "").strip()
     if not verify_agent_token(token):
         return JSONResponse({"error": "unauthorized"}, status_code=401)
-    return list_sessions()
+    try:
+        return await _etag_json(request, sessions_version, ("chats", limit, cursor, since),
+                          lambda: list_sessions_page(limit=limit, cursor=cursor, since=since))
+    except ValueError:
+        return JSONResponse({"error": "bad cursor"}, status_code=400)
 
 @app.get("/api/chat/{user_id}")
-async def get_chat(user_id: str, authorization: str = Header("")):
+async def get_chat(user_id: str, request: Request, authorization: str = Header(""), limit: int = 50,
+                   after_id: int | None = None, before_id: int | None = None):
     token = authorization.replace("Bearer ", "").strip()
     if not verify_agent_token(token):
         return JSONResponse({"error": "unauthorized"}, status_code=401)
-    return get_chat_history(user_id)
+    return await _etag_json(request, lambda: chat_version(user_id), ("chat", user_id, limit, after_id, before_id),
+                      lambda: get_chat_page(user_id, after_id=after_id, before_id=before_id, limit=limit))
+
+@app.post("/api/events/ticket")
+async def agent_events_ticket(authorization: str = Header("")):
+    """Single-use ticket for opening /api/events, which EventSource can't send headers to."""
+    agent = verify_agent_token(authorization.replace("Bearer ", "").strip())
+    if not agent:
+        return JSONResponse({"error": "unauthorized"}, status_code=401)
+    return {"ticket": await run_in_threadpool(STREAM_TICKETS.issue, agent), "expires_in": STREAM_TICKETS.ttl}
+
+@app.get("/api/events")
+async def agent_events(request: Request, ticket: str = Query(""), authorization: str = Header(""),
+                       last_event_id: str = Header("")):
+    """
+    Server-sent dashboard events, opened with ?ticket= from
+    POST /api/events/ticket (or a Bearer header for non-browser clients);
+    the agent token itself never goes in the URL. Resume point is the
+    Last-Event-ID header, or ?last_event_id= for a fresh EventSource.
+    """
+    if ticket:
+        agent = await run_in_threadpool(STREAM_TICKETS.redeem, ticket)
+    else:
+        agent = verify_agent_token(authorization.replace("Bearer ", "").strip())
+    if not agent:
+        return JSONResponse({"error": "unauthorized"}, status_code=401)
+    resume = last_event_id or request.query_params.get("last_event_id", "")
+    resume = int(resume) if resume.isdigit() else None
+
+    async def stream():
+        q, backlog = EVENTS.subscribe(resume)
+        sent = 0
+        try:
+            yield "retry: 3000\n\n"
+            for event in backlog:
+                sent = event[0]
+                yield format_sse(event)
+            while True:
+                try:
+                    event = await asyncio.wait_for(q.get(), EVENT_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": ping\n\n"
+                    continue
+                if event is None:
+                    break
+                if event[1] != "reset" and event[0] <= sent:
+                    continue  # already replayed from the backlog
+                sent = event[0]
+                yield format_sse(event)
+        finally:
+            EVENTS.unsubscribe(q)
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @app.post("/api/send_message")
 async def send_agent_message(request: Request, authorization: str = Header("")):
@@ -341,24 +510,15 @@ async def send_agent_message(request: Request, authorization: str = Header("")):
 
         log.info(f"[AgentAPI] Live Agent sending to {user_id}: {content}")
 
-        # Typing indicator simulation
-        try:
-            from time import sleep
-            send_whatsapp_typing(user_id, True)
-            sleep(1.2)
-            send_whatsapp_typing(user_id, False)
-        except Exception as e:
-            log.warning(f"[AgentAPI] Typing indicator failed: {e}")
-
         # Save message into session log
         timestamp = datetime.now().strftime("%H:%M")
-        add_message_to_history(user_id, "agent", f"[{timestamp}] {content}")
+        await run_in_threadpool(add_message_to_history, user_id, "agent", f"[{timestamp}] {content}")
 
-        # ✅ Send via real WhatsApp API
-        send_whatsapp_message(user_id, f"Live Agent ({agent}): {content}")
+        # Typing indicator, pause and the message itself run as a background task
+        TYPING.schedule(user_id, f"Live Agent ({agent}): {content}")
 
-        log.info(f"[LiveAgent] Message delivered → {user_id}")
-        return {"status": "sent"}
+        log.info(f"[LiveAgent] Message queued → {user_id}")
+        return {"status": "queued"}
 
     except Exception as e:
         log.error(f"[AgentAPI] send_message failed: {e}", exc_info=True)
@@ -378,7 +538,7 @@ async def freeze_chat(request: Request, authorization: str = Header("")):
         return JSONResponse({"error": "missing user_id"}, status_code=400)
 
     try:
-        freeze(user_id, True, mode="agent")
+        await run_in_threadpool(freeze, user_id, True, mode="agent")
         log.info(f"[AgentAPI] Chat frozen by {agent} for user {user_id}")
         send_whatsapp_message(user_id, "A live agent has taken over this chat.")
         return {"status": "frozen"}
@@ -400,7 +560,7 @@ async def unfreeze_chat(request: Request, authorization: str = Header("")):
         return JSONResponse({"error": "missing user_id"}, status_code=400)
 
     try:
-        freeze(user_id, False, mode="agent")
+        await run_in_threadpool(freeze, user_id, False, mode="agent")
         log.info(f"[AgentAPI] Chat resumed to bot by {agent} for user {user_id}")
         send_whatsapp_message(user_id, "Bot resumed. How can I help?")
         return {"status": "unfrozen"}
@@ -412,38 +572,49 @@ async def unfreeze_chat(request: Request, authorization: str = Header("")):
 # ----------------- WhatsApp Typing Indicator -----------------
 def send_whatsapp_typing(to: str, is_agent: bool = False):
     """Send a WhatsApp typing/on/off state (simulated via 'action' message type)."""
-    url = f"https://graph.facebook.com/v17.0/{os.getenv('META_PHONE_NUMBER_ID')}/messages"
-    headers = {
-        "Authorization": f"Bearer {os.getenv('META_PERMANENT_TOKEN','')}",
-        "Content-Type": "application/json"
-    }
+    WA_SENDER.send_typing(to, is_agent)
 
-    payload = {
-        "messaging_product": "whatsapp",
-        "to": to,
-        "type": "action",
-        "action": {"typing": "on" if is_agent else "off"}
-    }
-
-    try:
-        r = requests.post(url, headers=headers, json=payload, timeout=5)
-        if r.status_code >= 400:
-            log.warning(f"[Kai] Typing indicator failed {r.status_code}: {r.text}")
-    except Exception as e:
-        log.warning(f"[Kai] Typing indicator error: {e}")
-        
 
 # ----------------- Webhook -----------------
+def _webhook_value(data: dict) -> dict:
+    return data.get("entry", [{}])[0].get("changes", [{}])[0].get("value", {})
+
+def _webhook_message(data: dict) -> dict:
+    return (_webhook_value(data).get("messages") or [{}])[0]
+
 @app.post("/webhook")
 async def webhook(request: Request):
     try:
         data = await request.json()
-        value = data.get("entry", [{}])[0].get("changes", [{}])[0].get("value", {})
-        msg = value.get("messages", [{}])[0]
-        if not msg:
-            return JSONResponse({"status": "no_message"})
+        msg = _webhook_message(data)
+    except Exception as e:
+        log.warning(f"[Kai] Bad webhook payload: {e}")
+        return JSONResponse({"status": "bad_payload"}, status_code=400)
+    if not msg:
+        return JSONResponse({"status": "no_message"})
+
+    if WEBHOOK_MODE == "queue":
+        if not webhook_queue.submit(msg.get("from", ""), data):
+            log.warning(f"[Queue] Rejected message from {msg.get('from')}; depth={webhook_queue.depth()}")
+            return JSONResponse({"status": "busy"}, status_code=503)
+        return JSONResponse({"status": "queued"})
+
+    return JSONResponse(await run_in_threadpool(process_webhook, data))
 
-        wa_from = msg.get("from")
+
+def process_webhook(data: dict) -> dict:
+    """Run the full message pipeline for one webhook payload (blocking)."""
+    msg = _webhook_message(data)
+    wa_from = msg.get("from")
+    if not wa_from:
+        return {"status": "no_message"}
+    # One session read and one session write for the whole message
+    with session_unit(wa_from):
+        return _handle_message(_webhook_value(data), msg, wa_from)
+
+
+def _handle_message(value: dict, msg: dict, wa_from: str) -> dict:
+    try:
         body = msg.get("text", {}).get("body", "").strip()
         msg_type = msg.get("type", "text")
 
@@ -456,33 +627,28 @@ async def webhook(request: Request):
         else:
             user_name, profile_pic = "Unknown", ""
 
-        # --- Update session safely ---
-        try:
-            sess = get_session(wa_from)
-            sess["name"] = user_name
-            sess["profile_pic"] = profile_pic
-            from session_state import set_session
-            set_session(wa_from, sess)
-        except Exception as e:
-            log.warning(f"[Kai] Could not save profile info for {wa_from}: {e}")
+        # --- Update session (flushed once when the unit of work closes) ---
+        sess = get_session(wa_from)
+        sess["name"] = user_name
+        sess["profile_pic"] = profile_pic
 
         # --- Handle media ---
         if handle_incoming_media(msg, wa_from, add_message_to_history):
-            return JSONResponse({"status": "media_received"})
+            return {"status": "media_received"}
         if not body:
-            return JSONResponse({"status": "empty"})
+            return {"status": "empty"}
 
         log.info(f"[Kai] IN from={wa_from} type={msg_type} text={body}")
-        lower = norm(body)
+        # One regex pass classifies the message; intents come highest priority first
+        intents = INTENT_ROUTER.route(body)
 
-        sess = get_session(wa_from)
         lang = "BM" if is_malay(body) else "EN"
         set_lang(wa_from, lang)
         aft = not is_office_hours()
         add_message_to_history(wa_from, "user", body)
 
         # --- Auto-freeze trigger when user types "LA" or "live agent" ---
-        if lower in {"la", "live agent", "agent", "human"}:
+        if "live_agent" in intents:
             try:
                 freeze(wa_from, True, mode="user")
                 msg_out = (
@@ -492,12 +658,12 @@ async def webhook(request: Request):
                 )
                 send_whatsapp_message(wa_from, add_footer(msg_out, lang))
                 add_message_to_history(wa_from, "bot", msg_out)
-                return JSONResponse({"status": "frozen_by_user"})
+                return {"status": "frozen_by_user"}
             except Exception as e:
                 log.error(f"[Kai] Failed to auto-freeze on LA: {e}")
 
         # --- Greeting ---
-        if not sess.get("greeted") and has_any(["hi","hello","hai","helo","start","menu"], lower):
+        if not sess.get("greeted") and "greeting" in intents:
             msg_out = ("Hi! I'm Kai – Kommu Chatbot. This chat is handled by a chatbot (beta)."
                        if lang=="EN" else
                        "Hai! Saya Kai – Chatbot Kommu. Perbualan ini dikendalikan oleh chatbot (beta).")
@@ -505,58 +671,69 @@ async def webhook(request: Request):
             sess["greeted"] = True
             send_whatsapp_message(wa_from, add_footer(msg_out, lang))
             add_message_to_history(wa_from, "bot", msg_out)
-            return JSONResponse({"status": "greeted"})
+            return {"status": "greeted"}
 
         # --- Live Agent Handling ---
         if sess.get("frozen"):
-            if lower in {"resume","unfreeze","sambung"}:
+            if "resume" in intents:
                 freeze(wa_from, False, mode="user")
                 msg_out = "Bot resumed. How can I help?" if lang=="EN" else "Bot disambung semula. Ada apa saya boleh bantu?"
                 send_whatsapp_message(wa_from, add_footer(msg_out, lang))
-                return JSONResponse({"status": "resumed"})
+                return {"status": "resumed"}
             msg_out = ("A live agent will assist you soon. Type *resume* to continue with the bot."
                        if lang=="EN" else
                        "Ejen manusia akan membantu anda. Taip *resume* untuk teruskan.")
             send_whatsapp_message(wa_from, add_footer(msg_out, lang))
-            return JSONResponse({"status": "frozen"})
+            return {"status": "frozen"}
 
         # --- Warranty Lookup ---
-        if 6 <= len(body) <= 20:
-            row = warranty_lookup_by_dongle(body)
-            if row:
-                msg_out = (f"Warranty status: {warranty_text_from_row(row)}"
-                           if lang=="EN" else
-                           f"Status waranti: {warranty_text_from_row(row)}")
-                if aft: msg_out += after_hours_suffix(lang)
-                send_whatsapp_message(wa_from, add_footer(msg_out, lang))
-                return JSONResponse({"status": "warranty"})
+        match = warranty_find_dongle(body)
+        if match:
+            row, dongle_id, edits = match
+            msg_out = (f"Warranty status: {warranty_text_from_row(row)}"
+                       if lang=="EN" else
+                       f"Status waranti: {warranty_text_from_row(row)}")
+            if edits:
+                msg_out += (f"\n(Closest match: Dongle ID {dongle_id})"
+                            if lang=="EN" else
+                            f"\n(Padanan terdekat: Dongle ID {dongle_id})")
+            if aft: msg_out += after_hours_suffix(lang)
+            send_whatsapp_message(wa_from, add_footer(msg_out, lang))
+            return {"status": "warranty"}
+
+        # --- Canned Replies (templates.py) ---
+        intent = next((i for i in intents if i in TEMPLATE_REPLIES or i == "car"), None)
+        if intent in TEMPLATE_REPLIES:
+            msg_out = TEMPLATE_REPLIES[intent](lang)
+            if aft: msg_out += after_hours_suffix(lang)
+            set_last_intent(wa_from, intent)
+            send_whatsapp_message(wa_from, add_footer(msg_out, lang))
+            add_message_to_history(wa_from, "bot", msg_out)
+            return {"status": f"template_{intent}"}
 
         # --- Car Support Logic ---
-        if detect_car_support_query(body):
+        if intent == "car":
+            # Known model with table rows: answer from structured data, no LLM
+            verdict = CAR_COMPAT.check(body)
+            if verdict:
+                msg_out = format_verdict(verdict, lang)
+                send_whatsapp_message(wa_from, add_footer(msg_out, lang))
+                add_message_to_history(wa_from, "bot", msg_out)
+                return {"status": {"year_not_supported": "car_year_not_supported",
+                                   "need_year": "car_ask_year"}.get(verdict["status"], "car_supported_from_table")}
             answer = run_rag_dual(body, lang_hint=lang, user_id=wa_from)
             lower_ans = answer.lower() if answer else ""
-            year_in_text = extract_year(body)
-            sop_years = parse_year_range(answer)
             if any(k in lower_ans for k in CAR_KEYWORDS):
-                if sop_years != (None, None) and year_in_text:
-                    start, end = sop_years
-                    if year_in_text < start or year_in_text > end:
-                        msg_out = (f"Sorry, the {year_in_text} model is not supported. KommuAssist supports {start}–{end} variants only."
-                                   if lang=="EN" else
-                                   f"Maaf, model tahun {year_in_text} tidak disokong. KommuAssist hanya menyokong varian {start}–{end} sahaja.")
-                        send_whatsapp_message(wa_from, add_footer(msg_out, lang))
-                        add_message_to_history(wa_from, "bot", msg_out)
-                        return JSONResponse({"status": "car_year_not_supported"})
                 send_whatsapp_message(wa_from, add_footer(answer, lang))
                 add_message_to_history(wa_from, "bot", answer)
-                return JSONResponse({"status": "car_supported_from_sop"})
+                return {"status": "car_supported_from_sop"}
             msg_out = ("I'm not sure about that car. Does it have Adaptive Cruise Control (ACC) and Lane Keep Assist (LKA)?"
                        if lang=="EN" else
                        "Saya tidak pasti tentang kereta itu. Adakah ia mempunyai sistem Adaptive Cruise Control (ACC) dan Lane Keep Assist (LKA)?")
             set_last_intent(wa_from, "car_unknown")
             send_whatsapp_message(wa_from, add_footer(msg_out, lang))
             add_message_to_history(wa_from, "bot", msg_out)
-            return JSONResponse({"status": "car_unknown"})
+            return {"status": "car_unknown"}
 
         # --- Fallback RAG ---
         answer = run_rag_dual(body, lang_hint=lang, user_id=wa_from)
@@ -564,16 +741,14 @@ async def webhook(request: Request):
             if aft: answer += after_hours_suffix(lang)
             send_whatsapp_message(wa_from, add_footer(answer, lang))
             add_message_to_history(wa_from, "bot", answer)
-            return JSONResponse({"status": "answered"})
+            return {"status": "answered"}
 
         # --- Default fallback ---
-        msg_out = ("I can help with pricing, installation, office hours, warranty, and test drives."
-                   if lang=="EN" else
-                   "Saya boleh bantu dengan harga, pemasangan, waktu pejabat, waranti, dan pandu uji.")
+        msg_out = FALLBACK_EN if lang=="EN" else FALLBACK_BM
         if aft: msg_out += after_hours_suffix(lang)
         send_whatsapp_message(wa_from, add_footer(msg_out, lang))
         add_message_to_history(wa_from, "bot", msg_out)
-        return JSONResponse({"status": "fallback"})
+        return {"status": "fallback"}
 
     except Exception as e:
         log.error(f"[Kai] ERR webhook: {e}\n{traceback.format_exc()}")
@@ -581,4 +756,8 @@ async def webhook(request: Request):
             send_whatsapp_message(wa_from, "Sorry, I encountered an issue. Please try again.")
         except Exception:
             pass
-        return JSONResponse({"status": "error", "error": str(e)})
+        return {"status": "error", "error": str(e)}
+
+
+# ----------------- Webhook Queue -----------------
+webhook_queue = WebhookQueue(process_webhook, maxsize=WEBHOOK_QUEUE_SIZE, workers=WEBHOOK_WORKERS)
@@ -0,0 +1,303 @@
+import os, re, json, threading, logging
+
+log = logging.getLogger("kai")
+
+COMPAT_FILE = "compat.json"
+SUPPORT_URL = "https://kommu.ai/support/"
+# Curated support list (the rows behind SUPPORT_URL), maintained by the team:
+# [{"model": "Myvi", "trim": "AV", "year_from": 2022, "year_to": null,
+#   "requires": ["ACC", "LKAS"]}, ...]   year_to null = still in production
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+COMPAT_SOURCE_PATH = os.getenv("CAR_COMPAT_PATH", os.path.join(BASE_DIR, "data", "car_compat.json"))
+
+# ----------------- Model Aliases -----------------
+# canonical model -> (make, spellings customers use)
+MODELS = {
+    "Myvi": ("Perodua", ["myvi"]),
+    "Alza": ("Perodua", ["alza"]),
+    "Ativa": ("Perodua", ["ativa"]),
+    "Aruz": ("Perodua", ["aruz"]),
+    "Bezza": ("Perodua", ["bezza"]),
+    "Axia": ("Perodua", ["axia"]),
+    "S70": ("Proton", ["s70", "s 70"]),
+    "X50": ("Proton", ["x50", "x 50"]),
+    "X70": ("Proton", ["x70", "x 70"]),
+    "X90": ("Proton", ["x90", "x 90"]),
+    "City": ("Honda", ["city"]),
+    "Civic": ("Honda", ["civic"]),
+    "Accord": ("Honda", ["accord"]),
+    "HR-V": ("Honda", ["hrv", "hr-v", "hr v"]),
+    "CR-V": ("Honda", ["crv", "cr-v", "cr v"]),
+    "Vios": ("Toyota", ["vios"]),
+    "Veloz": ("Toyota", ["veloz"]),
+    "Yaris": ("Toyota", ["yaris"]),
+    "Corolla Cross": ("Toyota", ["corolla cross", "cross"]),
+    "Camry": ("Toyota", ["camry"]),
+    "Atto 3": ("BYD", ["atto 3", "atto3"]),
+    "Seal": ("BYD", ["seal"]),
+    "Dolphin": ("BYD", ["dolphin"]),
+    "UX": ("Lexus", ["lexus ux", "ux200", "ux 200"]),
+    "NX": ("Lexus", ["lexus nx", "nx200", "nx 200"]),
+}
+
+
+def _alias_key(s: str) -> str:
+    return re.sub(r"[\s\-]+", "", s.lower())
+
+
+_ALIASES = {_alias_key(a): model for model, (_, aliases) in MODELS.items() for a in aliases}
+_CANONICAL = {_alias_key(model): model for model in MODELS}
+# Longest spellings first so "corolla cross" wins over "cross"
+MODEL_ALIAS_PATTERN = "|".join(
+    r"[\s\-]?".join(map(re.escape, a.replace("-", " ").split()))
+    for a in sorted({a for _, aliases in MODELS.values() for a in aliases}, key=len, reverse=True)
+)
+_ALIAS_RE = re.compile(rf"\b({MODEL_ALIAS_PATTERN})\b", re.I)
+# Spellings that are everyday words ("which city are you in?") only count
+# with the make or a year within a few words
+_AMBIGUOUS = {"city", "cross", "seal", "accord"}
+_NEARBY = 24
+
+
+def match_model(text: str) -> str | None:
+    """Canonical model name for the first car model mentioned in `text`."""
+    text = text or ""
+    for m in _ALIAS_RE.finditer(text):
+        model = _ALIASES.get(_alias_key(m.group(1)))
+        if model and _alias_key(m.group(1)) in _AMBIGUOUS:
+            near = text[max(0, m.start() - _NEARBY):m.end() + _NEARBY]
+            if not (re.search(rf"\b{MODELS[model][0]}\b", near, re.I) or extract_year(near)):
+                continue
+        if model:
+            return model
+    return None
+
+
+def extract_year(text: str) -> int | None:
+    m = re.search(r"\b(19|20)\d{2}\b", text or "")
+    return int(m.group()) if m else None
+
+
+# ----------------- Extraction -----------------
+# "<model> [trim] 2018–2024", "(2019 - present)", "2020 onwards", "2018 ke atas"
+_OPEN_END = r"present|now|current|onwards?|kini|terkini|\+|and above|ke atas"
+_ROW_RE = re.compile(
+    rf"\b({MODEL_ALIAS_PATTERN})\b"
+    r"(?P<trim>[\w .+/]{0,24}?)[\s(:,\-]*"
+    r"(?P<start>(?:19|20)\d{2})\s*"
+    r"(?:(?:[–—\-]|to|hingga|sehingga)\s*(?P<end>(?:19|20)\d{2}|" + _OPEN_END + r")|(?P<open>" + _OPEN_END + r"))?",
+    re.I,
+)
+_SEGMENTS = re.compile(r"\n+|(?<=[.;!?])\s+(?=[A-Z])")
+_REQUIRES = (("ACC", re.compile(r"\bacc\b|adaptive cruise", re.I)),
+             ("LKAS", re.compile(r"\blka[s]?\b|\blkc\b|lane keep", re.I)),
+             ("Stop & Go", re.compile(r"stop\s*(?:&|and|-)\s*go", re.I)))
+
+
+# A segment saying a car is *not* supported must never become a "supported" row
+_NEGATION = re.compile(
+    r"\b(not|no|unsupported|isn't|aren't|cannot|can't|unable|tidak|tak|bukan|belum)\b|\bn't\b", re.I
+)
+_NOT_TRIM = re.compile(r"\b(is|are|in|for|from|with|the|model|year|tahun|dari|untuk)\b", re.I)
+
+
+def _clean_trim(raw: str) -> str:
+    trim = re.sub(r"\s+", " ", raw or "").strip(" .,/-")
+    # Only short tokens like "AV", "1.5 Premium", "Flagship" read as trims
+    return trim if trim and len(trim.split()) <= 3 and not _NOT_TRIM.search(trim) else ""
+
+
+def extract_compat(entries) -> list[dict]:
+    """
+    Pull (make, model, trim, year range, requirements) rows out of Q/A
+    text. Only a known model directly followed by a year range counts,
+    so vague mentions never turn into a "supported" answer.
+    """
+    rows, seen = [], set()
+    for e in entries:
+        text = f"{e.get('question', '')}\n{e.get('answer', '')}"
+        for seg in _SEGMENTS.split(text):
+            if _NEGATION.search(seg):
+                continue
+            for m in _ROW_RE.finditer(seg):
+                model = _ALIASES.get(_alias_key(m.group(1)))
+                start = int(m.group("start"))
+                end = m.group("end")
+                if not (end or m.group("open")):
+                    continue  # a lone year ("the Myvi in 2023") says nothing about support
+                end = int(end) if end and end[0].isdigit() else None
+                if model is None or (end is not None and end < start):
+                    continue
+                trim = _clean_trim(m.group("trim"))
+                key = (model, trim.lower(), start, end)
+                if key in seen:
+                    continue
+                seen.add(key)
+                rows.append({
+                    "make": MODELS[model][0], "model": model, "trim": trim,
+                    "year_from": start, "year_to": end,
+                    "requires": [name for name, rx in _REQUIRES if rx.search(seg)],
+                    "source": e.get("source", "SOP"),
+                })
+    return rows
+
+
+def save_compat(index_dir: str, entries) -> int:
+    rows = extract_compat(entries)
+    tmp = os.path.join(index_dir, COMPAT_FILE + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(rows, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, os.path.join(index_dir, COMPAT_FILE))
+    return len(rows)
+
+
+def load_compat(index_dir: str, meta=None) -> list[dict]:
+    """Rows written with the build; older builds get them extracted from their metadata."""
+    path = os.path.join(index_dir, COMPAT_FILE)
+    if os.path.exists(path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            log.warning(f"[Compat] Ignoring unreadable {path}: {e}")
+    if meta is None:
+        return []
+    return extract_compat(item for _, item in meta.iter_all())
+
+
+def load_compat_source(path: str = COMPAT_SOURCE_PATH) -> list[dict]:
+    """Rows from the curated support list; unknown models and bad rows are skipped with a warning."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            raw = json.load(f)
+    except FileNotFoundError:
+        return []
+    except Exception as e:
+        log.warning(f"[Compat] Ignoring unreadable {path}: {e}")
+        return []
+    rows = []
+    for r in raw:
+        # Names here are deliberate, so any known spelling counts (even "city" alone)
+        name = _alias_key(str(r.get("model", ""))) if isinstance(r, dict) else ""
+        model = _ALIASES.get(name) or _CANONICAL.get(name)
+        try:
+            start = int(r["year_from"])
+            end = int(r["year_to"]) if r.get("year_to") is not None else None
+        except (KeyError, TypeError, ValueError):
+            model = None
+        if model is None:
+            log.warning(f"[Compat] Skipping row in {path}: {r!r}")
+            continue
+        rows.append({
+            "make": MODELS[model][0], "model": model, "trim": r.get("trim") or "",
+            "year_from": start, "year_to": end,
+            "requires": list(r.get("requires") or []),
+            "source": "compat_list",
+        })
+    return rows
+
+
+# ----------------- Lookup -----------------
+def _years(row: dict) -> str:
+    return f"{row['year_from']}–{row['year_to'] or 'present'}" if row["year_to"] != row["year_from"] else str(row["year_from"])
+
+
+def _describe(row: dict) -> str:
+    name = f"{row['make']} {row['model']}" + (f" {row['trim']}" if row["trim"] else "")
+    return f"{name} ({_years(row)})"
+
+
+class CompatTable:
+    """Car support rows from the live index builds, keyed by canonical model."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.by_model: dict[str, list] = {}
+        self.sources: dict[str, int] = {}
+        self.answered = 0
+        self.year_rejected = 0
+        self.asked_year = 0
+        self.deferred = 0
+
+    def install(self, sources: dict):
+        """Swap in rows from {source label: rows}; logs how many each source gave."""
+        by_model = {}
+        for rows in sources.values():
+            for r in rows:
+                by_model.setdefault(r["model"], []).append(r)
+        for rows in by_model.values():
+            rows.sort(key=lambda r: (r["year_from"], r["trim"]))
+        with self._lock:
+            self.by_model = by_model
+            self.sources = {label: len(rows) for label, rows in sources.items()}
+        total = sum(map(len, by_model.values()))
+        counts = ", ".join(f"{label}={n}" for label, n in self.sources.items())
+        if total:
+            log.info(f"[Compat] {total} rows for {len(by_model)} models ({counts})")
+        else:
+            log.warning(f"[Compat] No compatibility rows ({counts}); add {COMPAT_SOURCE_PATH} "
+                        f"to answer support questions without the LLM")
+
+    def check(self, text: str) -> dict | None:
+        """
+        Structured verdict for a support question, or None when the table
+        can't tell (unknown model, no rows) and the LLM should answer.
+        """
+        model = match_model(text)
+        rows = self.by_model.get(model) if model else None
+        if not rows:
+            self.deferred += 1
+            return None
+        year = extract_year(text)
+        if year is None:
+            # Support depends on the year (and often trim): ask instead of saying yes
+            self.asked_year += 1
+            return {"status": "need_year", "model": model, "year": None, "rows": rows}
+        fits = [r for r in rows if r["year_from"] <= year <= (r["year_to"] or 9999)]
+        if fits:
+            self.answered += 1
+            return {"status": "supported", "model": model, "year": year, "rows": fits}
+        self.year_rejected += 1
+        return {"status": "year_not_supported", "model": model, "year": year, "rows": rows}
+
+    def stats(self) -> dict:
+        return {
+            "models": len(self.by_model),
+            "rows": sum(map(len, self.by_model.values())),
+            "sources": dict(self.sources),
+            "answered": self.answered,
+            "year_rejected": self.year_rejected,
+            "asked_year": self.asked_year,
+            "deferred_to_llm": self.deferred,
+        }
+
+
+def format_verdict(verdict: dict, lang: str = "EN") -> str:
+    rows = verdict["rows"]
+    listed = "; ".join(_describe(r) for r in rows)
+    requires = sorted({req for r in rows for req in r["requires"]})
+    if verdict["status"] == "year_not_supported":
+        spans = ", ".join(_years(r) for r in rows)
+        if lang == "BM":
+            return (f"Maaf, model tahun {verdict['year']} tidak disokong. KommuAssist hanya menyokong varian {spans} sahaja. "
+                    f"Senarai penuh: {SUPPORT_URL}")
+        return (f"Sorry, the {verdict['year']} model is not supported. KommuAssist supports {spans} variants only. "
+                f"Full list: {SUPPORT_URL}")
+    if verdict["status"] == "need_year":
+        if lang == "BM":
+            return (f"Sokongan bergantung pada tahun dan varian. Yang disokong: {listed}. "
+                    f"Boleh kongsi tahun dan varian kereta anda? Senarai penuh: {SUPPORT_URL}")
+        return (f"Support depends on the year and trim. Supported: {listed}. "
+                f"Which year and trim is yours? Full list: {SUPPORT_URL}")
+    if lang == "BM":
+        msg = f"Ya, disokong: {listed}."
+        if requires:
+            msg += f" Memerlukan {' & '.join(requires)}."
+        return msg + f" Senarai penuh: {SUPPORT_URL}"
+    msg = f"Yes, supported: {listed}."
+    if requires:
+        msg += f" Requires {' & '.join(requires)}."
+    return msg + f" Full list: {SUPPORT_URL}"
+
+
+CAR_COMPAT = CompatTable()
@@ -12,6 +12,16 @@ OFFICE_END   = int(os.getenv("OFFICE_END", 18))
 DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY", "")
 DEEPSEEK_BASE_URL = os.getenv("DEEPSEEK_BASE_URL") or os.getenv("DEEPSEEK_API_BASE", "https://api.deepseek.com/v1")
 DEEPSEEK_MODEL = os.getenv("DEEPSEEK_MODEL", "deepseek-chat")
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30"))             # seconds per call
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "1"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "16"))
+LLM_STREAM = os.getenv("LLM_STREAM", "0") in ("1", "true", "yes")  # stream to record time to first token
+
+# Prompt packing (tokens); see /admin/stats "prompt" for the size distribution
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "1800"))
+PROMPT_HISTORY_TOKENS = int(os.getenv("PROMPT_HISTORY_TOKENS", "300"))
+PROMPT_SCORE_GAP = float(os.getenv("PROMPT_SCORE_GAP", "0.15"))    # drop blocks this far below the best hit
+PROMPT_DUP_JACCARD = float(os.getenv("PROMPT_DUP_JACCARD", "0.8"))  # word overlap counted as a duplicate
 
 # Twilio / WhatsApp
 TWILIO_ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID", "")
@@ -24,6 +34,16 @@ def _split_list(name, default=""):
 CS_RECIPIENTS = _split_list("CS_RECIPIENTS")
 AGENT_NUMBERS = set(_split_list("AGENT_NUMBERS"))
 
+# WhatsApp Cloud API (point GRAPH_API_BASE at tools/graph_stub.py for local tests)
+GRAPH_API_BASE = os.getenv("GRAPH_API_BASE", "https://graph.facebook.com/v17.0")
+WA_SEND_RATE = float(os.getenv("WA_SEND_RATE", "20"))       # sustained messages/second
+WA_SEND_BURST = int(os.getenv("WA_SEND_BURST", "40"))
+WA_SEND_RETRIES = int(os.getenv("WA_SEND_RETRIES", "4"))
+WA_SEND_WORKERS = int(os.getenv("WA_SEND_WORKERS", "8"))
+WA_SEND_QUEUE_SIZE = int(os.getenv("WA_SEND_QUEUE_SIZE", "2000"))
+# Typing indicator shown before each live-agent reply
+AGENT_TYPING_SECONDS = float(os.getenv("AGENT_TYPING_SECONDS", "1.2"))
+
 # Admin
 ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "changeme-strong")
 
@@ -37,6 +57,25 @@ BASE_DIR = os.path.dirname(__file__)
 RAG_DIR = os.path.join(BASE_DIR, "rag")
 FAISS_DIR = os.path.join(RAG_DIR, "faiss_index")
 SOP_JSON_PATH = os.path.join(RAG_DIR, "sop_data.json")
+# Content-addressed embedding cache reused across index rebuilds
+EMBED_CACHE_PATH = os.getenv("RAG_EMBED_CACHE_PATH", os.path.join(BASE_DIR, "data", "embed_cache.sqlite"))
+
+# Webhook processing: "inline" handles the message before replying to Meta,
+# "queue" acks at once and processes on background workers
+WEBHOOK_MODE = os.getenv("WEBHOOK_MODE", "inline").lower()
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "4"))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+WEBHOOK_DRAIN_SECONDS = float(os.getenv("WEBHOOK_DRAIN_SECONDS", "30"))
+
+# LLM answer cache (seconds / max rows)
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", str(7 * 86400)))
+ANSWER_CACHE_MAX = int(os.getenv("ANSWER_CACHE_MAX", "5000"))
+
+# Seconds to wait for Google Translate before sending the untranslated answer
+TRANSLATE_TIMEOUT = float(os.getenv("TRANSLATE_TIMEOUT", "8"))
+# Stored translations (seconds / max rows)
+TRANSLATION_CACHE_TTL = int(os.getenv("TRANSLATION_CACHE_TTL", str(30 * 86400)))
+TRANSLATION_CACHE_MAX = int(os.getenv("TRANSLATION_CACHE_MAX", "5000"))
 
 # Optional web search
 BING_API_KEY = os.getenv("BING_API_KEY", "")
@@ -46,3 +85,16 @@ MIN_SUPPORTED_YEAR = 2016
 
 # Memory settings
 MEMORY_DEPTH = 5  
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "512"))
+
+# Dashboard event stream (SSE): events kept for Last-Event-ID resume, keep-alive interval
+EVENT_BUFFER = int(os.getenv("EVENT_BUFFER", "2000"))
+EVENT_HEARTBEAT_SECONDS = float(os.getenv("EVENT_HEARTBEAT_SECONDS", "15"))
+# Lifetime of the single-use ticket that opens a stream (the agent token never goes in the URL)
+EVENT_TICKET_TTL = float(os.getenv("EVENT_TICKET_TTL", "60"))
+
+# Multi-worker deployment (gunicorn.conf.py). WEB_CONCURRENCY is gunicorn's own
+# worker-count variable; with more than one worker, indexes, warranty data and
+# dashboard events are synced between processes
+WORKERS = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+STATE_SYNC_SECONDS = float(os.getenv("STATE_SYNC_SECONDS", "10"))
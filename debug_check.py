@@ -1,6 +1,6 @@
 # debug_check.py  — Kai health/debug tool
 import os, sys, io, csv, re, json
-import requests, faiss, pickle
+import requests, faiss
 from pathlib import Path
 from colorama import init, Fore, Style
 from dotenv import load_dotenv
@@ -30,7 +30,7 @@ except Exception:
     RAGEngine = None
 
 RAG_INDEX = Path(FAISS_DIR) / "index.faiss"
-RAG_META  = Path(FAISS_DIR) / "index.pkl"
+RAG_META  = Path(FAISS_DIR) / "meta.sqlite"
 SOP_JSON  = Path(RAG_DIR)  / "sop_data.json"
 
 init(autoreset=True)
@@ -146,7 +146,7 @@ def main():
     header("RAG / FAISS")
     ok(f"sop_data.json       : {'EXISTS' if Path(SOP_JSON).exists() else 'MISSING'}")
     ok(f"index.faiss         : {'EXISTS' if RAG_INDEX.exists() else 'MISSING'}")
-    ok(f"index.pkl           : {'EXISTS' if RAG_META.exists() else 'MISSING'}")
+    ok(f"meta.sqlite         : {'EXISTS' if RAG_META.exists() else 'MISSING'}")
     if RAG_INDEX.exists():
         try:
             idx = faiss.read_index(str(RAG_INDEX))
@@ -1,23 +1,302 @@
-from openai import OpenAI
-import os
+import asyncio, concurrent.futures, hashlib, json, threading, time
+from collections import deque
 
-_api_key = os.getenv("DEEPSEEK_API_KEY", "")
-_base = os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com/v1")
-_model = os.getenv("DEEPSEEK_MODEL", "deepseek-chat")
+import httpx
+from openai import OpenAI, AsyncOpenAI, APIError, APITimeoutError
 
-_client = OpenAI(api_key=_api_key, base_url=_base)
+from config import (
+    DEEPSEEK_API_KEY, DEEPSEEK_BASE_URL, DEEPSEEK_MODEL,
+    LLM_TIMEOUT, LLM_MAX_RETRIES, LLM_MAX_CONNECTIONS, LLM_STREAM
+)
 
-def chat_completion(system_prompt: str, user_prompt: str) -> str:
+_api_key = DEEPSEEK_API_KEY
+_base = DEEPSEEK_BASE_URL
+_model = DEEPSEEK_MODEL
+
+_TEMPERATURE = 0.3
+_MAX_TOKENS = 450
+
+
+# ----------------- Clients -----------------
+# Built on first use so importing this module never opens connections
+_client: OpenAI | None = None
+_aclient: AsyncOpenAI | None = None
+_aclient_loop = None
+_client_lock = threading.Lock()
+# The app's event loop once start() ran: blocking callers on worker threads
+# then go through the async client there, sharing its pool and in-flight prompts
+_loop: asyncio.AbstractEventLoop | None = None
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_CONNECTIONS,
+                        keepalive_expiry=120)
+
+
+def _get_client() -> OpenAI:
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = OpenAI(api_key=_api_key, base_url=_base, timeout=LLM_TIMEOUT, max_retries=LLM_MAX_RETRIES,
+                             http_client=httpx.Client(limits=_limits()))
+        return _client
+
+
+def _get_aclient() -> AsyncOpenAI:
+    """One pooled async client per event loop (httpx async pools are loop-bound)."""
+    global _aclient, _aclient_loop
+    loop = asyncio.get_running_loop()
+    if _aclient is None or _aclient_loop is not loop:
+        _aclient = AsyncOpenAI(api_key=_api_key, base_url=_base, timeout=LLM_TIMEOUT, max_retries=LLM_MAX_RETRIES,
+                               http_client=httpx.AsyncClient(limits=_limits()))
+        _aclient_loop = loop
+    return _aclient
+
+
+def _messages(system_prompt: str, user_prompt: str) -> list:
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ]
+
+
+def _prompt_key(system_prompt: str, user_prompt: str) -> str:
+    raw = json.dumps([_model, _TEMPERATURE, _MAX_TOKENS, system_prompt, user_prompt])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+# ----------------- Stats -----------------
+class _LLMStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.latency = deque(maxlen=500)
+        self.ttft = deque(maxlen=500)
+
+    def bump(self, name: str):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    @staticmethod
+    def _summary(values) -> dict:
+        vals = sorted(values)
+        if not vals:
+            return {"avg": 0.0, "p95": 0.0, "max": 0.0}
+        p95 = vals[max(0, int(len(vals) * 0.95) - 1)]
+        return {"avg": round(1000 * sum(vals) / len(vals), 1), "p95": round(1000 * p95, 1),
+                "max": round(1000 * vals[-1], 1)}
+
+    def snapshot(self) -> dict:
+        return {
+            "upstream_calls": self.calls,
+            "coalesced": self.coalesced,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "latency_ms": self._summary(self.latency),
+            "ttft_ms": self._summary(self.ttft),
+        }
+
+
+STATS = _LLMStats()
+
+
+def _failed(e: Exception):
+    STATS.bump("timeouts" if isinstance(e, APITimeoutError) else "errors")
+    print(f"[LLM] Request failed: {e}")
+
+
+def stats() -> dict:
+    return STATS.snapshot()
+
+
+# ----------------- Sync -----------------
+def _complete_sync(system_prompt: str, user_prompt: str, timeout: float | None, stream: bool) -> str:
+    STATS.bump("calls")
+    client = _get_client()
+    if timeout:
+        client = client.with_options(timeout=timeout)
+    t0 = time.monotonic()
+    try:
+        if not stream:
+            resp = client.chat.completions.create(
+                model=_model, messages=_messages(system_prompt, user_prompt),
+                temperature=_TEMPERATURE, max_tokens=_MAX_TOKENS,
+            )
+            return (resp.choices[0].message.content or "").strip()
+        parts = []
+        for chunk in client.chat.completions.create(
+            model=_model, messages=_messages(system_prompt, user_prompt),
+            temperature=_TEMPERATURE, max_tokens=_MAX_TOKENS, stream=True,
+        ):
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                if not parts:
+                    STATS.ttft.append(time.monotonic() - t0)
+                parts.append(delta)
+        return "".join(parts).strip()
+    except APIError as e:
+        _failed(e)
+        return ""
+    finally:
+        STATS.latency.append(time.monotonic() - t0)
+
+
+class _Flight:
+    __slots__ = ("done", "result")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = ""
+
+
+_flights: dict[str, _Flight] = {}
+_flights_lock = threading.Lock()
+
+
+def chat_completion(system_prompt: str, user_prompt: str, timeout: float | None = None,
+                    stream: bool = LLM_STREAM) -> str:
+    """
+    Blocking completion. From a worker thread of a started app it runs
+    achat_completion on the app's loop; otherwise (CLI tools, no loop) it
+    calls the sync client. Either way identical prompts already in flight
+    wait for that call instead of making their own.
+    """
     if not _api_key:
         print("[LLM] SKIP — no DEEPSEEK_API_KEY")
         return ""
-    resp = _client.chat.completions.create(
-        model=_model,
-        messages=[
-            {"role":"system","content":system_prompt},
-            {"role":"user","content":user_prompt}
-        ],
-        temperature=0.3,
-        max_tokens=450,
-    )
-    return (resp.choices[0].message.content or "").strip()
+    loop = _loop
+    if loop is not None and not loop.is_closed():
+        try:
+            in_loop = asyncio.get_running_loop() is loop
+        except RuntimeError:
+            in_loop = False
+        if not in_loop:
+            fut = asyncio.run_coroutine_threadsafe(
+                achat_completion(system_prompt, user_prompt, timeout, stream), loop)
+            try:
+                # achat_completion enforces the deadline; the margin only covers a stalled loop
+                return fut.result((timeout or LLM_TIMEOUT) + 5)
+            except concurrent.futures.TimeoutError:
+                fut.cancel()
+                STATS.bump("timeouts")
+                return ""
+    key = _prompt_key(system_prompt, user_prompt)
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = _Flight()
+    if not leader:
+        STATS.bump("coalesced")
+        if not flight.done.wait(timeout or LLM_TIMEOUT):
+            STATS.bump("timeouts")
+        return flight.result
+    try:
+        flight.result = _complete_sync(system_prompt, user_prompt, timeout, stream)
+    finally:
+        with _flights_lock:
+            _flights.pop(key, None)
+        flight.done.set()
+    return flight.result
+
+
+# ----------------- Async -----------------
+async def astream_completion(system_prompt: str, user_prompt: str, timeout: float | None = None):
+    """Yield content deltas as they arrive; records time to first token."""
+    STATS.bump("calls")
+    client = _get_aclient()
+    if timeout:
+        client = client.with_options(timeout=timeout)
+    t0 = time.monotonic()
+    first = True
+    try:
+        stream = await client.chat.completions.create(
+            model=_model, messages=_messages(system_prompt, user_prompt),
+            temperature=_TEMPERATURE, max_tokens=_MAX_TOKENS, stream=True,
+        )
+        async for chunk in stream:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                if first:
+                    STATS.ttft.append(time.monotonic() - t0)
+                    first = False
+                yield delta
+    finally:
+        STATS.latency.append(time.monotonic() - t0)
+
+
+async def _complete_async(system_prompt: str, user_prompt: str, stream: bool) -> str:
+    if stream:
+        try:
+            return "".join([d async for d in astream_completion(system_prompt, user_prompt)]).strip()
+        except APIError as e:
+            _failed(e)
+            return ""
+    STATS.bump("calls")
+    t0 = time.monotonic()
+    try:
+        resp = await _get_aclient().chat.completions.create(
+            model=_model, messages=_messages(system_prompt, user_prompt),
+            temperature=_TEMPERATURE, max_tokens=_MAX_TOKENS,
+        )
+        return (resp.choices[0].message.content or "").strip()
+    except APIError as e:
+        _failed(e)
+        return ""
+    finally:
+        STATS.latency.append(time.monotonic() - t0)
+
+
+# key -> (shared upstream task, number of callers still waiting on it)
+_aflights: dict[str, list] = {}
+
+
+async def achat_completion(system_prompt: str, user_prompt: str, timeout: float | None = None,
+                           stream: bool = LLM_STREAM) -> str:
+    """
+    Async completion with a per-call deadline. Identical concurrent prompts
+    share one upstream request; it is cancelled only when every caller
+    waiting on it has given up.
+    """
+    if not _api_key:
+        print("[LLM] SKIP — no DEEPSEEK_API_KEY")
+        return ""
+    key = _prompt_key(system_prompt, user_prompt)
+    flight = _aflights.get(key)
+    if flight is None:
+        task = asyncio.create_task(_complete_async(system_prompt, user_prompt, stream))
+        flight = _aflights[key] = [task, 0]
+        task.add_done_callback(lambda t, k=key: _aflights.get(k, [None])[0] is t and _aflights.pop(k))
+    else:
+        STATS.bump("coalesced")
+    task = flight[0]
+    flight[1] += 1
+    try:
+        return await asyncio.wait_for(asyncio.shield(task), timeout or LLM_TIMEOUT)
+    except asyncio.TimeoutError:
+        STATS.bump("timeouts")
+        return ""
+    finally:
+        flight[1] -= 1
+        if flight[1] == 0 and not task.done():
+            task.cancel()
+            if _aflights.get(key) is flight:
+                _aflights.pop(key)
+
+
+async def start():
+    """Route blocking calls from worker threads through this loop (call at app startup)."""
+    global _loop
+    _loop = asyncio.get_running_loop()
+
+
+async def close():
+    """Stop routing to the loop and close its pooled client (call at app shutdown)."""
+    global _loop, _aclient, _aclient_loop
+    _loop = None
+    if _aclient is not None and _aclient_loop is asyncio.get_running_loop():
+        await _aclient.close()
+    _aclient = _aclient_loop = None
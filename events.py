@@ -0,0 +1,269 @@
+import asyncio, itertools, json, os, secrets, sqlite3, threading, time, logging
+from collections import deque
+
+from config import EVENT_BUFFER, EVENT_TICKET_TTL, WORKERS
+
+log = logging.getLogger("kai")
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+EVENTS_DB_PATH = os.getenv("EVENTS_DB_PATH", os.path.join(BASE_DIR, "data", "events.db"))
+RELAY_INTERVAL = 0.25
+
+
+def format_sse(event: tuple) -> str:
+    event_id, kind, data = event
+    return f"id: {event_id}\nevent: {kind}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+class EventBus:
+    """
+    In-process pub/sub for dashboard events (message, frozen, unfrozen).
+    Any thread may publish; each subscriber is an asyncio queue fed on its
+    own loop. The newest events stay in a ring buffer so a reconnecting
+    client resumes from its Last-Event-ID instead of refetching; when the
+    gap is no longer buffered it gets a single "reset" event instead.
+
+    With `db_path` set (several worker processes), publishing appends to a
+    shared SQLite log and each worker's relay thread tails it, so an agent
+    connected to any worker sees every event under the same ids.
+    """
+
+    def __init__(self, buffer: int = 2000, queue_size: int = 256, db_path: str | None = None):
+        self.queue_size = queue_size
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._ring: deque = deque(maxlen=max(1, buffer))
+        # Ids start at boot time in ms, so ids from before a restart read as a gap
+        self._ids = itertools.count(int(time.time() * 1000))
+        self._subs: dict[asyncio.Queue, asyncio.AbstractEventLoop] = {}
+        self._local = threading.local()
+        self._pull_lock = threading.Lock()
+        self._seen = 0
+        self._relay = None
+        self._stop = threading.Event()
+        self.published = 0
+        self.resumed = 0
+        self.resets = 0
+
+    # --- Shared log (multi-worker) ---
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            with conn:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS events (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        kind TEXT NOT NULL,
+                        data TEXT NOT NULL
+                    )
+                """)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _pull(self):
+        """Relay rows appended since the last pull, by any worker, in id order."""
+        with self._pull_lock:
+            rows = self._connect().execute(
+                "SELECT id, kind, data FROM events WHERE id > ? ORDER BY id", (self._seen,)
+            ).fetchall()
+            if not rows:
+                return
+            with self._lock:
+                for event_id, kind, data in rows:
+                    self._dispatch((event_id, kind, json.loads(data)))
+                self._seen = rows[-1][0]
+
+    def start(self):
+        """Start tailing the shared log (call in each worker, after fork); no-op in-process."""
+        if not self.db_path or self._relay is not None:
+            return
+        newest = self._connect().execute("SELECT MAX(id) FROM events").fetchone()[0] or 0
+        # Prime the ring so clients moving over from another worker can resume at once
+        self._seen = max(0, newest - self._ring.maxlen)
+        self._pull()
+
+        def _run():
+            while not self._stop.wait(RELAY_INTERVAL):
+                try:
+                    self._pull()
+                except Exception as e:
+                    log.warning(f"[Events] Relay read failed: {e}")
+        self._relay = threading.Thread(target=_run, name="kai-events-relay", daemon=True)
+        self._relay.start()
+        log.info(f"[Events] Relaying shared event log {self.db_path} from id {self._seen}")
+
+    # --- Publish / subscribe ---
+    def publish(self, kind: str, data: dict) -> int:
+        if self.db_path:
+            conn = self._connect()
+            with conn:
+                event_id = conn.execute("INSERT INTO events (kind, data) VALUES (?,?)",
+                                        (kind, json.dumps(data, ensure_ascii=False))).lastrowid
+                if event_id % 500 == 0:
+                    conn.execute("DELETE FROM events WHERE id <= ?", (event_id - self._ring.maxlen,))
+            self.published += 1
+            return event_id
+        with self._lock:
+            event_id = next(self._ids)
+            self._dispatch((event_id, kind, data))
+            self.published += 1
+        return event_id
+
+    def _dispatch(self, event):
+        # Caller holds self._lock, so every subscriber sees id order
+        self._ring.append(event)
+        for q, loop in list(self._subs.items()):
+            try:
+                loop.call_soon_threadsafe(self._deliver, q, event)
+            except RuntimeError:
+                self._subs.pop(q, None)  # loop already closed
+
+    def _deliver(self, q: asyncio.Queue, event):
+        try:
+            q.put_nowait(event)
+        except asyncio.QueueFull:
+            # Too far behind: drop its backlog and tell it to resync
+            while not q.empty():
+                q.get_nowait()
+            q.put_nowait((event[0], "reset", {}))
+            self.resets += 1
+
+    @staticmethod
+    def _end(q: asyncio.Queue):
+        while not q.empty():
+            q.get_nowait()
+        q.put_nowait(None)
+
+    def subscribe(self, last_event_id: int | None = None) -> tuple[asyncio.Queue, list]:
+        """
+        Register a queue on the running loop; returns it with the events
+        missed since `last_event_id`. Replayed events may also arrive on the
+        queue, so consumers skip ids they have already sent.
+        """
+        if self.db_path and last_event_id is not None:
+            self._pull()  # the client may have seen newer events on another worker
+        q = asyncio.Queue(maxsize=self.queue_size)
+        with self._lock:
+            self._subs[q] = asyncio.get_running_loop()
+            if last_event_id is None or not self._ring:
+                return q, []
+            oldest, newest = self._ring[0][0], self._ring[-1][0]
+            if last_event_id == newest:
+                return q, []
+            if last_event_id > newest or last_event_id < oldest - 1:
+                self.resets += 1
+                return q, [(newest, "reset", {})]
+            self.resumed += 1
+            return q, [e for e in self._ring if e[0] > last_event_id]
+
+    def unsubscribe(self, q: asyncio.Queue):
+        with self._lock:
+            self._subs.pop(q, None)
+
+    def close(self):
+        """Stop the relay and wake every stream with an end marker (on shutdown)."""
+        self._stop.set()
+        with self._lock:
+            subs, self._subs = self._subs, {}
+        for q, loop in subs.items():
+            try:
+                loop.call_soon_threadsafe(self._end, q)
+            except RuntimeError:
+                pass
+        log.info(f"[Events] Closed {len(subs)} streams")
+
+    def stats(self) -> dict:
+        return {
+            "shared_log": bool(self.db_path),
+            "subscribers": len(self._subs),
+            "published": self.published,
+            "buffered": len(self._ring),
+            "resumed": self.resumed,
+            "resets": self.resets,
+        }
+
+
+class StreamTickets:
+    """
+    Single-use, short-lived tickets that open the event stream. EventSource
+    can't send an Authorization header, so the dashboard trades its token
+    for a ticket over an authenticated POST and only the ticket goes in the
+    URL (and so into proxy and access logs). With `db_path` set tickets are
+    kept in the shared SQLite file, so any worker can redeem them.
+    """
+
+    def __init__(self, ttl: float = 60, db_path: str | None = None):
+        self.ttl = ttl
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._tickets: dict[str, tuple[str, float]] = {}
+        self._local = threading.local()
+        self.issued = 0
+        self.redeemed = 0
+        self.rejected = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            with conn:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS stream_tickets (
+                        ticket TEXT PRIMARY KEY,
+                        agent TEXT NOT NULL,
+                        expires REAL NOT NULL
+                    )
+                """)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def issue(self, agent: str) -> str:
+        ticket = secrets.token_urlsafe(24)
+        now = time.time()
+        if self.db_path:
+            conn = self._connect()
+            with conn:
+                conn.execute("DELETE FROM stream_tickets WHERE expires < ?", (now,))
+                conn.execute("INSERT INTO stream_tickets (ticket, agent, expires) VALUES (?,?,?)",
+                             (ticket, agent, now + self.ttl))
+        else:
+            with self._lock:
+                self._tickets = {t: v for t, v in self._tickets.items() if v[1] >= now}
+                self._tickets[ticket] = (agent, now + self.ttl)
+        self.issued += 1
+        return ticket
+
+    def redeem(self, ticket: str) -> str | None:
+        """The agent a ticket was issued to; None when unknown, used or expired."""
+        found = None
+        if ticket and self.db_path:
+            conn = self._connect()
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                found = conn.execute("SELECT agent, expires FROM stream_tickets WHERE ticket = ?",
+                                     (ticket,)).fetchone()
+                if found:
+                    conn.execute("DELETE FROM stream_tickets WHERE ticket = ?", (ticket,))
+        elif ticket:
+            with self._lock:
+                found = self._tickets.pop(ticket, None)
+        if found and found[1] >= time.time():
+            self.redeemed += 1
+            return found[0]
+        self.rejected += 1
+        return None
+
+    def stats(self) -> dict:
+        return {"ttl_s": self.ttl, "issued": self.issued, "redeemed": self.redeemed, "rejected": self.rejected}
+
+
+EVENTS = EventBus(buffer=EVENT_BUFFER, db_path=EVENTS_DB_PATH if WORKERS > 1 else None)
+STREAM_TICKETS = StreamTickets(ttl=EVENT_TICKET_TTL, db_path=EVENTS_DB_PATH if WORKERS > 1 else None)
@@ -1,21 +1,65 @@
-import os, io, csv, requests, re
+import os, csv, gzip, codecs, json, time, requests, re
+from functools import lru_cache
 
 # Primary warranty sheet
 WARRANTY_CSV_URL = os.getenv("WARRANTY_CSV_URL", "")
 # Secondary warranty sheet
 EXTRA_WARRANTY_CSV_URL = os.getenv("EXTRA_WARRANTY_CSV_URL", "")
 
-# In-memory stores
-WARRANTY_DB = {}         
-WARRANTY_BY_DONGLE = {}  
+# Last good indexes on disk, so a restart can serve lookups before any fetch
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+WARRANTY_SNAPSHOT_PATH = os.getenv(
+    "WARRANTY_SNAPSHOT_PATH", os.path.join(BASE_DIR, "data", "warranty_snapshot.json.gz")
+)
+SNAPSHOT_FORMAT = 1
+# Typos tolerated by the fuzzy dongle lookup; each extra edit grows the index ~N-fold
+DONGLE_MAX_EDITS = int(os.getenv("DONGLE_MAX_EDITS", "1"))
 
-def _fetch_csv_rows(url: str):
-    if not url:
-        return []
-    r = requests.get(url, timeout=20, headers={"User-Agent":"Kai/Sheets/1.0"})
-    r.raise_for_status()
-    content = r.content.decode("utf-8", errors="ignore")
-    return list(csv.DictReader(io.StringIO(content)))
+# In-memory stores; replaced wholesale on refresh, never mutated in place
+WARRANTY_DB = {}
+WARRANTY_BY_DONGLE = {}
+DONGLE_INDEX = None  # DongleIndex over WARRANTY_BY_DONGLE, swapped with it
+# Per-sheet parts behind the merged stores (tag -> part, see _index_rows)
+_PARTS = {}
+# mtime of the snapshot file the installed stores match (other workers may write newer ones)
+_SNAPSHOT_MTIME = None
+
+def _iter_lines(resp, chunk_size: int = 1 << 16):
+    """Decode a streamed response into "\n"-terminated lines for csv.reader."""
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+    buf = ""
+    for chunk in resp.iter_content(chunk_size):
+        *lines, buf = (buf + decoder.decode(chunk)).split("\n")
+        for line in lines:
+            yield line + "\n"
+    buf += decoder.decode(b"", final=True)
+    if buf:
+        yield buf
+
+def _stream_csv_rows(url: str, prev: dict | None = None):
+    """
+    Yield CSV records (lists) as they download. Sends the previous ETag /
+    Last-Modified; yields nothing and sets `meta["unchanged"]` on a 304.
+    The response validators are returned in `meta` once the stream ends.
+    """
+    headers = {"User-Agent": "Kai/Sheets/1.0"}
+    if prev and prev.get("etag"):
+        headers["If-None-Match"] = prev["etag"]
+    if prev and prev.get("last_modified"):
+        headers["If-Modified-Since"] = prev["last_modified"]
+    meta = {"unchanged": False}
+
+    def _rows():
+        with requests.get(url, timeout=20, headers=headers, stream=True) as r:
+            if r.status_code == 304:
+                meta["unchanged"] = True
+                return
+            r.raise_for_status()
+            meta["etag"] = r.headers.get("ETag")
+            meta["last_modified"] = r.headers.get("Last-Modified")
+            yield from csv.reader(_iter_lines(r))
+
+    return _rows(), meta
 
 def _norm_key(s: str) -> str:
     if not s: return ""
@@ -26,6 +70,101 @@ def _norm_dongle(s: str) -> str:
     if not s: return ""
     return "".join(ch for ch in str(s).upper() if ch.isalnum())
 
+# ----------------- Fuzzy Dongle Index -----------------
+# Characters customers swap when typing IDs (IDs are hex, so letters fold safely)
+_CONFUSABLES = str.maketrans({"O": "0", "I": "1", "L": "1"})
+
+# Dongle-ID-shaped tokens inside a longer message: 6–24 letters/digits
+# (dashes allowed between groups) with at least one digit
+_DONGLE_TOKEN = re.compile(
+    r"(?<![A-Za-z0-9])(?=[A-Za-z0-9-]*\d)[A-Za-z0-9][A-Za-z0-9-]{4,22}[A-Za-z0-9](?![A-Za-z0-9])"
+)
+
+def _fold_dongle(s: str) -> str:
+    return _norm_dongle(s).translate(_CONFUSABLES)
+
+def _deletes(word: str, depth: int) -> set:
+    """`word` plus every string reachable by deleting up to `depth` characters."""
+    out = frontier = {word}
+    for _ in range(depth):
+        frontier = {w[:i] + w[i + 1:] for w in frontier for i in range(len(w))}
+        out = out | frontier
+    return out
+
+def _edit_distance(a: str, b: str, cap: int) -> int:
+    """Levenshtein distance, or cap + 1 as soon as it must exceed `cap`."""
+    if abs(len(a) - len(b)) > cap:
+        return cap + 1
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        for j, cb in enumerate(b, 1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb)))
+        if min(cur) > cap:
+            return cap + 1
+        prev = cur
+    return prev[-1]
+
+class DongleIndex:
+    """
+    Nearest-dongle lookup: IDs are folded for confusable characters and
+    every deletion variant (up to `max_edits`) points back at its ID, so a
+    query only probes its own deletion variants instead of scanning all IDs.
+    """
+
+    def __init__(self, dongle_ids, max_edits: int = DONGLE_MAX_EDITS):
+        self.max_edits = max_edits
+        self.exact = {}     # folded -> normalized ID, None when two IDs fold alike
+        self.variants = {}  # deletion variant -> folded ID(s)
+        for d in dongle_ids:
+            f = _fold_dongle(d)
+            if f in self.exact:
+                if self.exact[f] != d:
+                    self.exact[f] = None
+                continue
+            self.exact[f] = d
+            if max_edits <= 0:
+                continue
+            for v in _deletes(f, max_edits):
+                prev = self.variants.get(v)
+                if prev is None:
+                    self.variants[v] = f
+                elif isinstance(prev, list):
+                    prev.append(f)
+                else:
+                    self.variants[v] = [prev, f]
+
+    def lookup(self, text: str):
+        """(normalized ID, edits) for the single closest ID, or None if none/ambiguous."""
+        f = _fold_dongle(text)
+        if not f:
+            return None
+        if f in self.exact:
+            d = self.exact[f]
+            return (d, 0) if d else None
+        if self.max_edits <= 0:
+            return None
+        cands = set()
+        for v in _deletes(f, self.max_edits):
+            hit = self.variants.get(v)
+            if hit is None:
+                continue
+            if isinstance(hit, list):
+                cands.update(hit)
+            else:
+                cands.add(hit)
+        scored = sorted((_edit_distance(f, c, self.max_edits), c) for c in cands)
+        scored = [(e, c) for e, c in scored if e <= self.max_edits]
+        # Two equally close IDs: don't guess whose warranty to show
+        if not scored or (len(scored) > 1 and scored[1][0] == scored[0][0]):
+            return None
+        edits, folded = scored[0]
+        d = self.exact.get(folded)
+        return (d, edits) if d else None
+
+    def stats(self) -> dict:
+        return {"ids": len(self.exact), "variants": len(self.variants), "max_edits": self.max_edits}
+
 def _norm_header(s: str) -> str:
     """Normalize header keys: strip, lower, collapse spaces, remove NBSP/zero-width, strip punctuation around."""
     if s is None: return ""
@@ -53,70 +192,214 @@ def _extract_field(row: dict, *candidates):
             return v
     return ""
 
-def _merge_rows_into_indexes(rows, source_tag=""):
-    """Insert rows into WARRANTY_DB and WARRANTY_BY_DONGLE."""
+# ----------------- Column Plans -----------------
+_PHONE_COLS = ("phone", "mobile", "whatsapp", "contact")
+_SERIAL_COLS = ("serial", "serial no", "serial_no", "device serial")
+# DONGLE ID variants — include headers with leading/trailing spaces
+_DONGLE_COLS = ("dongle id", "dongle  id", "dongle_id", "dongle", "device id", "device_id", "dongle id ")
+# Warranty display columns, in preference order, common across both sheets
+_DISPLAY_COLS = {
+    "status": ("warranty", "warranty status", "subscription valid"),
+    "end":    ("warranty end", "warranty expiry", "subscription valid until"),
+    "prod":   ("prod date", "pd. date", "product date"),
+    "sold":   ("date of sale", "date", "sales date"),
+    "inst":   ("installation date", "date of installation"),
+}
+
+class ColumnPlan:
+    """A sheet's header row resolved once into the source columns behind each field."""
+
+    def __init__(self, headers):
+        by_norm = {}
+        for h in headers:
+            by_norm[_norm_header(h)] = h  # later duplicates win, as in _extract_field
+
+        def resolve(candidates):
+            cols = []
+            for name in candidates:
+                h = by_norm.get(_norm_header(name))
+                if h is not None and h not in cols:
+                    cols.append(h)
+            return tuple(cols)
+
+        self.key_cols = resolve(_PHONE_COLS + _SERIAL_COLS)
+        self.dongle_cols = resolve(_DONGLE_COLS)
+        self.display = {field: resolve(names) for field, names in _DISPLAY_COLS.items()}
+        # Every column the bot reads; the rest of the sheet is dropped at load
+        self.keep = tuple(dict.fromkeys(
+            self.key_cols + self.dongle_cols + tuple(h for cols in self.display.values() for h in cols)
+        ))
+
+    def first(self, row: dict, field: str):
+        """First non-empty display value for `field`."""
+        for h in self.display[field]:
+            v = row.get(h)
+            if v not in (None, ""):
+                return v
+        return ""
+
+@lru_cache(maxsize=32)
+def _plan_for(headers: tuple) -> ColumnPlan:
+    return ColumnPlan(headers)
+
+def _index_rows(records, source_tag="") -> dict:
+    """
+    Index one sheet from raw CSV records (header first). Only the columns
+    the bot reads are kept; `keys`/`dongles` map normalized IDs to row numbers.
+    """
+    records = iter(records)
+    header = next(records, None)
+    part = {"headers": [], "rows": [], "keys": {}, "dongles": {}}
+    if not header:
+        return part
+    plan = _plan_for(tuple(header))
+    pos = {h: i for i, h in enumerate(header)}
+    keep = plan.keep
+    idx = [pos[h] for h in keep]
+    key_idx = [pos[h] for h in plan.key_cols]
+    dongle_idx = [pos[h] for h in plan.dongle_cols]
+    rows, keys, dongles = part["rows"], part["keys"], part["dongles"]
     added_dongles = 0
-    for r in rows:
-        # phone-ish
-        phone_like  = [
-            _extract_field(r, "phone"), _extract_field(r, "mobile"),
-            _extract_field(r, "whatsapp"), _extract_field(r, "contact")
-        ]
-        serial_like = [
-            _extract_field(r, "serial"), _extract_field(r, "serial no"),
-            _extract_field(r, "serial_no"), _extract_field(r, "device serial")
-        ]
-        # DONGLE ID variants — include headers with leading
-        dongle_like = [
-            _extract_field(r, "dongle id"), _extract_field(r, "dongle  id"),
-            _extract_field(r, "dongle_id"), _extract_field(r, "dongle"),
-            _extract_field(r, "device id"), _extract_field(r, "device_id"),
-            _extract_field(r, "dongle id ")  
-        ]
+
+    for rec in records:
+        if not rec:
+            continue
+        n = len(rec)
+        row_no = len(rows)
+        rows.append([rec[i] if i < n else "" for i in idx])
 
         # index phone/serial
-        for k in phone_like + serial_like:
-            k2 = _norm_key(k)
+        for i in key_idx:
+            k2 = _norm_key(rec[i]) if i < n else ""
             if k2:
-                WARRANTY_DB[k2] = r
+                keys[k2] = row_no
 
         # index dongle id
-        for d in dongle_like:
-            d2 = _norm_dongle(d)
+        for i in dongle_idx:
+            d2 = _norm_dongle(rec[i]) if i < n else ""
             if d2:
-                WARRANTY_BY_DONGLE[d2] = r
+                dongles[d2] = row_no
                 added_dongles += 1
+
+    part["headers"] = list(keep)
     print(f"[WARRANTY] {source_tag} mapped {added_dongles} dongle ids.")
+    return part
 
-def fetch_warranty_all():
-    """Load/merge warranty rows from both sheets."""
-    global WARRANTY_DB, WARRANTY_BY_DONGLE
-    WARRANTY_DB = {}
-    WARRANTY_BY_DONGLE = {}
+def _install(parts: dict):
+    """Merge sheet parts (primary first, extra overrides) and swap them in at once."""
+    global WARRANTY_DB, WARRANTY_BY_DONGLE, DONGLE_INDEX, _PARTS
+    db, by_dongle = {}, {}
+    for tag in ("primary", "extra"):
+        part = parts.get(tag)
+        if not part:
+            continue
+        headers = part["headers"]
+        rows = [dict(zip(headers, r)) for r in part["rows"]]
+        for k, i in part["keys"].items():
+            db[k] = rows[i]
+        for d, i in part["dongles"].items():
+            by_dongle[d] = rows[i]
+    dongle_index = DongleIndex(by_dongle)
+    WARRANTY_DB, WARRANTY_BY_DONGLE, DONGLE_INDEX, _PARTS = db, by_dongle, dongle_index, parts
 
-    total_rows = 0
+# ----------------- Snapshot -----------------
+def _save_snapshot(parts: dict, path: str = WARRANTY_SNAPSHOT_PATH):
+    global _SNAPSHOT_MTIME
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Per-process tmp name: two workers refreshing at once must not share one
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with gzip.open(tmp, "wt", encoding="utf-8", compresslevel=6) as f:
+        json.dump({"format": SNAPSHOT_FORMAT, "saved_at": time.time(), "parts": parts},
+                  f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp, path)
+    _SNAPSHOT_MTIME = os.path.getmtime(path)
 
-    if WARRANTY_CSV_URL:
-        try:
-            rows = _fetch_csv_rows(WARRANTY_CSV_URL)
-            print(f"[WARRANTY] Primary rows: {len(rows)}")
-            _merge_rows_into_indexes(rows, source_tag="primary")
-            total_rows += len(rows)
-        except Exception as e:
-            print(f"[WARRANTY] Primary fetch failed: {e}")
+def load_warranty_snapshot(path: str = WARRANTY_SNAPSHOT_PATH) -> int:
+    """Serve the last saved indexes without touching the network; returns row count."""
+    global _SNAPSHOT_MTIME
+    try:
+        mtime = os.path.getmtime(path)
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            snap = json.load(f)
+    except FileNotFoundError:
+        return 0
+    _SNAPSHOT_MTIME = mtime
+    if snap.get("format") != SNAPSHOT_FORMAT:
+        print(f"[WARRANTY] Ignoring snapshot with format {snap.get('format')}")
+        return 0
+    _install(snap["parts"])
+    total = sum(len(p["rows"]) for p in _PARTS.values())
+    print(f"[WARRANTY] Snapshot loaded: {total} rows; "
+          f"{len(WARRANTY_BY_DONGLE)} unique dongle ids; {len(WARRANTY_DB)} phone/serial keys.")
+    return total
+
+# ----------------- Refresh -----------------
+def fetch_warranty_all():
+    """
+    Refresh both sheets. Unchanged sheets (304) and failed fetches keep
+    their previous part; lookups keep hitting the old indexes until the
+    merged replacement is swapped in.
+    """
+    parts = {}
+    changed = False
 
-    if EXTRA_WARRANTY_CSV_URL:
+    for tag, url in (("primary", WARRANTY_CSV_URL), ("extra", EXTRA_WARRANTY_CSV_URL)):
+        if not url:
+            changed = changed or tag in _PARTS
+            continue
+        last = _PARTS.get(tag)
+        # Validators only apply to the URL they came from
+        prev = last if last and last.get("url") == url else None
         try:
-            rows2 = _fetch_csv_rows(EXTRA_WARRANTY_CSV_URL)
-            print(f"[WARRANTY] Extra rows: {len(rows2)}")
-            _merge_rows_into_indexes(rows2, source_tag="extra")
-            total_rows += len(rows2)
+            records, meta = _stream_csv_rows(url, prev)
+            part = _index_rows(records, source_tag=tag)
+            if meta["unchanged"]:
+                print(f"[WARRANTY] {tag.capitalize()} sheet unchanged")
+                parts[tag] = prev
+                continue
+            part.update(url=url, etag=meta.get("etag"), last_modified=meta.get("last_modified"),
+                        fetched_at=time.time())
+            print(f"[WARRANTY] {tag.capitalize()} rows: {len(part['rows'])}")
+            parts[tag] = part
+            changed = True
         except Exception as e:
-            print(f"[WARRANTY] Extra fetch failed: {e}")
+            print(f"[WARRANTY] {tag.capitalize()} fetch failed: {e}")
+            if last:
+                parts[tag] = last
+
+    if not changed:
+        # Every part is the one already installed; rebuilding would only redo the same indexes
+        print("[WARRANTY] No sheet changed; keeping installed indexes")
+        return
+    _install(parts)
+    try:
+        _save_snapshot(parts)
+    except OSError as e:
+        print(f"[WARRANTY] Snapshot write failed: {e}")
 
+    total_rows = sum(len(p["rows"]) for p in parts.values())
     print(f"[WARRANTY] Loaded total rows: {total_rows}; "
           f"{len(WARRANTY_BY_DONGLE)} unique dongle ids; {len(WARRANTY_DB)} phone/serial keys.")
 
+def warranty_snapshot_stale(path: str = WARRANTY_SNAPSHOT_PATH) -> bool:
+    """True when the snapshot on disk is newer than what this process serves."""
+    try:
+        return os.path.getmtime(path) != _SNAPSHOT_MTIME
+    except OSError:
+        return False
+
+def warranty_stats() -> dict:
+    return {
+        "dongle_ids": len(WARRANTY_BY_DONGLE),
+        "dongle_index": DONGLE_INDEX.stats() if DONGLE_INDEX else None,
+        "phone_serial_keys": len(WARRANTY_DB),
+        "sheets": {
+            tag: {"rows": len(p["rows"]), "etag": p.get("etag"),
+                  "last_modified": p.get("last_modified"), "fetched_at": p.get("fetched_at")}
+            for tag, p in _PARTS.items()
+        },
+    }
+
 def warranty_lookup(identifier: str):
     """Legacy lookup by normalized phone/serial key."""
     return WARRANTY_DB.get(_norm_key(identifier))
@@ -125,17 +408,47 @@ def warranty_lookup_by_dongle(dongle_id: str):
     """Primary lookup by Dongle ID (merged)."""
     return WARRANTY_BY_DONGLE.get(_norm_dongle(dongle_id))
 
+def warranty_find_dongle(text: str):
+    """
+    Find the warranty row a message refers to: the whole message or any
+    ID-shaped token in it, exact matches first, then the closest ID within
+    DONGLE_MAX_EDITS typos. Returns (row, dongle_id, edits) or None.
+    """
+    text = (text or "").strip()
+    by_dongle, index = WARRANTY_BY_DONGLE, DONGLE_INDEX
+    if not by_dongle:
+        return None
+    candidates = _DONGLE_TOKEN.findall(text)
+    if 6 <= len(text) <= 20:
+        candidates.insert(0, text)
+
+    for c in candidates:
+        d = _norm_dongle(c)
+        if d in by_dongle:
+            return by_dongle[d], d, 0
+    if index is None:
+        return None
+    for c in candidates:
+        if not any(ch.isdigit() for ch in c):
+            continue
+        hit = index.lookup(c)
+        if hit and hit[0] in by_dongle:
+            d, edits = hit
+            # A confusable-only fold (O for 0) still counts as a correction
+            return by_dongle[d], d, edits or int(d != _norm_dongle(c))
+    return None
+
 def warranty_text_from_row(row: dict) -> str:
     """
     Return a clean human answer using warranty-only columns.
     Looks for typical columns across both sheets.
     """
-    # Common warranty columns across sheets
-    status = _extract_field(row, "warranty", "warranty status", "subscription valid")
-    end    = _extract_field(row, "warranty end", "warranty expiry", "subscription valid until")
-    prod   = _extract_field(row, "prod date", "pd. date", "product date")
-    sold   = _extract_field(row, "date of sale", "date", "sales date")
-    inst   = _extract_field(row, "installation date", "date of installation")
+    plan = _plan_for(tuple(row))
+    status = plan.first(row, "status")
+    end    = plan.first(row, "end")
+    prod   = plan.first(row, "prod")
+    sold   = plan.first(row, "sold")
+    inst   = plan.first(row, "inst")
 
     bits = []
     if status: bits.append(f"Status: {status}")
@@ -0,0 +1,29 @@
+# gunicorn -c gunicorn.conf.py app:app
+#
+# Workers share one data/ directory: sessions and caches are SQLite in WAL
+# mode, index rebuilds and sheet refreshes take a file lock in data/locks/,
+# and each worker reloads builds published by another (see worker_sync.py).
+import multiprocessing, os
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:6090")
+worker_class = "uvicorn.workers.UvicornWorker"
+# WEB_CONCURRENCY is also read by config.WORKERS, so the app knows it is one of several
+workers = int(os.getenv("WEB_CONCURRENCY", str(min(4, multiprocessing.cpu_count()))))
+os.environ["WEB_CONCURRENCY"] = str(workers)
+
+# Load indexes and the warranty snapshot once in the master; workers fork
+# with them already in memory (shared copy-on-write)
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") == "1"
+
+# Index rebuilds and LLM calls run on threads, so keep the heartbeat timeout generous
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "40"))
+keepalive = 5
+
+
+def when_ready(server):
+    # Runs in the master after the app is imported and before any worker forks
+    if preload_app:
+        from app import preload
+        preload()
+        server.log.info(f"Preloaded shared state for {workers} workers")
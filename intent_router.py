@@ -0,0 +1,118 @@
+import re, threading
+
+from car_compat import MODEL_ALIAS_PATTERN
+from templates import (
+    reply_about, reply_how, reply_buy, reply_test_drive, reply_office_hours,
+    reply_not_blinking, reply_part_replacement
+)
+
+CAR_KEYWORDS = [
+    "myvi", "alza", "ativa", "perodua", "proton", "s70", "x50", "x70",
+    "honda", "city", "accord", "hrv", "crv", "toyota", "vios", "cross",
+    "byd", "lexus", "kereta", "support", "compatible"
+]
+
+# ----------------- Rules -----------------
+# (intent, phrases, exact). Exact intents must be the whole message; the
+# rest match anywhere on word boundaries. A trailing "*" matches any word
+# ending ("support*" → supported, supports). Order is priority: the first
+# listed intent found in a message wins.
+#
+# Template phrases are multi-word on purpose: a lone "alamat", "ganti" or
+# "tak hidup" shows up in real questions ("tukar alamat penghantaran",
+# "kereta tak hidup lepas pasang") that need RAG or an agent, not a canned reply.
+RULES = [
+    ("live_agent", ["la", "live agent", "agent", "human", "ejen", "ejen manusia"], True),
+    ("resume", ["resume", "unfreeze", "sambung"], True),
+    ("greeting", ["hi", "hello", "hai", "helo", "start", "menu"], False),
+    ("office_hours", ["office hour*", "office time", "opening hour*", "operating hour*", "waktu pejabat",
+                      "waktu operasi", "jam berapa buka", "office address", "alamat pejabat", "alamat office",
+                      "alamat kommu", "where is the office", "where is your office", "office location",
+                      "lokasi pejabat"], False),
+    ("test_drive", ["test drive", "testdrive", "pandu uji", "try the car", "cuba pandu"], False),
+    ("not_blinking", ["not blinking", "no led", "led not", "no light", "device not turning on",
+                      "device won't turn on", "device no power", "tak menyala", "tidak menyala", "lampu tak",
+                      "device tak hidup", "device tiada kuasa"], False),
+    ("car", [*CAR_KEYWORDS, "support*", "compatib*", "serasi", "disokong"], False),
+    ("part_replacement", ["spare part*", "replacement part*", "needs replacement", "need replacement",
+                          "alat ganti", "penggantian part", "broken cable", "harness rosak", "relay rosak",
+                          "kabel rosak"], False),
+    # No price words here: reply_buy carries no price, so price questions go to RAG (SOP has the prices)
+    ("buy", ["buy", "purchase", "how to order", "place an order", "beli", "tempah"], False),
+    ("about", ["what is kommu", "what is kommuassist", "about kommu", "apa itu kommu", "apa itu kommuassist",
+               "tentang kommu", "who are you"], False),
+    ("how", ["how does it work", "how it works", "how does kommuassist work", "bagaimana ia berfungsi",
+             "macam mana berfungsi", "camne dia berfungsi", "cara berfungsi"], False),
+]
+
+# Canned replies only answer short messages; a longer one carries detail
+# (car, year, what went wrong) that RAG or an agent should see
+SHORT_ONLY = {"office_hours", "not_blinking", "part_replacement"}
+SHORT_MAX_WORDS = 8
+
+# Intents answered straight from templates.py
+TEMPLATE_REPLIES = {
+    "office_hours": reply_office_hours,
+    "test_drive": reply_test_drive,
+    "not_blinking": reply_not_blinking,
+    "part_replacement": reply_part_replacement,
+    "buy": reply_buy,
+    "about": reply_about,
+    "how": reply_how,
+}
+
+_EDGE_PUNCT = re.compile(r"^[^\w]+|[^\w]+$")
+
+
+def _phrase(p: str) -> str:
+    prefix = p.endswith("*")
+    body = r"\s+".join(re.escape(w) for w in p.rstrip("*").split())
+    return body + (r"\w*" if prefix else r"\b")
+
+
+class IntentRouter:
+    """
+    Every rule compiled into one alternation of named groups, so a message
+    is classified with a single regex scan instead of one search per word.
+    """
+
+    def __init__(self, rules=RULES):
+        self.priority = [name for name, _, _ in rules]
+        parts = []
+        for name, phrases, exact in rules:
+            alt = "|".join(_phrase(p) for p in sorted(phrases, key=len, reverse=True))
+            if name == "car":
+                alt = rf"(?:{MODEL_ALIAS_PATTERN})\b|{alt}"
+            parts.append(rf"(?P<{name}>^(?:{alt})$)" if exact else rf"(?P<{name}>\b(?:{alt}))")
+        self.pattern = re.compile("|".join(parts))
+        self._lock = threading.Lock()
+        self.counts = {name: 0 for name in self.priority}
+        self.unmatched = 0
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return _EDGE_PUNCT.sub("", " ".join((text or "").lower().split()))
+
+    def classify(self, text: str) -> list[str]:
+        """All intents present in `text`, highest priority first."""
+        text = self.normalize(text)
+        found = {m.lastgroup for m in self.pattern.finditer(text)}
+        if len(text.split()) > SHORT_MAX_WORDS:
+            found -= SHORT_ONLY
+        return [name for name in self.priority if name in found]
+
+    def route(self, text: str) -> list[str]:
+        """`classify` plus counting of the winning intent for /admin/stats."""
+        intents = self.classify(text)
+        with self._lock:
+            if intents:
+                self.counts[intents[0]] += 1
+            else:
+                self.unmatched += 1
+        return intents
+
+    def stats(self) -> dict:
+        return {"routed": {k: v for k, v in self.counts.items() if v}, "unmatched": self.unmatched}
+
+
+INTENT_ROUTER = IntentRouter()
@@ -2,6 +2,32 @@ import React, { useEffect, useState, useCallback, useRef } from "react";
 import { getToken, setToken, clearToken } from "./utils/tokenStorage";
 
 const API_BASE = import.meta.env.VITE_API_BASE || "https://api.kommu.ai/api";
+const PAGE_SIZE = 40;
+const CHAT_PAGE_SIZE = 50;
+
+const toMessage = (m: any) => ({
+  id: m.id,
+  sender: m.sender,
+  content: m.content,
+  time:
+    m.time ||
+    m.timestamp ||
+    m.created_at ||
+    m.sent_at ||
+    new Date().toLocaleTimeString([], {
+      hour: "2-digit",
+      minute: "2-digit",
+    }),
+});
+
+// Upsert delta rows by user_id and keep the list ordered by last activity
+const mergeChats = (prev: any[], updates: any[]) => {
+  const byId = new Map(prev.map((c) => [c.user_id, c]));
+  updates.forEach((c) => byId.set(c.user_id, c));
+  return [...byId.values()].sort((a, b) =>
+    (b.lastActive || "").localeCompare(a.lastActive || "")
+  );
+};
 
 export default function App() {
   const [token, setTok] = useState(getToken());
@@ -24,8 +50,12 @@ export default function App() {
   // scrolling / unread
   const scrollRef = useRef<HTMLDivElement>(null);
   const [isLoadingOld, setIsLoadingOld] = useState(false);
-  const [visibleCount, setVisibleCount] = useState(40);
-  const [totalMessageCount, setTotalMessageCount] = useState(0);
+  const [hasOlder, setHasOlder] = useState(false);
+  const latestIdRef = useRef(0);
+
+  // chat list paging / deltas
+  const [chatCursor, setChatCursor] = useState<string | null>(null);
+  const chatsSinceRef = useRef<string | null>(null);
   const [unreadCounts, setUnreadCounts] = useState<Record<string, number>>({});
   const [searchQuery, setSearchQuery] = useState("");
   const [showScrollButton, setShowScrollButton] = useState(false);
@@ -58,12 +88,14 @@ export default function App() {
   const loadChats = useCallback(
     async (tok?: string) => {
       try {
-        const res = await fetch(`${API_BASE}/chats`, {
+        const res = await fetch(`${API_BASE}/chats?limit=${CHAT_PAGE_SIZE}`, {
           headers: { Authorization: `Bearer ${tok || token}` },
         });
 
         const data = await res.json();
-        setChats([...data].reverse());
+        setChats(data.chats);
+        setChatCursor(data.next_cursor);
+        chatsSinceRef.current = data.since;
       } catch (e) {
         console.error("loadChats error:", e);
       }
@@ -71,47 +103,45 @@ export default function App() {
     [token]
   );
 
+  const loadMoreChats = async () => {
+    if (!chatCursor) return;
+    try {
+      const res = await fetch(
+        `${API_BASE}/chats?limit=${CHAT_PAGE_SIZE}&cursor=${encodeURIComponent(chatCursor)}`,
+        { headers: { Authorization: `Bearer ${token}` } }
+      );
+      const data = await res.json();
+      setChats((prev) => mergeChats(prev, data.chats));
+      setChatCursor(data.next_cursor);
+    } catch (e) {
+      console.error("loadMoreChats error:", e);
+    }
+  };
+
   // ---------------- Load chat messages ----------------
   const loadChat = useCallback(
     async (userId: string, silent = false) => {
       try {
         if (!silent) {
           setSelected(userId);
-          setVisibleCount(40);
           setUnreadCounts((prev) => ({ ...prev, [userId]: 0 }));
         }
 
-        const res = await fetch(`${API_BASE}/chat/${userId}`, {
+        const res = await fetch(`${API_BASE}/chat/${userId}?limit=${PAGE_SIZE}`, {
           headers: { Authorization: `Bearer ${token}` },
         });
 
         const data = await res.json();
-        setTotalMessageCount(data.length);
-
-        const slice = data.slice(-visibleCount);
-
-        setMessages(
-          slice.map((m: any) => ({
-            sender: m.sender,
-            content: m.content,
-            time:
-              m.time ||
-              m.timestamp ||
-              m.created_at ||
-              m.sent_at ||
-              new Date().toLocaleTimeString([], {
-                hour: "2-digit",
-                minute: "2-digit",
-              }),
-          }))
-        );
+        latestIdRef.current = data.latest_id;
+        setHasOlder(data.has_more);
+        setMessages(data.messages.map(toMessage));
 
         scrollBottom(!silent);
       } catch (e) {
         console.error("loadChat error:", e);
       }
     },
-    [token, visibleCount]
+    [token]
   );
 
   // ---------------- Scroll to bottom ----------------
@@ -207,47 +237,124 @@ export default function App() {
     }
   };
 
-  // ---------------- Auto refresh ----------------
+  // ---------------- Live events (SSE) ----------------
+  // One stream per tab instead of polling. The URL carries a single-use
+  // ticket (never the token), so on any error we close and reconnect with a
+  // fresh ticket, resuming from lastEventIdRef. A "reset" means the gap was
+  // too old to replay: refetch.
+  const selectedRef = useRef<string | null>(null);
+  const chatsRef = useRef<any[]>([]);
+  const lastEventIdRef = useRef("");
+
   useEffect(() => {
-    if (!selected) return;
+    selectedRef.current = selected;
+  }, [selected]);
 
-    const interval = setInterval(async () => {
-      const res = await fetch(`${API_BASE}/chat/${selected}`, {
-        headers: { Authorization: `Bearer ${token}` },
-      });
+  useEffect(() => {
+    chatsRef.current = chats;
+  }, [chats]);
 
-      const data = await res.json();
-      setTotalMessageCount(data.length);
+  useEffect(() => {
+    if (!agent) return;
 
-      const slice = data.slice(-visibleCount);
+    let source: EventSource | null = null;
+    let retry: ReturnType<typeof setTimeout> | undefined;
+    let closed = false;
 
-      const last = data[data.length - 1];
-      if (last?.sender === "user" && !document.hasFocus()) {
-        setUnreadCounts((prev) => ({
-          ...prev,
-          [selected]: (prev[selected] || 0) + 1,
-        }));
+    // A chat we don't list yet: pull the rows active since our last fetch
+    const catchUpChats = async () => {
+      if (chatsSinceRef.current === null) return;
+      try {
+        const res = await fetch(
+          `${API_BASE}/chats?since=${encodeURIComponent(chatsSinceRef.current)}`,
+          { headers: { Authorization: `Bearer ${token}` } }
+        );
+        if (!res.ok) return;
+        const data = await res.json();
+        chatsSinceRef.current = data.since;
+        setChats((prev) => mergeChats(prev, data.chats));
+      } catch (e) {
+        console.error("catch up chats error:", e);
       }
+    };
 
-      setMessages(
-        slice.map((m: any) => ({
-          sender: m.sender,
-          content: m.content,
-          time:
-            m.time ||
-            m.timestamp ||
-            m.created_at ||
-            m.sent_at ||
-            new Date().toLocaleTimeString([], {
-              hour: "2-digit",
-              minute: "2-digit",
-            }),
-        }))
-      );
-    }, 4000);
+    const onMessage = (e: MessageEvent) => {
+      lastEventIdRef.current = e.lastEventId;
+      const m = JSON.parse(e.data);
+
+      const row = chatsRef.current.find((c) => c.user_id === m.user_id);
+      if (row) {
+        setChats((prev) =>
+          mergeChats(prev, [
+            { ...row, lastMessage: m.content, lastMessageTime: m.time, lastActive: m.lastActive },
+          ])
+        );
+      } else {
+        catchUpChats();
+      }
 
-    return () => clearInterval(interval);
-  }, [selected, token, visibleCount]);
+      const isOpen = m.user_id === selectedRef.current;
+      if (isOpen && m.id > latestIdRef.current) {
+        latestIdRef.current = m.id;
+        setMessages((prev) => [...prev, toMessage(m)]);
+        scrollBottom();
+      }
+      if (m.sender === "user" && (!isOpen || !document.hasFocus())) {
+        setUnreadCounts((prev) => ({ ...prev, [m.user_id]: (prev[m.user_id] || 0) + 1 }));
+      }
+    };
+
+    const onFreeze = (frozen: boolean) => (e: MessageEvent) => {
+      lastEventIdRef.current = e.lastEventId;
+      const { user_id } = JSON.parse(e.data);
+      setChats((prev) => prev.map((c) => (c.user_id === user_id ? { ...c, frozen } : c)));
+    };
+
+    const onReset = (e: MessageEvent) => {
+      lastEventIdRef.current = e.lastEventId;
+      loadChats();
+      if (selectedRef.current) loadChat(selectedRef.current, true);
+    };
+
+    const reconnect = () => {
+      source?.close();
+      source = null;
+      if (!closed) retry = setTimeout(connect, 3000);
+    };
+
+    const connect = async () => {
+      let ticket: string;
+      try {
+        const res = await fetch(`${API_BASE}/events/ticket`, {
+          method: "POST",
+          headers: { Authorization: `Bearer ${token}` },
+        });
+        if (!res.ok) throw new Error(`ticket ${res.status}`);
+        ticket = (await res.json()).ticket;
+      } catch (e) {
+        console.error("event stream ticket error:", e);
+        return reconnect();
+      }
+      if (closed) return;
+      const resume = lastEventIdRef.current
+        ? `&last_event_id=${encodeURIComponent(lastEventIdRef.current)}`
+        : "";
+      source = new EventSource(`${API_BASE}/events?ticket=${encodeURIComponent(ticket)}${resume}`);
+      source.addEventListener("message", onMessage);
+      source.addEventListener("frozen", onFreeze(true));
+      source.addEventListener("unfrozen", onFreeze(false));
+      source.addEventListener("reset", onReset);
+      // The browser's own retry would reuse the spent ticket
+      source.onerror = reconnect;
+    };
+
+    connect();
+    return () => {
+      closed = true;
+      clearTimeout(retry);
+      source?.close();
+    };
+  }, [agent, token, loadChats, loadChat]);
 
   // ---------------- SCROLL-UP PATCH (FINAL) ----------------
   useEffect(() => {
@@ -269,7 +376,7 @@ export default function App() {
 
     el.addEventListener("scroll", handleScroll);
     return () => el.removeEventListener("scroll", handleScroll);
-  }, [selected, token, visibleCount, isLoadingOld]);
+  }, [selected, token, messages, hasOlder, isLoadingOld]);
 
   // ---------------- Load older messages ----------------
   const loadOlderMessages = async () => {
@@ -280,31 +387,17 @@ export default function App() {
     const prevScrollHeight = el?.scrollHeight || 0;
 
     try {
-      const res = await fetch(`${API_BASE}/chat/${selected}`, {
-        headers: { Authorization: `Bearer ${token}` },
-      });
+      const oldest = messages[0]?.id;
+      if (!hasOlder || oldest === undefined) return;
+
+      const res = await fetch(
+        `${API_BASE}/chat/${selected}?limit=${PAGE_SIZE}&before_id=${oldest}`,
+        { headers: { Authorization: `Bearer ${token}` } }
+      );
 
       const data = await res.json();
-      setTotalMessageCount(data.length);
-
-      const newCount = Math.min(visibleCount + 40, data.length);
-
-      const slice = data.slice(-newCount).map((m: any) => ({
-        sender: m.sender,
-        content: m.content,
-        time:
-          m.time ||
-          m.timestamp ||
-          m.created_at ||
-          m.sent_at ||
-          new Date().toLocaleTimeString([], {
-            hour: "2-digit",
-            minute: "2-digit",
-          }),
-      }));
-
-      setVisibleCount(newCount);
-      setMessages(slice);
+      setHasOlder(data.has_more);
+      setMessages((prev) => [...data.messages.map(toMessage), ...prev]);
 
       requestAnimationFrame(() => {
         if (el) {
@@ -471,6 +564,14 @@ return (
               </span>
             </div>
           ))}
+
+        {chatCursor && !searchQuery && (
+          <div className="flex justify-center p-2">
+            <button onClick={loadMoreChats} className="text-xs text-blue-600 hover:underline">
+              Load more chats
+            </button>
+          </div>
+        )}
       </div>
     </div>
 
@@ -528,7 +629,7 @@ return (
         {/* Load previous button */}
         {!isLoadingOld &&
           messages.length > 0 &&
-          visibleCount < totalMessageCount && (
+          hasOlder && (
             <div className="flex justify-center mb-2">
               <button
                 onClick={loadOlderMessages}
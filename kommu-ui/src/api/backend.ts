@@ -19,14 +19,14 @@ export async function getChats(token?: string) {
   const res = await axios.get(`${BASE_URL}/chats`, {
     headers: authHeaders(token),
   });
-  return res.data;
+  return res.data.chats;
 }
 
 export async function getChat(token: string, userId: string) {
   const res = await axios.get(`${BASE_URL}/chat/${userId}`, {
     headers: authHeaders(token),
   });
-  return res.data;
+  return res.data.messages;
 }
 
 export async function sendMessage(
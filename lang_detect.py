@@ -1,15 +1,190 @@
-from langdetect import detect, DetectorFactory
-DetectorFactory.seed = 42
+import re, math, threading
+from collections import Counter
+from functools import lru_cache
 
-def is_malay(text: str) -> bool:
-    t = (text or "").strip()
-    if not t:
-        return False
+import templates
+
+# ----------------- Lexicon -----------------
+# General function words (pronouns, particles, question words, connectives)
+# that on their own mark a WhatsApp message as BM or EN. Topic words (prices,
+# warranty, car parts) are left to the n-gram model, as are words used in
+# both ("ok", "tq", car models).
+_BM_WORDS = frozenset("""
+    ada adakah akan apa awak bagaimana belum berapa bila boleh bukan dah dalam dan dapat
+    dekat dengan di dia ialah ini itu je juga kah kalau kami kat ke kenapa ketika kita kot
+    lagi lah lepas macam mahu mana masa mcm nak ni perlu saja sahaja saya sebab sila sini
+    sudah sy tak tapi tidak tolong tu untuk ya yang
+""".split())
+
+_EN_WORDS = frozenset("""
+    about are be can could do does for from get have hello hey hi how i if is it me my
+    need no not of please the there thank thanks this to we what when where which will
+    with would yes you your
+""".split())
+
+# Extra chat-style lines so the n-gram model sees short, informal text too
+_SEED = {
+    "BM": [
+        "berapa harga kommu", "boleh pasang untuk kereta saya tak", "bila boleh hantar",
+        "kereta saya myvi tahun 2020 boleh sokong ke", "nak tanya pasal waranti",
+        "terima kasih banyak", "saya nak buat temujanji pemasangan", "pejabat buka pukul berapa",
+        "lampu tak berkelip", "macam mana nak claim waranti", "ada stok lagi tak",
+        "sila bantu saya", "dah pasang tapi tak berfungsi", "kat mana alamat pejabat",
+    ],
+    "EN": [
+        "how much is kommu", "can you install it on my car", "when can you deliver",
+        "is my 2020 honda city supported", "i want to ask about the warranty",
+        "thank you so much", "i would like to book an installation", "what time does the office open",
+        "the light is not blinking", "how do i claim warranty", "is it still in stock",
+        "please help me", "installed but it is not working", "where is your office",
+    ],
+}
+
+_TOKEN = re.compile(r"[a-z]+")
+_URL = re.compile(r"https?://\S+|\S+@\S+")
+
+# A lexicon verdict decides messages up to this many words
+SHORT_WORDS = 4
+# Mean per-n-gram log-odds the n-gram model needs before it is trusted
+NGRAM_MARGIN = 0.15
+# Shorter texts ("LA", "tq") carry too few n-grams to classify
+MIN_NGRAM_CHARS = 4
+
+
+def _normalize(text: str) -> str:
+    return " ".join(_TOKEN.findall(_URL.sub(" ", (text or "").lower())))
+
+
+def _ngrams(text: str, n_max: int = 3):
+    for word in text.split():
+        w = f" {word} "
+        for n in range(1, n_max + 1):
+            for i in range(len(w) - n + 1):
+                yield w[i:i + n]
+
+
+# ----------------- N-gram Model -----------------
+class NgramNB:
+    """Character 1–3-gram naive Bayes over two classes, trained once at import."""
+
+    def __init__(self, corpus: dict):
+        self.labels = tuple(corpus)
+        counts = {lab: Counter() for lab in self.labels}
+        for lab, texts in corpus.items():
+            for t in texts:
+                counts[lab].update(_ngrams(_normalize(t)))
+        vocab = set().union(*counts.values())
+        self.logp = {}
+        self.unseen = {}
+        for lab, c in counts.items():
+            total = sum(c.values()) + len(vocab) + 1
+            self.logp[lab] = {g: math.log((k + 1) / total) for g, k in c.items()}
+            self.unseen[lab] = math.log(1 / total)
+
+    def margin(self, text: str) -> float:
+        """Mean log-odds per n-gram of BM over EN (> 0 leans BM)."""
+        grams = list(_ngrams(text))
+        if not grams:
+            return 0.0
+        bm, en = self.logp["BM"], self.logp["EN"]
+        ubm, uen = self.unseen["BM"], self.unseen["EN"]
+        score = sum(bm.get(g, ubm) - en.get(g, uen) for g in grams)
+        return score / len(grams)
+
+
+def _training_corpus() -> dict:
+    corpus = {"BM": list(_SEED["BM"]), "EN": list(_SEED["EN"])}
+    for name in dir(templates):
+        fn = getattr(templates, name)
+        if name.startswith("reply_") and callable(fn):
+            corpus["BM"].append(fn("BM"))
+            corpus["EN"].append(fn("EN"))
+    corpus["BM"] += [templates.BM_GREETING, templates.FALLBACK_BM]
+    corpus["EN"] += [templates.EN_GREETING, templates.FALLBACK_EN]
+    corpus["BM"].append(" ".join(_BM_WORDS))
+    corpus["EN"].append(" ".join(_EN_WORDS))
+    return corpus
+
+
+_MODEL = NgramNB(_training_corpus())
+
+# ----------------- Detection -----------------
+_STATS = Counter()
+_STATS_LOCK = threading.Lock()
+
+_langdetect = None
+
+def _langdetect_is_malay(text: str) -> bool | None:
+    """Optional last resort; None when langdetect is unavailable or gives up."""
+    global _langdetect
+    if _langdetect is None:
+        try:
+            from langdetect import detect, DetectorFactory
+            DetectorFactory.seed = 42
+            _langdetect = detect
+        except ImportError:
+            _langdetect = False
+    if not _langdetect:
+        return None
     try:
-        code = detect(t)
-        return code in ("ms",)
-    except:
-        tl = " " + t.lower() + " "
-        bm_hits = sum(x in tl for x in [" ialah ", " anda ", " kami ", " yang ", " bila ", " bagaimana ", " di ", " ke ", " untuk ", " akan "])
-        en_hits = sum(x in tl for x in [" the ", " and ", " is ", " are ", " you ", " we "])
-        return bm_hits >= max(2, en_hits+1)
+        # langdetect labels most Malay as Indonesian
+        return _langdetect(text) in ("ms", "id")
+    except Exception:
+        return None
+
+
+def _count(layer: str):
+    with _STATS_LOCK:
+        _STATS[layer] += 1
+
+
+@lru_cache(maxsize=4096)
+def _detect(norm: str) -> str:
+    words = norm.split()
+    if not words:
+        _count("empty")
+        return "EN"
+
+    bm_hits = sum(w in _BM_WORDS for w in words)
+    en_hits = sum(w in _EN_WORDS for w in words)
+    if len(words) <= SHORT_WORDS:
+        if bm_hits != en_hits:
+            _count("lexicon")
+            return "BM" if bm_hits > en_hits else "EN"
+    elif bm_hits >= 2 * en_hits + 2 or en_hits >= 2 * bm_hits + 2:
+        _count("lexicon")
+        return "BM" if bm_hits > en_hits else "EN"
+
+    m = _MODEL.margin(norm) if len(norm) >= MIN_NGRAM_CHARS else 0.0
+    if abs(m) >= NGRAM_MARGIN:
+        _count("ngram")
+        return "BM" if m > 0 else "EN"
+
+    verdict = _langdetect_is_malay(norm) if len(words) > SHORT_WORDS else None
+    if verdict is not None:
+        _count("langdetect")
+        return "BM" if verdict else "EN"
+    _count("ngram_weak")
+    # Too little signal either way ("LA", "Myvi?"): keep the EN default
+    return "BM" if m > 0 and len(words) > SHORT_WORDS else "EN"
+
+
+def detect_lang(text: str) -> str:
+    """'BM' or 'EN' for one incoming message."""
+    return _detect(_normalize(text))
+
+
+def is_malay(text: str) -> bool:
+    return detect_lang(text) == "BM"
+
+
+def stats() -> dict:
+    info = _detect.cache_info()
+    total = info.hits + info.misses
+    with _STATS_LOCK:
+        layers = dict(_STATS)
+    return {
+        "layers": layers,
+        "cache_size": info.currsize,
+        "cache_hit_rate": round(info.hits / total, 3) if total else 0.0,
+    }
@@ -5,6 +5,8 @@ import sqlite3
 from datetime import datetime
 from typing import Optional
 
+from config import GRAPH_API_BASE
+
 # ----------------- Setup -----------------
 log = logging.getLogger(__name__)
 
@@ -24,7 +26,8 @@ DB_PATH = os.path.join(DATA_DIR, "media_log.db")
 # ----------------- Database Helpers -----------------
 def _db():
     """Open a connection to the local media_log SQLite DB."""
-    conn = sqlite3.connect(DB_PATH)
+    # Several worker processes may write at once; wait for the lock instead of failing
+    conn = sqlite3.connect(DB_PATH, timeout=10)
     conn.row_factory = sqlite3.Row
     return conn
 
@@ -33,6 +36,7 @@ def init_media_log():
     """Ensure media_log table exists"""
     try:
         conn = _db()
+        conn.execute("PRAGMA journal_mode=WAL")
         cur = conn.cursor()
         cur.execute("""
             CREATE TABLE IF NOT EXISTS media_log (
@@ -73,7 +77,7 @@ def get_media_url(media_id: str) -> Optional[str]:
         return None
     try:
         r = requests.get(
-            f"https://graph.facebook.com/v17.0/{media_id}",
+            f"{GRAPH_API_BASE}/{media_id}",
             headers={"Authorization": f"Bearer {META_TOKEN}"},
             timeout=15,
         )
@@ -0,0 +1,197 @@
+import re, threading, logging
+from collections import deque
+from functools import lru_cache
+
+from config import PROMPT_TOKEN_BUDGET, PROMPT_HISTORY_TOKENS, PROMPT_SCORE_GAP, PROMPT_DUP_JACCARD
+
+log = logging.getLogger("kai")
+
+# ----------------- Token Counting -----------------
+# tiktoken when installed; DeepSeek's tokenizer is close enough to cl100k
+# for budgeting. Otherwise a word/punctuation heuristic calibrated to it.
+try:
+    import tiktoken
+    _ENC = tiktoken.get_encoding("cl100k_base")
+    TOKENIZER = "tiktoken"
+except Exception:
+    _ENC = None
+    TOKENIZER = "heuristic"
+
+_PIECES = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+_WORDS = re.compile(r"\w+", re.UNICODE)
+
+
+@lru_cache(maxsize=4096)
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    if _ENC is not None:
+        return len(_ENC.encode(text, disallowed_special=()))
+    # ~1 token per short word or symbol, longer words split every ~6 chars
+    return sum(1 + (len(p) - 1) // 6 for p in _PIECES.findall(text))
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    if max_tokens <= 0:
+        return ""
+    if _ENC is not None:
+        ids = _ENC.encode(text, disallowed_special=())
+        return text if len(ids) <= max_tokens else _ENC.decode(ids[:max_tokens]) + " …"
+    out, used = [], 0
+    for m in re.finditer(r"\S+\s*", text):
+        cost = count_tokens(m.group())
+        if used + cost > max_tokens:
+            return "".join(out).rstrip() + " …"
+        out.append(m.group())
+        used += cost
+    return text
+
+
+def _shingles(text: str) -> frozenset:
+    return frozenset(w.lower() for w in _WORDS.findall(text))
+
+
+def _jaccard(a: frozenset, b: frozenset) -> float:
+    return len(a & b) / len(a | b) if a and b else 0.0
+
+
+# ----------------- Size Stats -----------------
+class PromptStats:
+    """Rolling prompt-size samples so the budget can be tuned from /admin/stats."""
+
+    def __init__(self, maxlen: int = 1000):
+        self._lock = threading.Lock()
+        self.total = deque(maxlen=maxlen)
+        self.context = deque(maxlen=maxlen)
+        self.history = deque(maxlen=maxlen)
+        self.blocks_dropped = 0
+        self.blocks_truncated = 0
+        self.turns_dropped = 0
+
+    def record(self, info: dict):
+        with self._lock:
+            self.total.append(info["tokens"])
+            self.context.append(info["context_tokens"])
+            self.history.append(info["history_tokens"])
+            self.blocks_dropped += info["blocks_dropped"]
+            self.blocks_truncated += info["blocks_truncated"]
+            self.turns_dropped += info["turns_dropped"]
+
+    @staticmethod
+    def _dist(values) -> dict:
+        vals = sorted(values)
+        if not vals:
+            return {"p50": 0, "p95": 0, "max": 0}
+        pick = lambda q: vals[min(len(vals) - 1, int(len(vals) * q))]
+        return {"p50": pick(0.5), "p95": pick(0.95), "max": vals[-1]}
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "tokenizer": TOKENIZER,
+                "budget": PROMPT_TOKEN_BUDGET,
+                "prompts": len(self.total),
+                "tokens": self._dist(self.total),
+                "context_tokens": self._dist(self.context),
+                "history_tokens": self._dist(self.history),
+                "blocks_dropped": self.blocks_dropped,
+                "blocks_truncated": self.blocks_truncated,
+                "turns_dropped": self.turns_dropped,
+            }
+
+
+PROMPT_STATS = PromptStats()
+
+
+# ----------------- Builder -----------------
+# Smallest truncated block still worth adding after the first one
+MIN_BLOCK_TOKENS = 64
+
+
+def pack_context(hits: list, format_block, budget: int) -> tuple[str, dict]:
+    """
+    Keep the best-ranked hits (fused RRF rank when present, else score)
+    that fit in `budget` tokens. Hits scoring more than PROMPT_SCORE_GAP
+    below the best one without a lexical match, and near-duplicates of a
+    block already kept, are dropped first. Blocks that don't fit are cut
+    to the remaining room; the best block is always kept, truncated if need be.
+    """
+    ranked = sorted(hits, key=lambda h: h.get("rrf", h.get("score", 0.0)), reverse=True)
+    info = {"blocks": len(ranked), "blocks_dropped": 0, "blocks_truncated": 0}
+    if not ranked:
+        return "", info
+    floor = max(h.get("score", 0.0) for h in ranked) - PROMPT_SCORE_GAP
+    sep = "\n\n---\n\n"
+    sep_cost = count_tokens(sep)
+
+    kept, seen, used = [], [], 0
+    for h in ranked:
+        # Exact-term matches (model codes, prices) stay even when their embedding is off
+        if kept and h.get("score", 0.0) < floor and not h.get("bm25"):
+            info["blocks_dropped"] += 1
+            continue
+        block = format_block([h])
+        sh = _shingles(block)
+        if any(_jaccard(sh, s) >= PROMPT_DUP_JACCARD for s in seen):
+            info["blocks_dropped"] += 1
+            continue
+        extra = sep_cost if kept else 0
+        cost = count_tokens(block) + extra
+        if used + cost > budget:
+            # Long passages (website pages) are cut to the room left, if it is worth it
+            room = budget - used - extra
+            if kept and room < MIN_BLOCK_TOKENS:
+                info["blocks_dropped"] += 1
+                continue
+            block = _truncate(block, room)
+            cost = count_tokens(block) + extra
+            info["blocks_truncated"] += 1
+        kept.append(block)
+        seen.append(sh)
+        used += cost
+    return sep.join(kept), info
+
+
+def trim_history(turns: list, budget: int) -> tuple[str, int]:
+    """Newest turns first until `budget` is spent; returns (text, turns dropped)."""
+    lines, used = [], 0
+    for h in reversed(turns):
+        line = f"{h['role']}: {h['text']}"
+        cost = count_tokens(line) + 1
+        if used + cost > budget:
+            break
+        lines.append(line)
+        used += cost
+    return "\n".join(reversed(lines)), len(turns) - len(lines)
+
+
+def build_prompt(system_prompt: str, user_text: str, hits: list, format_block,
+                 history: list | None = None, lang_instruction: str = "",
+                 budget: int = PROMPT_TOKEN_BUDGET) -> tuple[str, str]:
+    """
+    Return (system, user) prompts that fit `budget` tokens. The system
+    prompt, question and language line are always kept; context gets what
+    remains after a history allowance of at most PROMPT_HISTORY_TOKENS,
+    and history then takes whatever context left unused.
+    """
+    fixed = count_tokens(system_prompt) + count_tokens(f"User: {user_text}") + count_tokens(lang_instruction) + 8
+    remaining = max(0, budget - fixed)
+    history = history or []
+    history_cap = min(PROMPT_HISTORY_TOKENS, remaining // 3) if history else 0
+
+    context, info = pack_context(hits, format_block, remaining - history_cap)
+    context_tokens = count_tokens(context)
+    history_text, turns_dropped = trim_history(history, min(PROMPT_HISTORY_TOKENS, remaining - context_tokens))
+
+    user_prompt = f"{history_text}\nUser: {user_text}\n\nContext:\n{context}\n\n{lang_instruction}".lstrip()
+    info.update(
+        tokens=count_tokens(system_prompt) + count_tokens(user_prompt),
+        context_tokens=context_tokens,
+        history_tokens=count_tokens(history_text),
+        turns_dropped=turns_dropped,
+    )
+    PROMPT_STATS.record(info)
+    log.info(f"[Prompt] tokens={info['tokens']}/{budget} context={context_tokens} "
+             f"blocks={info['blocks'] - info['blocks_dropped']}/{info['blocks']} "
+             f"history={info['history_tokens']} turns_dropped={turns_dropped}")
+    return system_prompt, user_prompt
@@ -0,0 +1,133 @@
+import os, re, json, math
+import numpy as np
+
+BM25_FILE = "bm25.json"
+BM25_FORMAT = 1
+
+K1 = 1.5
+B = 0.75
+
+# Fillers that carry no retrieval signal in either language
+_STOPWORDS = frozenset("""
+a an the is are was were be been am do does did i you we they it its my your our me us to of in on at for
+from with and or but if so as by can could would should will what which who how when where why this that
+these those there here please pls hi hello any some about
+apa ini itu saya awak anda kami kita dia ke di dari dan atau yang untuk dengan boleh nak tak tidak ada
+ya je lah pun kah ke macam mana bila berapa sebab kenapa tu ni
+""".split())
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+# "RM4,999" / "4.999" → "rm 4999"
+_THOUSANDS = re.compile(r"(?<=\d)[,.](?=\d{3}\b)")
+_CURRENCY = re.compile(r"\brm(?=\d)")
+
+
+def tokenize(text: str) -> list[str]:
+    """Lowercased word/number tokens; keeps model codes like "x70" and "ka2" whole."""
+    text = _CURRENCY.sub("rm ", _THOUSANDS.sub("", (text or "").lower()))
+    out = []
+    for tok in _TOKEN.findall(text):
+        if tok in _STOPWORDS:
+            continue
+        # Crude plural folding ("cars" → "car") for plain English words only
+        if len(tok) > 4 and tok.isalpha() and tok.endswith("s") and not tok.endswith("ss"):
+            tok = tok[:-1]
+        out.append(tok)
+    return out
+
+
+class BM25Index:
+    """
+    In-memory Okapi BM25 over the same rows as the FAISS index (doc id ==
+    FAISS id). Postings are kept as numpy arrays with the length-normalised
+    term weight precomputed, so a query is a handful of vector adds.
+    """
+
+    def __init__(self, postings: dict, doc_len: list, k1: float = K1, b: float = B):
+        self.k1 = k1
+        self.b = b
+        self.doc_len = np.asarray(doc_len, dtype=np.float32)
+        self.n = len(doc_len)
+        self.avgdl = float(self.doc_len.mean()) if self.n else 0.0
+        self._raw = postings
+        self._terms: dict[str, tuple] = {}
+        norm = k1 * (1 - b + b * self.doc_len / (self.avgdl or 1.0))
+        for term, plist in postings.items():
+            ids = np.fromiter((p[0] for p in plist), dtype=np.int64, count=len(plist))
+            tf = np.fromiter((p[1] for p in plist), dtype=np.float32, count=len(plist))
+            df = len(plist)
+            idf = math.log(1 + (self.n - df + 0.5) / (df + 0.5))
+            self._terms[term] = (ids, tf * (k1 + 1) / (tf + norm[ids]), idf)
+        # Weight given to query terms the corpus has never seen (as rare as it gets)
+        self.max_idf = math.log(1 + (self.n + 0.5) / 0.5) if self.n else 0.0
+
+    @classmethod
+    def from_texts(cls, texts) -> "BM25Index":
+        postings, doc_len = {}, []
+        for doc_id, text in enumerate(texts):
+            toks = tokenize(text)
+            doc_len.append(len(toks))
+            counts = {}
+            for t in toks:
+                counts[t] = counts.get(t, 0) + 1
+            for t, c in counts.items():
+                postings.setdefault(t, []).append([doc_id, c])
+        return cls(postings, doc_len)
+
+    def save(self, path: str):
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"format": BM25_FORMAT, "k1": self.k1, "b": self.b,
+                       "doc_len": self.doc_len.astype(int).tolist(), "postings": self._raw}, f, separators=(",", ":"))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("format") != BM25_FORMAT:
+            raise ValueError(f"unsupported bm25 format {data.get('format')}")
+        return cls(data["postings"], data["doc_len"], data.get("k1", K1), data.get("b", B))
+
+    def search(self, query: str, topk: int = 10) -> tuple[list, float]:
+        """
+        Return ([(doc_id, score), ...], coverage) where coverage is the share
+        of the query's idf mass that the top document contains.
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms or not self.n:
+            return [], 0.0
+        scores = np.zeros(self.n, dtype=np.float32)
+        matched = np.zeros(self.n, dtype=np.float32)
+        total_idf = 0.0
+        for t in terms:
+            entry = self._terms.get(t)
+            if entry is None:
+                total_idf += self.max_idf
+                continue
+            ids, weight, idf = entry
+            scores[ids] += idf * weight
+            matched[ids] += idf
+            total_idf += idf
+        k = min(topk, self.n)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        ranked = [(int(i), float(scores[i])) for i in top if scores[i] > 0]
+        coverage = float(matched[ranked[0][0]] / total_idf) if ranked and total_idf else 0.0
+        return ranked, coverage
+
+    def stats(self) -> dict:
+        return {"docs": self.n, "terms": len(self._terms), "avgdl": round(self.avgdl, 1)}
+
+
+def rrf_fuse(rankings, k: int = 60) -> list[tuple[int, float]]:
+    """Reciprocal rank fusion of several ranked id lists → [(id, fused score), ...] best first."""
+    fused = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(fused.items(), key=lambda kv: kv[1], reverse=True)
+
+
+def entry_text(entry: dict) -> str:
+    return f"{entry.get('question', '')} {entry.get('answer', '')}"
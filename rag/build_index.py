@@ -1,7 +1,10 @@
-import os, json, pickle
+import os, json, shutil
 import numpy as np, faiss
 from fastembed import TextEmbedding
 from config import SOP_JSON_PATH, FAISS_DIR
+from rag.index_store import write_index, new_version_dir, publish_build
+from rag.embed_cache import embed_corpus
+from car_compat import save_compat
 
 PREFERRED = [
     "intfloat/multilingual-e5-small",
@@ -51,23 +54,31 @@ def build():
 
     os.makedirs(FAISS_DIR, exist_ok=True)
     model_name = _pick_model()
-    embedder = TextEmbedding(model_name=model_name)
 
     corpus = [f"Q: {d['question']} A: {d['answer']}" for d in data]
 
-    vecs = []
-    for emb in embedder.embed(corpus, batch_size=64):
-        vecs.append(_normalize(np.array(emb, dtype=np.float32)))
-    embs = np.vstack(vecs)   # [N, D]
+    def _embed(texts):
+        embedder = TextEmbedding(model_name=model_name)
+        return np.vstack([_normalize(np.array(emb, dtype=np.float32))
+                          for emb in embedder.embed(texts, batch_size=64)])
+
+    embs, stats = embed_corpus(corpus, model_name, "fastembed", _embed)   # [N, D]
+    print(f"[fastembed] Vectors reused={stats['reused']} computed={stats['computed']}")
     dim = embs.shape[1]
 
     index = faiss.IndexFlatIP(dim)
     index.add(embs.astype(np.float32))
 
-    with open(os.path.join(FAISS_DIR, "index.pkl"), "wb") as f:
-        pickle.dump({"data": data, "model": model_name}, f)
-    faiss.write_index(index, os.path.join(FAISS_DIR, "index.faiss"))
-    print(f"Indexed {len(data)} entries → {FAISS_DIR}")
+    version_dir = new_version_dir(FAISS_DIR)
+    try:
+        write_index(version_dir, index, data, model_name)
+        save_compat(version_dir, data)
+        publish_build(FAISS_DIR, version_dir)
+    except Exception:
+        shutil.rmtree(version_dir, ignore_errors=True)
+        raise
+    print(f"Indexed {len(data)} entries → {version_dir}")
+    return stats
 
 if __name__ == "__main__":
     build()
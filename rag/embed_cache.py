@@ -0,0 +1,79 @@
+import os, sqlite3, hashlib
+import numpy as np
+from config import EMBED_CACHE_PATH
+
+
+def text_sha(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def cache_model_key(model_name: str, backend: str) -> str:
+    """fastembed and sentence-transformers give different vectors for one model name."""
+    return f"{model_name}@{backend}"
+
+
+class EmbeddingCache:
+    """On-disk vectors keyed by (model name @ backend, sha256 of the embedded text)."""
+
+    def __init__(self, path: str = EMBED_CACHE_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=30)
+        with self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS vectors (
+                    model TEXT NOT NULL,
+                    sha TEXT NOT NULL,
+                    dim INTEGER NOT NULL,
+                    vec BLOB NOT NULL,
+                    PRIMARY KEY (model, sha)
+                )
+            """)
+
+    def get_many(self, model: str, shas) -> dict:
+        found = {}
+        shas = list(shas)
+        for i in range(0, len(shas), 500):
+            chunk = shas[i:i + 500]
+            rows = self.conn.execute(
+                f"SELECT sha, dim, vec FROM vectors WHERE model=? AND sha IN ({','.join('?' * len(chunk))})",
+                [model, *chunk]
+            ).fetchall()
+            for sha, dim, blob in rows:
+                found[sha] = np.frombuffer(blob, dtype=np.float32, count=dim)
+        return found
+
+    def put_many(self, model: str, items):
+        with self.conn:
+            self.conn.executemany(
+                "REPLACE INTO vectors (model, sha, dim, vec) VALUES (?,?,?,?)",
+                [(model, sha, int(vec.shape[0]), np.asarray(vec, dtype=np.float32).tobytes()) for sha, vec in items]
+            )
+
+    def close(self):
+        self.conn.close()
+
+
+def embed_corpus(corpus: list, model_name: str, backend: str, embed_fn, cache: EmbeddingCache | None = None):
+    """
+    Return (vectors [N, D], stats) for `corpus`, embedding only texts that
+    are not already cached for `model_name` on `backend`. `embed_fn(texts)`
+    must return the final (normalized) float32 vectors from that backend
+    and is not called at all when everything is cached.
+    """
+    own = cache is None
+    cache = cache or EmbeddingCache()
+    key = cache_model_key(model_name, backend)
+    try:
+        shas = [text_sha(t) for t in corpus]
+        found = cache.get_many(key, set(shas))
+        missing = [i for i, s in enumerate(shas) if s not in found]
+        if missing:
+            fresh = np.asarray(embed_fn([corpus[i] for i in missing]), dtype=np.float32)
+            cache.put_many(key, [(shas[i], fresh[j]) for j, i in enumerate(missing)])
+            for j, i in enumerate(missing):
+                found[shas[i]] = fresh[j]
+        vecs = np.vstack([found[s] for s in shas]).astype(np.float32) if shas else np.zeros((0, 0), np.float32)
+        return vecs, {"reused": len(corpus) - len(missing), "computed": len(missing)}
+    finally:
+        if own:
+            cache.close()
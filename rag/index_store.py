@@ -0,0 +1,249 @@
+import os, json, pickle, sqlite3, hashlib, threading, shutil, time, uuid
+import numpy as np
+import faiss
+
+from rag.bm25 import BM25Index, BM25_FILE, entry_text
+
+FAISS_INDEX_FILE = "index.faiss"
+META_DB_FILE = "meta.sqlite"
+LEGACY_META_FILE = "index.pkl"
+
+# Versioned layout: <root>/versions/<name>/{index.faiss,meta.sqlite,bm25.json} plus
+# <root>/CURRENT naming the live version
+VERSIONS_DIR = "versions"
+CURRENT_FILE = "CURRENT"
+KEEP_VERSIONS = int(os.getenv("RAG_KEEP_VERSIONS", "3"))
+
+# Load FAISS indexes memory-mapped so several workers share the page cache
+RAG_MMAP = os.getenv("RAG_MMAP", "1") not in ("0", "false", "no")
+
+_CORE_FIELDS = ("question", "answer", "source")
+
+
+def _file_digest(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()[:16]
+
+
+def write_index(out_dir: str, index, entries: list, model_name: str):
+    """
+    Write `index.faiss`, a `meta.sqlite` sidecar holding one row per
+    vector (row id == FAISS id) and the matching `bm25.json` lexical index.
+    Files are written next to the targets and moved into place so readers
+    never see a partial file.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    index_path = os.path.join(out_dir, FAISS_INDEX_FILE)
+    meta_path = os.path.join(out_dir, META_DB_FILE)
+
+    tmp_index = index_path + ".tmp"
+    faiss.write_index(index, tmp_index)
+    version = _file_digest(tmp_index)
+
+    tmp_meta = meta_path + ".tmp"
+    if os.path.exists(tmp_meta):
+        os.remove(tmp_meta)
+    conn = sqlite3.connect(tmp_meta)
+    with conn:
+        conn.execute("""
+            CREATE TABLE entries (
+                id INTEGER PRIMARY KEY,
+                question TEXT,
+                answer TEXT,
+                source TEXT,
+                extra TEXT
+            )
+        """)
+        conn.execute("CREATE TABLE info (key TEXT PRIMARY KEY, value TEXT)")
+        conn.executemany(
+            "INSERT INTO entries (id, question, answer, source, extra) VALUES (?,?,?,?,?)",
+            [
+                (i, e.get("question", ""), e.get("answer", ""), e.get("source"),
+                 json.dumps({k: v for k, v in e.items() if k not in _CORE_FIELDS}, ensure_ascii=False))
+                for i, e in enumerate(entries)
+            ]
+        )
+        conn.executemany("INSERT INTO info (key, value) VALUES (?,?)", [
+            ("model", model_name),
+            ("count", str(len(entries))),
+            ("version", version),
+        ])
+    conn.close()
+
+    BM25Index.from_texts(entry_text(e) for e in entries).save(os.path.join(out_dir, BM25_FILE))
+    os.replace(tmp_index, index_path)
+    os.replace(tmp_meta, meta_path)
+    return version
+
+
+# ----------------- Versioned Directories -----------------
+def new_version_dir(root: str) -> str:
+    """Create an empty directory for the next build under <root>/versions."""
+    name = time.strftime("%Y%m%d-%H%M%S") + "-" + uuid.uuid4().hex[:6]
+    path = os.path.join(root, VERSIONS_DIR, name)
+    os.makedirs(path)
+    return path
+
+
+def resolve_index_dir(root: str) -> str:
+    """Directory of the live build: the CURRENT version, or `root` itself for flat legacy layouts."""
+    try:
+        with open(os.path.join(root, CURRENT_FILE), "r", encoding="utf-8") as f:
+            name = f.read().strip()
+        if name:
+            return os.path.join(root, VERSIONS_DIR, name)
+    except FileNotFoundError:
+        pass
+    return root
+
+
+def validate_index_dir(path: str) -> int:
+    """Check a finished build before publishing it; returns the entry count."""
+    index = faiss.read_index(os.path.join(path, FAISS_INDEX_FILE))
+    meta = MetaStore(os.path.join(path, META_DB_FILE))
+    try:
+        count = meta.count()
+        if count == 0 or index.ntotal != count:
+            raise ValueError(f"index has {index.ntotal} vectors but metadata lists {count}")
+        probe = index.reconstruct(0).reshape(1, -1).astype(np.float32)
+        _, ids = index.search(probe, 1)
+        if int(ids[0][0]) < 0 or not meta.fetch([int(ids[0][0])]):
+            raise ValueError("probe search returned no metadata row")
+        bm25_path = os.path.join(path, BM25_FILE)
+        if os.path.exists(bm25_path) and BM25Index.load(bm25_path).n != count:
+            raise ValueError(f"bm25 index does not cover the {count} entries")
+        return count
+    finally:
+        meta.close()
+
+
+def publish_version(root: str, version_dir: str):
+    """Atomically point <root>/CURRENT at `version_dir`."""
+    tmp = os.path.join(root, CURRENT_FILE + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(os.path.basename(version_dir))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, os.path.join(root, CURRENT_FILE))
+
+
+def gc_versions(root: str, keep: int = KEEP_VERSIONS) -> list:
+    """Delete all but the newest `keep` versions (never the current one)."""
+    base = os.path.join(root, VERSIONS_DIR)
+    if not os.path.isdir(base):
+        return []
+    current = os.path.basename(resolve_index_dir(root))
+    names = sorted(os.listdir(base), reverse=True)
+    removed = []
+    for name in names[max(keep, 1):]:
+        if name != current:
+            shutil.rmtree(os.path.join(base, name), ignore_errors=True)
+            removed.append(name)
+    return removed
+
+
+def publish_build(root: str, version_dir: str) -> int:
+    """Validate, publish and garbage-collect one finished build."""
+    count = validate_index_dir(version_dir)
+    publish_version(root, version_dir)
+    removed = gc_versions(root)
+    print(f"[RAG] Published {os.path.basename(version_dir)} ({count} entries); removed {len(removed)} old versions")
+    return count
+
+
+def load_bm25(index_dir: str, meta: "MetaStore") -> BM25Index:
+    """The build's lexical index; older builds without one get it rebuilt from metadata."""
+    path = os.path.join(index_dir, BM25_FILE)
+    if os.path.exists(path):
+        try:
+            return BM25Index.load(path)
+        except Exception as e:
+            print(f"[RAG] Ignoring unreadable {path}: {e}")
+    print(f"[RAG] No {BM25_FILE} in {index_dir}; building lexical index from metadata")
+    return BM25Index.from_texts(entry_text(item) for _, item in meta.iter_all())
+
+
+def read_faiss_index(path: str):
+    """
+    Read an index memory-mapped when enabled, falling back to a private copy.
+    Only IO_FLAG_MMAP_IFC (faiss >= 1.11) maps flat vectors in place; with
+    older faiss, or when it fails, each process holds its own full copy
+    (a 200k x 768 IndexFlatIP: +0 MB RSS mapped vs +586 MB copied).
+    """
+    if RAG_MMAP:
+        if hasattr(faiss, "IO_FLAG_MMAP_IFC"):
+            try:
+                return faiss.read_index(path, faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+            except Exception as e:
+                print(f"[RAG] Memory-mapped read of {path} failed ({e}); loading a private copy")
+        else:
+            print(f"[RAG] faiss {faiss.__version__} cannot memory-map flat indexes; loading a private copy")
+    return faiss.read_index(path)
+
+
+def convert_legacy_meta(base_dir: str) -> bool:
+    """One-off conversion of an old `index.pkl` into the SQLite sidecar."""
+    pkl_path = os.path.join(base_dir, LEGACY_META_FILE)
+    index_path = os.path.join(base_dir, FAISS_INDEX_FILE)
+    if not (os.path.exists(pkl_path) and os.path.exists(index_path)):
+        return False
+    with open(pkl_path, "rb") as f:
+        meta = pickle.load(f)
+    index = faiss.read_index(index_path)
+    write_index(base_dir, index, meta["data"], meta.get("model") or "intfloat/multilingual-e5-base")
+    os.remove(pkl_path)
+    print(f"[RAG] Converted {pkl_path} → {META_DB_FILE}")
+    return True
+
+
+class MetaStore:
+    """Read-only access to the entry sidecar; fetches only the rows asked for."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._pid = None
+        self._lock = threading.Lock()
+        with self._lock:
+            self.info = dict(self._db().execute("SELECT key, value FROM info").fetchall())
+
+    def _db(self) -> sqlite3.Connection:
+        # Reopened in each worker when the store was loaded before a fork (gunicorn --preload)
+        if self._pid != os.getpid():
+            self._conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            self._pid = os.getpid()
+        return self._conn
+
+    def _row_to_item(self, row) -> dict:
+        _, question, answer, source, extra = row
+        item = json.loads(extra) if extra else {}
+        item["question"] = question
+        item["answer"] = answer
+        if source is not None:
+            item["source"] = source
+        return item
+
+    def fetch(self, ids) -> dict:
+        ids = [int(i) for i in ids]
+        if not ids:
+            return {}
+        with self._lock:
+            rows = self._db().execute(
+                f"SELECT id, question, answer, source, extra FROM entries WHERE id IN ({','.join('?' * len(ids))})",
+                ids
+            ).fetchall()
+        return {r[0]: self._row_to_item(r) for r in rows}
+
+    def iter_all(self):
+        with self._lock:
+            rows = self._db().execute("SELECT id, question, answer, source, extra FROM entries ORDER BY id").fetchall()
+        for r in rows:
+            yield r[0], self._row_to_item(r)
+
+    def count(self) -> int:
+        return int(self.info.get("count", 0))
+
+    def close(self):
+        self._conn.close()
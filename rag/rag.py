@@ -1,9 +1,23 @@
-import os, pickle
+import os, time, threading
+from collections import OrderedDict
 import numpy as np
-import faiss
 
-FAISS_INDEX_FILE = "index.faiss"
-META_FILE = "index.pkl"
+from rag.bm25 import rrf_fuse
+from rag.index_store import (
+    FAISS_INDEX_FILE, META_DB_FILE, MetaStore, read_faiss_index, convert_legacy_meta, resolve_index_dir,
+    load_bm25
+)
+
+QUERY_CACHE_SIZE = int(os.getenv("RAG_QUERY_CACHE_SIZE", "1024"))
+
+# Hybrid retrieval: BM25 and vector rankings fused with RRF; a lexical match
+# that is strong enough on its own skips embedding the query entirely
+RRF_K = int(os.getenv("RAG_RRF_K", "60"))
+HYBRID_DEPTH = int(os.getenv("RAG_HYBRID_DEPTH", "20"))
+LEXICAL_FAST_PATH = os.getenv("RAG_LEXICAL_FAST_PATH", "1") not in ("0", "false", "no")
+LEXICAL_MIN_SCORE = float(os.getenv("RAG_LEXICAL_MIN_SCORE", "5.0"))
+LEXICAL_MIN_COVERAGE = float(os.getenv("RAG_LEXICAL_MIN_COVERAGE", "0.95"))
+LEXICAL_MARGIN = float(os.getenv("RAG_LEXICAL_MARGIN", "1.5"))
 
 def _l2_normalize(vec: np.ndarray) -> np.ndarray:
     if vec.ndim == 1:
@@ -13,73 +27,290 @@ def _l2_normalize(vec: np.ndarray) -> np.ndarray:
     n[n == 0] = 1.0
     return vec / n
 
-class RAGEngine:
-    def __init__(self, k=4, base_dir=None):
-        self.k = k
-        self.base_dir = base_dir or os.path.join(os.path.dirname(__file__), "faiss_index")
-        meta_path = os.path.join(self.base_dir, META_FILE)
-        index_path = os.path.join(self.base_dir, FAISS_INDEX_FILE)
+def _norm_query(text: str) -> str:
+    return " ".join((text or "").lower().split())
 
-        if not (os.path.exists(meta_path) and os.path.exists(index_path)):
-            raise FileNotFoundError(f"Missing FAISS artifacts in {self.base_dir}")
+class QueryEmbeddingCache:
+    """Bounded LRU of query vectors keyed on (model name, normalized query)."""
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._items: OrderedDict[tuple, np.ndarray] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple):
+        with self._lock:
+            vec = self._items.get(key)
+            if vec is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return vec
+
+    def put(self, key: tuple, vec: np.ndarray):
+        if self.maxsize <= 0:
+            return
+        vec.setflags(write=False)
+        with self._lock:
+            self._items[key] = vec
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._items),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
+
+QUERY_CACHE = QueryEmbeddingCache(QUERY_CACHE_SIZE)
+
+class RetrievalStats:
+    """How often queries took the lexical fast path vs the embed + fuse path."""
 
-        with open(meta_path, "rb") as f:
-            meta = pickle.load(f)
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.lexical_only = 0
+        self.hybrid = 0
+        self.embeddings_skipped = 0
+        self.lexical_ms = 0.0
 
-        self.data = meta["data"]
-        self.model_name = meta.get("model") or "intfloat/multilingual-e5-base"
+    def record(self, fast: bool, lexical_s: float):
+        with self._lock:
+            if fast:
+                self.lexical_only += 1
+            else:
+                self.hybrid += 1
+            self.lexical_ms += lexical_s * 1000
+
+    def skipped_embedding(self):
+        with self._lock:
+            self.embeddings_skipped += 1
+
+    def snapshot(self) -> dict:
+        total = self.lexical_only + self.hybrid
+        return {
+            "lexical_only": self.lexical_only,
+            "hybrid": self.hybrid,
+            "fast_path_rate": round(self.lexical_only / total, 3) if total else 0.0,
+            "embeddings_skipped": self.embeddings_skipped,
+            "lexical_ms_avg": round(self.lexical_ms / total, 3) if total else 0.0,
+        }
+
+RETRIEVAL_STATS = RetrievalStats()
+
+def _fastembed_names(raw) -> set:
+    names = set()
+    for it in raw:
+        if isinstance(it, str):
+            names.add(it)
+        elif isinstance(it, dict) and isinstance(it.get("model"), str):
+            names.add(it["model"])
+    return names
+
+def embedder_backend(model_name: str) -> str:
+    """Backend an Embedder picks for `model_name`, without loading it: "fastembed" or "st"."""
+    try:
+        from fastembed import TextEmbedding
+        if model_name in _fastembed_names(TextEmbedding.list_supported_models()):
+            return "fastembed"
+    except Exception:
+        pass
+    return "st"
+
+class Embedder:
+    """One loaded embedding model: fastembed (ONNX) when supported, else SentenceTransformer."""
 
+    def __init__(self, model_name: str):
+        self.model_name = model_name
         self.backend = None
-        self.embedder = None
+        self.model = None
         try:
-            from fastembed import TextEmbedding
-            supported = set(TextEmbedding.list_supported_models())
-            if self.model_name in supported:
-                self.embedder = TextEmbedding(model_name=self.model_name)
-                self.backend = "fastembed"
-            else:
+            if embedder_backend(model_name) != "fastembed":
                 raise ValueError("model_not_supported_by_fastembed")
+            from fastembed import TextEmbedding
+            self.model = TextEmbedding(model_name=model_name)
+            self.backend = "fastembed"
         except Exception:
             from sentence_transformers import SentenceTransformer
-            self.embedder = SentenceTransformer(self.model_name)
+            self.model = SentenceTransformer(model_name)
             self.backend = "st"
 
-        self.index = faiss.read_index(index_path)
-
-    def _embed(self, texts):
+    def embed(self, texts) -> np.ndarray:
         if self.backend == "fastembed":
             out = []
-            for emb in self.embedder.embed(texts, batch_size=64):
+            for emb in self.model.embed(texts, batch_size=64):
                 out.append(np.array(emb, dtype=np.float32))
             return np.vstack(out)
-        else:
-            arr = self.embedder.encode(
-                texts,
-                convert_to_numpy=True,
-                normalize_embeddings=False,
-                show_progress_bar=False
-            ).astype("float32")
-            return arr
+        return self.model.encode(
+            texts,
+            convert_to_numpy=True,
+            normalize_embeddings=False,
+            show_progress_bar=False
+        ).astype("float32")
 
-    def _embed_query(self, text: str) -> np.ndarray:
-        emb = self._embed([text])
-        emb = _l2_normalize(emb).astype("float32")
+    def embed_query(self, text: str) -> np.ndarray:
+        """
+        L2-normalized [1, D] query vector, served from QUERY_CACHE when possible.
+        The normalized text is only the cache key; the model sees `text` as typed.
+        """
+        key = (self.model_name, _norm_query(text))
+        emb = QUERY_CACHE.get(key)
+        if emb is None:
+            emb = _l2_normalize(self.embed([text])).astype("float32")
+            QUERY_CACHE.put(key, emb)
         return emb
 
+# Process-wide registry: every RAGEngine using the same model shares one instance
+_EMBEDDERS: dict[str, Embedder] = {}
+_EMBEDDERS_LOCK = threading.Lock()
+
+def get_embedder(model_name: str) -> Embedder:
+    with _EMBEDDERS_LOCK:
+        emb = _EMBEDDERS.get(model_name)
+        if emb is None:
+            emb = _EMBEDDERS[model_name] = Embedder(model_name)
+        return emb
+
+def multi_search(engines, query: str, topk: int = None) -> list[list[dict]]:
+    """
+    Search several engines for one query. Each engine runs BM25 first; a
+    strong lexical match is served as is, otherwise the query is embedded
+    (once per model) and both rankings are fused. Returns one hit list per
+    engine (empty for engines that are None).
+    """
+    vectors = {}
+    results = []
+    for engine in engines:
+        if engine is None:
+            results.append([])
+            continue
+        t0 = time.perf_counter()
+        ranked, coverage = engine.search_lexical(query, topk=max(topk or engine.k, HYBRID_DEPTH))
+        strong = engine.lexical_is_strong(ranked, coverage)
+        RETRIEVAL_STATS.record(strong, time.perf_counter() - t0)
+        if strong:
+            results.append(engine.lexical_hits(ranked, topk=topk))
+            continue
+        if engine.model_name not in vectors:
+            vectors[engine.model_name] = engine.embedder.embed_query(query)
+        results.append(engine.search_hybrid(vectors[engine.model_name], ranked, topk=topk))
+    if any(e is not None for e in engines) and not vectors:
+        RETRIEVAL_STATS.skipped_embedding()
+    return results
+
+class RAGEngine:
+    def __init__(self, k=4, base_dir=None):
+        self.k = k
+        self.base_dir = base_dir or os.path.join(os.path.dirname(__file__), "faiss_index")
+        # Pin the build that is live right now; later publishes don't affect this engine
+        self.index_dir = resolve_index_dir(self.base_dir)
+        meta_path = os.path.join(self.index_dir, META_DB_FILE)
+        index_path = os.path.join(self.index_dir, FAISS_INDEX_FILE)
+
+        if not os.path.exists(meta_path):
+            convert_legacy_meta(self.index_dir)
+        if not (os.path.exists(meta_path) and os.path.exists(index_path)):
+            raise FileNotFoundError(f"Missing FAISS artifacts in {self.index_dir}")
+
+        self.meta = MetaStore(meta_path)
+        self.model_name = self.meta.info.get("model") or "intfloat/multilingual-e5-base"
+        self.index = read_faiss_index(index_path)
+        self.bm25 = load_bm25(self.index_dir, self.meta)
+        # Content stamp of the index; scopes cached answers to this build
+        self.version = f"{os.path.basename(self.base_dir)}:{self.meta.info.get('version', '')}"
+
+    @property
+    def embedder(self) -> Embedder:
+        # Loaded on first use, so a gunicorn --preload parent can load indexes
+        # without starting model runtimes whose thread pools don't survive fork
+        return get_embedder(self.model_name)
+
+    @property
+    def backend(self) -> str:
+        return self.embedder.backend
+
+    def _embed(self, texts):
+        return self.embedder.embed(texts)
+
+    def _embed_query(self, text: str) -> np.ndarray:
+        return self.embedder.embed_query(text)
+
     def search(self, query: str, topk: int = None):
-        q = self._embed_query(query)
+        return multi_search([self], query, topk=topk)[0]
+
+    def search_vector(self, q: np.ndarray, topk: int = None):
         k = topk or self.k
         D, I = self.index.search(q, k)
+        ids = [int(i) for i in I[0] if i >= 0]
+        rows = self.meta.fetch(ids)
         results = []
         for score, idx in zip(D[0], I[0]):
-            if idx < 0:
+            item = rows.get(int(idx))
+            if item is None:
                 continue
-            item = self.data[idx]
-            results.append({"score": float(score), **item})
+            results.append({"score": float(score), "id": int(idx), **item})
+        return results
+
+    def search_lexical(self, query: str, topk: int = None) -> tuple[list, float]:
+        return self.bm25.search(query, topk or self.k)
+
+    @staticmethod
+    def lexical_is_strong(ranked: list, coverage: float) -> bool:
+        """Top BM25 hit contains every informative query term and clearly beats the runner-up."""
+        if not LEXICAL_FAST_PATH or not ranked:
+            return False
+        top = ranked[0][1]
+        second = ranked[1][1] if len(ranked) > 1 else 0.0
+        return top >= LEXICAL_MIN_SCORE and coverage >= LEXICAL_MIN_COVERAGE and top >= LEXICAL_MARGIN * second
+
+    def lexical_hits(self, ranked: list, topk: int = None) -> list:
+        """Hits for the fast path; `score` is BM25 relative to the top hit."""
+        if not ranked:
+            return []
+        top = ranked[0][1]
+        ranked = [(i, s) for i, s in ranked[:topk or self.k] if s >= 0.5 * top]
+        rows = self.meta.fetch([i for i, _ in ranked])
+        return [{"score": s / top, "bm25": s, "id": i, **rows[i]} for i, s in ranked if i in rows]
+
+    def search_hybrid(self, q: np.ndarray, ranked: list, topk: int = None) -> list:
+        """Fuse the vector ranking with the BM25 `ranked` list (RRF); `score` stays the cosine similarity."""
+        k = topk or self.k
+        D, I = self.index.search(q, max(k, HYBRID_DEPTH))
+        dense = {int(i): float(s) for s, i in zip(D[0], I[0]) if i >= 0}
+        lex = dict(ranked)
+        fused = rrf_fuse([list(dense), [i for i, _ in ranked]], k=RRF_K)[:k]
+        rows = self.meta.fetch([i for i, _ in fused])
+        results = []
+        for idx, rrf in fused:
+            item = rows.get(idx)
+            if item is None:
+                continue
+            score = dense.get(idx)
+            if score is None:
+                # Lexical-only hit: score it against the query like the others
+                try:
+                    score = float(self.index.reconstruct(idx) @ q[0])
+                except Exception:
+                    score = 0.0
+            results.append({"score": score, "rrf": rrf, "bm25": lex.get(idx, 0.0), "id": idx, **item})
         return results
 
     def build_context(self, query: str, topk: int = None) -> str:
-        hits = self.search(query, topk=topk or self.k)
+        return self.format_context(self.search(query, topk=topk or self.k))
+
+    @staticmethod
+    def format_context(hits) -> str:
         blocks = []
         for h in hits:
             src = h.get("source", "SOP")
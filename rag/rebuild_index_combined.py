@@ -1,7 +1,9 @@
-import os, json, pickle
+import os, json, shutil
 import numpy as np, faiss
-from sentence_transformers import SentenceTransformer
 from config import FAISS_DIR, SOP_JSON_PATH
+from rag.index_store import write_index, new_version_dir, publish_build
+from rag.embed_cache import embed_corpus
+from car_compat import save_compat
 
 MODEL_NAME = "intfloat/multilingual-e5-base"
 
@@ -10,8 +12,10 @@ def _normalize(v):
     n[n == 0] = 1.0
     return v / n
 
-def rebuild():
-    os.makedirs(FAISS_DIR, exist_ok=True)
+def rebuild(out_root: str = FAISS_DIR, progress=None):
+    """Build a new index version under `out_root` and switch CURRENT to it once validated."""
+    progress = progress or (lambda stage: None)
+    os.makedirs(out_root, exist_ok=True)
     try:
         data = json.load(open(SOP_JSON_PATH, "r", encoding="utf-8"))
     except Exception as e:
@@ -24,17 +28,38 @@ def rebuild():
 
     corpus = [f"Q: {e['question']}\nA: {e['answer']}" for e in entries]
     print(f"[ingest] Embedding {len(corpus)} entries with {MODEL_NAME}...")
-    model = SentenceTransformer(MODEL_NAME)
-    embs = model.encode(corpus, convert_to_numpy=True, normalize_embeddings=False, show_progress_bar=False).astype("float32")
-    embs = _normalize(embs)
+    progress("embed")
+
+    from rag.rag import get_embedder, embedder_backend
+    backend = embedder_backend(MODEL_NAME)
+
+    def _embed(texts):
+        # Model is only loaded when something actually changed
+        embedder = get_embedder(MODEL_NAME)
+        if embedder.backend != backend:
+            # Cached vectors came from the other backend; mixing them would corrupt the index
+            raise RuntimeError(f"{MODEL_NAME} loaded on {embedder.backend}, expected {backend}")
+        return _normalize(embedder.embed(texts))
+
+    embs, stats = embed_corpus(corpus, MODEL_NAME, backend, _embed)
+    print(f"[ingest] Vectors reused={stats['reused']} computed={stats['computed']}")
     dim = embs.shape[1]
     index = faiss.IndexFlatIP(dim)
     index.add(embs)
 
-    faiss.write_index(index, os.path.join(FAISS_DIR, "index.faiss"))
-    with open(os.path.join(FAISS_DIR, "index.pkl"), "wb") as f:
-        pickle.dump({"data": entries, "model": MODEL_NAME}, f)
-    print(f"[ingest] Indexed {len(entries)} items → {FAISS_DIR}")
+    progress("write")
+    version_dir = new_version_dir(out_root)
+    try:
+        write_index(version_dir, index, entries, MODEL_NAME)
+        print(f"[ingest] Compatibility rows: {save_compat(version_dir, entries)}")
+        progress("validate")
+        publish_build(out_root, version_dir)
+    except Exception:
+        shutil.rmtree(version_dir, ignore_errors=True)
+        raise
+    print(f"[ingest] Indexed {len(entries)} items → {version_dir}")
+    stats["version"] = os.path.basename(version_dir)
+    return stats
 
 if __name__ == "__main__":
     rebuild()
@@ -1,6 +1,9 @@
-import sqlite3, json, os
-from datetime import datetime
-from config import MEMORY_DEPTH
+import sqlite3, json, os, threading, base64
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from config import MEMORY_DEPTH, SESSION_CACHE_SIZE, WORKERS
+from events import EVENTS
 
 # ----------------- Database Path Setup -----------------
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -8,87 +11,442 @@ DATA_DIR = os.path.join(BASE_DIR, "data")
 os.makedirs(DATA_DIR, exist_ok=True)  # ensure writable folder inside container
 DB_PATH = os.getenv("SESSION_DB_PATH", os.path.join(DATA_DIR, "sessions.db"))
 
+# Bump when the schema changes; init_db() migrates older databases
+SCHEMA_VERSION = 2
+
+
+def _default_session() -> dict:
+    return {
+        "lang": None,
+        "frozen": False,
+        "reply_count": 0,
+        "greeted": False,
+        "last_intent": None
+    }
+
+
+def _now_ts() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+
+def _now_active() -> str:
+    # Sub-second precision so two writes in the same second still change sessions_version()
+    return datetime.now(timezone.utc).isoformat(timespec="microseconds")
+
+
+class _Unit:
+    """Open unit of work: the live session dict plus messages and events not yet flushed."""
+    __slots__ = ("sess", "pending", "events")
+
+    def __init__(self, sess: dict):
+        self.sess = sess
+        self.pending: list[tuple[str, str, str]] = []  # (ts, role, text)
+        self.events: list[tuple[str, dict]] = []  # (kind, data), published after the flush
+
+
+# ----------------- Session Store -----------------
+class SessionStore:
+    """
+    Session persistence with one WAL-mode connection per worker thread,
+    a write-through LRU of serialized sessions, and a unit-of-work scope
+    that loads a session once and flushes it once.
+
+    Sessions hold scalar state only; conversation turns are appended to
+    the `messages` table.
+
+    With `shared=True` (several worker processes on one database) the LRU
+    is dropped whenever SQLite's data_version shows a commit from another
+    connection, so no worker serves a session another one has rewritten.
+    """
+
+    def __init__(self, db_path: str, cache_size: int = 512, shared: bool = False):
+        self.db_path = db_path
+        self.cache_size = cache_size
+        self.shared = shared
+        self._local = threading.local()
+        self._cache: OrderedDict[str, str] = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.invalidations = 0
+
+    def connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        # A connection opened before a fork (gunicorn --preload) belongs to the parent
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=10)  # also the busy timeout for cross-process writes
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+            self._local.data_version = None
+        return conn
+
+    def _check_external_writes(self):
+        """
+        data_version changes when any other connection commits (other
+        workers, but also this process's other threads, so this errs on
+        the side of dropping the cache).
+        """
+        conn = self.connect()
+        version = conn.execute("PRAGMA data_version").fetchone()[0]
+        if version != self._local.data_version:
+            if self._cache:
+                self.invalidate()
+                self.invalidations += 1
+            self._local.data_version = version
+
+    def _units(self) -> dict:
+        units = getattr(self._local, "units", None)
+        if units is None:
+            units = self._local.units = {}
+        return units
+
+    # --- LRU ---
+    def _cache_get(self, user_id: str):
+        with self._cache_lock:
+            raw = self._cache.get(user_id)
+            if raw is not None:
+                self._cache.move_to_end(user_id)
+            return raw
+
+    def _cache_put(self, user_id: str, raw: str, fill: bool = False):
+        """
+        Writers call this under the SQLite write lock, so their puts land in
+        commit order. Readers only `fill` a missing entry: a row they read
+        before a concurrent write must not replace what that write cached.
+        """
+        if self.cache_size <= 0:
+            return
+        with self._cache_lock:
+            if fill and user_id in self._cache:
+                return
+            self._cache[user_id] = raw
+            self._cache.move_to_end(user_id)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def invalidate(self, user_id: str | None = None):
+        with self._cache_lock:
+            if user_id is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(user_id, None)
+
+    # --- Session reads / writes ---
+    def _read_raw(self, user_id: str):
+        if self.shared:
+            self._check_external_writes()
+        raw = self._cache_get(user_id)
+        if raw is not None:
+            self.hits += 1
+            return raw
+        self.misses += 1
+        row = self.connect().execute("SELECT data FROM sessions WHERE user_id=?", (user_id,)).fetchone()
+        if row:
+            self._cache_put(user_id, row[0], fill=True)
+            return row[0]
+        return None
+
+    def load(self, user_id: str) -> dict:
+        """Return a private copy of the session (live dict inside a unit of work)."""
+        unit = self._units().get(user_id)
+        if unit is not None:
+            return unit.sess
+        raw = self._read_raw(user_id)
+        if raw is None:
+            return _default_session()
+        try:
+            return json.loads(raw)
+        except Exception:
+            return {}
+
+    def save(self, user_id: str, data: dict):
+        """Replace the whole session (prefer `update` for single fields)."""
+        unit = self._units().get(user_id)
+        if unit is not None:
+            if data is not unit.sess:
+                unit.sess.clear()
+                unit.sess.update(data)
+            return
+        def replace(sess):
+            sess.clear()
+            sess.update(data)
+        self._flush(user_id, replace, [])
+
+    def update(self, user_id: str, mutate):
+        """
+        Apply `mutate(sess)` to the live session: in memory inside a unit,
+        otherwise to a fresh read in one write transaction, so concurrent
+        writers to other fields are never overwritten.
+        """
+        unit = self._units().get(user_id)
+        if unit is not None:
+            mutate(unit.sess)
+            return
+        self._flush(user_id, mutate, [])
+
+    def _flush(self, user_id: str, mutate, pending: list, events=()):
+        """
+        Write session changes and new turns in one transaction. `mutate`
+        is applied to the session as stored right now (read under the
+        write lock, not from the cache), so it only touches what it changes.
+        `events` are (kind, data) pairs published once the write is committed.
+        """
+        conn = self.connect()
+        now = _now_active()
+        try:
+            with conn:
+                # IMMEDIATE takes the write lock before the read: no other thread
+                # or worker can commit to this session between read and write
+                conn.execute("BEGIN IMMEDIATE")
+                raw = None
+                if mutate is not None:
+                    row = conn.execute("SELECT data FROM sessions WHERE user_id=?", (user_id,)).fetchone()
+                    try:
+                        sess = json.loads(row[0]) if row else _default_session()
+                    except Exception:
+                        sess = _default_session()
+                    mutate(sess)
+                    raw = json.dumps(sess)
+                # Every write bumps last_active, which drives dashboard ordering and deltas
+                conn.execute(
+                    "INSERT INTO sessions (user_id, data, last_active) VALUES (?,?,?) "
+                    "ON CONFLICT(user_id) DO UPDATE SET last_active=excluded.last_active"
+                    + (", data=excluded.data" if raw is not None else ""),
+                    (user_id, raw if raw is not None else json.dumps(_default_session()), now)
+                )
+                # One INSERT per turn (rarely more than two) to learn each msg_id
+                ids = [
+                    conn.execute("INSERT INTO messages (user_id, ts, role, text) VALUES (?,?,?,?)",
+                                 (user_id, ts, role, text)).lastrowid
+                    for ts, role, text in pending
+                ]
+                # Still holding the write lock, so concurrent flushes cache in commit order
+                if raw is not None:
+                    self._cache_put(user_id, raw)
+        except Exception:
+            self.invalidate(user_id)  # the cached copy may be the one that failed to commit
+            raise
+        self.writes += 1
+        # Published after commit, so a client that refetches on the event sees the row
+        for mid, (ts, role, text) in zip(ids, pending):
+            EVENTS.publish("message", {"user_id": user_id, "id": mid, "sender": role or "bot",
+                                       "content": text or "", "time": ts, "lastActive": now})
+        for kind, data in events:
+            EVENTS.publish(kind, data)
+
+    # --- Messages ---
+    def append_message(self, user_id: str, role: str, text: str):
+        item = (_now_ts(), role, text)
+        unit = self._units().get(user_id)
+        if unit is not None:
+            unit.pending.append(item)
+            return
+        self._flush(user_id, None, [item])
+
+    def publish(self, user_id: str, kind: str, data: dict):
+        """Publish a dashboard event once this user's pending changes are committed."""
+        unit = self._units().get(user_id)
+        if unit is not None:
+            unit.events.append((kind, data))
+            return
+        EVENTS.publish(kind, data)
+
+    def recent_messages(self, user_id: str, limit: int) -> list[dict]:
+        """Last `limit` turns, oldest first, including unflushed ones."""
+        rows = self.connect().execute(
+            "SELECT role, text FROM messages WHERE user_id=? ORDER BY ts DESC, msg_id DESC LIMIT ?",
+            (user_id, limit)
+        ).fetchall()
+        out = [{"role": r, "text": t} for r, t in reversed(rows)]
+        unit = self._units().get(user_id)
+        if unit is not None:
+            out += [{"role": r, "text": t} for _, r, t in unit.pending]
+        return out[-limit:] if limit else []
+
+    @contextmanager
+    def unit(self, user_id: str):
+        """
+        Load the session once, let every helper mutate it in memory and
+        write back (with any new messages) in one transaction on exit.
+        Only the keys changed inside the unit are written, merged into the
+        stored session, so e.g. an agent's freeze() during a slow reply
+        survives. No lock is held while the unit is open. Nested scopes for
+        the same user reuse the open one.
+        """
+        units = self._units()
+        if user_id in units:
+            yield units[user_id].sess
+            return
+        sess = self.load(user_id)
+        before = json.loads(json.dumps(sess))
+        unit = units[user_id] = _Unit(sess)
+        try:
+            yield sess
+        finally:
+            del units[user_id]
+            changed = {k: v for k, v in sess.items() if k not in before or before[k] != v}
+            removed = [k for k in before if k not in sess]
+
+            def merge(stored):
+                stored.update(changed)
+                for k in removed:
+                    stored.pop(k, None)
+
+            if changed or removed or unit.pending:
+                self._flush(user_id, merge if changed or removed else None, unit.pending, unit.events)
+            else:
+                for kind, data in unit.events:
+                    EVENTS.publish(kind, data)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "cache_size": len(self._cache),
+            "cache_hits": self.hits,
+            "cache_misses": self.misses,
+            "cache_hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "writes": self.writes,
+            "cross_process_invalidations": self.invalidations,
+        }
+
+
+SESSION_STORE = SessionStore(DB_PATH, cache_size=SESSION_CACHE_SIZE, shared=WORKERS > 1)
+
+
+def session_unit(user_id: str):
+    """Unit-of-work scope for one inbound message (see SessionStore.unit)."""
+    return SESSION_STORE.unit(user_id)
+
 
 # ----------------- Database Init -----------------
 def init_db():
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = SESSION_STORE.connect()
         c = conn.cursor()
         c.execute("""
         CREATE TABLE IF NOT EXISTS sessions (
             user_id TEXT PRIMARY KEY,
-            data TEXT
+            data TEXT,
+            last_active TEXT NOT NULL DEFAULT ''
+        )
+        """)
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS messages (
+            msg_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            ts TEXT NOT NULL,
+            role TEXT NOT NULL,
+            text TEXT
         )
         """)
+        c.execute("CREATE INDEX IF NOT EXISTS idx_messages_user_ts ON messages (user_id, ts)")
+        conn.commit()
+        version = c.execute("PRAGMA user_version").fetchone()[0]
+        if version < 1:
+            _migrate_history_blobs(conn)
+        if version < 2:
+            _add_last_active(conn)
+        c.execute("CREATE INDEX IF NOT EXISTS idx_sessions_last_active ON sessions (last_active, user_id)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_messages_user_id ON messages (user_id, msg_id)")
+        c.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
         conn.commit()
-        conn.close()
         print(f"[DB] sessions.db initialized successfully at {DB_PATH}")
     except Exception as e:
         print(f"[DB ERROR] Failed to init database: {e}")
         raise
 
 
+def _migrate_history_blobs(conn: sqlite3.Connection):
+    """Move `history`/`logs` lists out of session JSON into the messages table."""
+    migrated = 0
+    rows = conn.execute(
+        "SELECT user_id, data FROM sessions WHERE data LIKE '%\"history\"%' OR data LIKE '%\"logs\"%'"
+    ).fetchall()
+    with conn:
+        for user_id, data in rows:
+            try:
+                sess = json.loads(data)
+            except Exception:
+                continue
+            turns, seen = [], set()
+            # Q/A logs carry timestamps; history only holds the last few turns
+            for item in sess.pop("logs", []) or []:
+                try:
+                    ts = datetime.fromisoformat(item["t"]).replace(tzinfo=timezone.utc).isoformat(timespec="seconds")
+                except Exception:
+                    ts = _now_ts()
+                for role, text in (("user", item.get("q", "")), ("bot", item.get("a", ""))):
+                    turns.append((user_id, ts, role, text))
+                    seen.add((role, text))
+            now = _now_ts()
+            for item in sess.pop("history", []) or []:
+                role, text = item.get("role", "bot"), item.get("text", "")
+                if (role, text) not in seen:
+                    turns.append((user_id, now, role, text))
+            conn.executemany("INSERT INTO messages (user_id, ts, role, text) VALUES (?,?,?,?)", turns)
+            conn.execute("UPDATE sessions SET data=? WHERE user_id=?", (json.dumps(sess), user_id))
+            migrated += 1
+    SESSION_STORE.invalidate()
+    if migrated:
+        print(f"[DB] Migrated conversation history for {migrated} sessions")
+
+
+def _add_last_active(conn: sqlite3.Connection):
+    """Add sessions.last_active, backfilled from each user's newest message."""
+    cols = {r[1] for r in conn.execute("PRAGMA table_info(sessions)")}
+    with conn:
+        if "last_active" not in cols:
+            conn.execute("ALTER TABLE sessions ADD COLUMN last_active TEXT NOT NULL DEFAULT ''")
+        conn.execute("""
+            UPDATE sessions SET last_active = COALESCE(
+                (SELECT MAX(ts) FROM messages WHERE messages.user_id = sessions.user_id), '')
+        """)
+    print("[DB] Added sessions.last_active")
+
+
 # ----------------- Core Session Ops -----------------
 def get_session(user_id: str):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT data FROM sessions WHERE user_id=?", (user_id,))
-    row = c.fetchone()
-    conn.close()
-    if row:
-        try:
-            return json.loads(row[0])
-        except Exception:
-            return {}
-    return {
-        "lang": None,
-        "frozen": False,
-        "reply_count": 0,
-        "greeted": False,
-        "last_intent": None,
-        "history": []
-    }
+    return SESSION_STORE.load(user_id)
 
 
 def save_session(user_id: str, data: dict):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("REPLACE INTO sessions (user_id, data) VALUES (?,?)", (user_id, json.dumps(data)))
-    conn.commit()
-    conn.close()
+    SESSION_STORE.save(user_id, data)
 
 
 # ----------------- State Updates -----------------
 def set_lang(user_id: str, lang: str):
-    sess = get_session(user_id)
-    sess["lang"] = lang
-    save_session(user_id, sess)
+    def apply(sess):
+        sess["lang"] = lang
+    SESSION_STORE.update(user_id, apply)
 
 
 def freeze(user_id: str, frozen: bool, mode="user"):
-    sess = get_session(user_id)
-    sess["frozen"] = frozen
-    save_session(user_id, sess)
+    def apply(sess):
+        sess["frozen"] = frozen
+    SESSION_STORE.update(user_id, apply)
+    # Inside a unit this waits for its flush, so a dashboard refetch sees the new state
+    SESSION_STORE.publish(user_id, "frozen" if frozen else "unfrozen", {"user_id": user_id, "mode": mode})
 
 
 def update_reply_state(user_id: str):
-    sess = get_session(user_id)
-    sess["reply_count"] = sess.get("reply_count", 0) + 1
-    save_session(user_id, sess)
+    def bump(sess):
+        sess["reply_count"] = sess.get("reply_count", 0) + 1
+    SESSION_STORE.update(user_id, bump)
 
 
 def log_qna(user_id: str, q: str, a: str):
-    sess = get_session(user_id)
-    logs = sess.get("logs", [])
-    logs.append({"q": q, "a": a, "t": datetime.utcnow().isoformat()})
-    sess["logs"] = logs[-50:]  # Keep last 50 pairs
-    save_session(user_id, sess)
+    """Record a question/answer pair as two conversation turns."""
+    SESSION_STORE.append_message(user_id, "user", q)
+    SESSION_STORE.append_message(user_id, "bot", a)
 
 
 def set_last_intent(user_id: str, intent: str | None):
-    sess = get_session(user_id)
-    sess["last_intent"] = intent
-    save_session(user_id, sess)
+    def apply(sess):
+        sess["last_intent"] = intent
+    SESSION_STORE.update(user_id, apply)
 
 
 def get_last_intent(user_id: str):
@@ -98,52 +456,190 @@ def get_last_intent(user_id: str):
 
 # ----------------- Multi-Turn Memory -----------------
 def add_message_to_history(user_id: str, role: str, text: str):
-    """Append message to session history, keeping only MEMORY_DEPTH turns."""
-    sess = get_session(user_id)
-    history = sess.get("history", [])
-    history.append({"role": role, "text": text})
-    if len(history) > MEMORY_DEPTH:
-        history = history[-MEMORY_DEPTH:]
-    sess["history"] = history
-    save_session(user_id, sess)
+    """Append one conversation turn (O(1), no session rewrite)."""
+    SESSION_STORE.append_message(user_id, role, text)
 
 
 def get_history(user_id: str):
-    """Retrieve the recent conversation history."""
-    sess = get_session(user_id)
-    return sess.get("history", [])
+    """Retrieve the last MEMORY_DEPTH conversation turns."""
+    return SESSION_STORE.recent_messages(user_id, MEMORY_DEPTH)
+
+
+# ----------------- Dashboard Queries -----------------
+# Pages are keyed on (last_active, user_id) so every query walks
+# idx_sessions_last_active and costs O(page), never O(users).
+CHAT_PAGE_MAX = 200
+HISTORY_PAGE_MAX = 500
+
+_CHAT_ROWS_SQL = """
+    SELECT s.user_id, s.data, s.last_active, m.text, m.ts
+    FROM sessions s
+    LEFT JOIN messages m ON m.msg_id = (
+        SELECT msg_id FROM messages WHERE user_id = s.user_id ORDER BY msg_id DESC LIMIT 1
+    )
+"""
+
+
+def encode_cursor(last_active: str, user_id: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps([last_active, user_id]).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[str, str]:
+    raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+    last_active, user_id = json.loads(raw)
+    return str(last_active), str(user_id)
+
+
+def _chat_rows(conn: sqlite3.Connection, rows) -> list[dict]:
+    out = []
+    for user_id, data, last_active, last, last_time in rows:
+        try:
+            sess = json.loads(data)
+            out.append({
+                "user_id": user_id,
+                "name": sess.get("name", user_id),
+                "profile_pic": sess.get("profile_pic", ""),
+                "lastMessage": last or "",
+                "lastMessageTime": last_time or last_active or _now_ts(),
+                "lastActive": last_active,
+                "frozen": sess.get("frozen", False),
+                "lang": sess.get("lang", "EN")
+            })
+        except Exception as e:
+            print(f"[CLEANUP] Removing corrupted session {user_id}: {e}", flush=True)
+            try:
+                with conn:
+                    conn.execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
+                SESSION_STORE.invalidate(user_id)
+            except Exception as db_err:
+                print(f"[CLEANUP ERROR] Failed to delete {user_id}: {db_err}", flush=True)
+    return out
+
+
+def sessions_version() -> str:
+    """Newest last_active (index lookup); changes whenever any session is written."""
+    row = SESSION_STORE.connect().execute("SELECT MAX(last_active) FROM sessions").fetchone()
+    return row[0] or ""
+
+
+def list_sessions_page(limit: int = 50, cursor: str | None = None, since: str | None = None) -> dict:
+    """
+    Chats by most recent activity. `cursor` continues a previous page;
+    `since` returns only chats active at or after that timestamp (the
+    `since` value of an earlier response). Clients merge delta rows by
+    user_id, so repeats at the boundary are harmless.
+    """
+    conn = SESSION_STORE.connect()
+    limit = max(1, min(int(limit), CHAT_PAGE_MAX))
+    if since is not None:
+        # Oldest change first, so an overflowing delta resumes where it stopped
+        rows = conn.execute(
+            f"{_CHAT_ROWS_SQL} WHERE s.last_active >= ? ORDER BY s.last_active, s.user_id LIMIT ?",
+            (since, limit + 1)
+        ).fetchall()
+        more = len(rows) > limit
+        rows = rows[:limit]
+        return {
+            "chats": _chat_rows(conn, rows[::-1]),
+            "next_cursor": None,
+            "since": rows[-1][2] if more else sessions_version(),
+        }
+    where, params = "", []
+    if cursor:
+        where, params = "WHERE (s.last_active, s.user_id) < (?, ?)", list(decode_cursor(cursor))
+    rows = conn.execute(
+        f"{_CHAT_ROWS_SQL} {where} ORDER BY s.last_active DESC, s.user_id DESC LIMIT ?",
+        params + [limit + 1]
+    ).fetchall()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        "chats": _chat_rows(conn, rows),
+        "next_cursor": encode_cursor(rows[-1][2], rows[-1][0]) if more else None,
+        "since": sessions_version(),
+    }
+
+
+def list_sessions():
+    """Return all valid sessions with their latest message, most recently active first."""
+    conn = SESSION_STORE.connect()
+    try:
+        rows = conn.execute(f"{_CHAT_ROWS_SQL} ORDER BY s.last_active DESC, s.user_id DESC").fetchall()
+    except Exception as e:
+        print(f"[ERROR] list_sessions failed: {e}", flush=True)
+        return []
+    return _chat_rows(conn, rows)
+
+
+def chat_version(user_id: str) -> int:
+    """Newest msg_id for the user (index lookup); 0 when there are no messages."""
+    row = SESSION_STORE.connect().execute("SELECT MAX(msg_id) FROM messages WHERE user_id=?", (user_id,)).fetchone()
+    return row[0] or 0
+
+
+def get_chat_page(user_id: str, after_id: int | None = None, before_id: int | None = None,
+                  limit: int = 50) -> dict:
+    """
+    Messages oldest first. `after_id` returns what arrived since the
+    client's newest message; otherwise the newest `limit` messages
+    (older than `before_id` when paging back).
+    """
+    conn = SESSION_STORE.connect()
+    limit = max(1, min(int(limit), HISTORY_PAGE_MAX))
+    if after_id is not None:
+        rows = conn.execute(
+            "SELECT msg_id, role, text, ts FROM messages WHERE user_id=? AND msg_id>? ORDER BY msg_id LIMIT ?",
+            (user_id, after_id, limit + 1)
+        ).fetchall()
+        more = len(rows) > limit
+        rows = rows[:limit]
+    else:
+        rows = conn.execute(
+            "SELECT msg_id, role, text, ts FROM messages WHERE user_id=? AND msg_id<? "
+            "ORDER BY msg_id DESC LIMIT ?",
+            (user_id, before_id if before_id is not None else 2 ** 62, limit + 1)
+        ).fetchall()
+        more = len(rows) > limit
+        rows = rows[:limit][::-1]
+    messages = [{"id": mid, "sender": role or "bot", "content": text or "", "time": ts} for mid, role, text, ts in rows]
+    return {
+        "messages": messages,
+        "latest_id": chat_version(user_id),
+        # after_id: more new messages to fetch; otherwise older ones remain
+        "has_more": more,
+    }
+
+
+def get_chat_history(user_id: str):
+    """Full conversation for the dashboard, oldest first."""
+    rows = SESSION_STORE.connect().execute(
+        "SELECT msg_id, role, text, ts FROM messages WHERE user_id=? ORDER BY msg_id",
+        (user_id,)
+    ).fetchall()
+    return [{"id": mid, "sender": role or "bot", "content": text or "", "time": ts} for mid, role, text, ts in rows]
 
 
 # ----------------- Memory Reset Helpers -----------------
 def reset_memory(user_id: str | None = None):
     """Reset memory for a specific user or all users."""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    if user_id:
-        default = {
-            "lang": None,
-            "frozen": False,
-            "reply_count": 0,
-            "greeted": False,
-            "last_intent": None,
-            "history": []
-        }
-        c.execute("REPLACE INTO sessions (user_id, data) VALUES (?,?)", (user_id, json.dumps(default)))
-    else:
-        c.execute("DELETE FROM sessions")
-    conn.commit()
-    conn.close()
+    conn = SESSION_STORE.connect()
+    with conn:
+        if user_id:
+            conn.execute("REPLACE INTO sessions (user_id, data, last_active) VALUES (?,?,?)",
+                         (user_id, json.dumps(_default_session()), _now_active()))
+            conn.execute("DELETE FROM messages WHERE user_id=?", (user_id,))
+        else:
+            conn.execute("DELETE FROM sessions")
+            conn.execute("DELETE FROM messages")
+    SESSION_STORE.invalidate(user_id)
 
 
 # ----------------- Utility -----------------
 def get_all_user_ids():
     """Return list of all active session user_ids (for admin view/logging)."""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
+    c = SESSION_STORE.connect().cursor()
     c.execute("SELECT user_id FROM sessions")
-    rows = [r[0] for r in c.fetchall()]
-    conn.close()
-    return rows
+    return [r[0] for r in c.fetchall()]
 
 # ----------------- Backward Compatibility Shim -----------------
 def set_session(user_id: str, data: dict):
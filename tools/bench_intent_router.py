@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Benchmark intent_router's single compiled regex against the old style of
+checking intents one after another (one `re.search` per keyword, built on
+every call, plus substring scans for car keywords).
+
+Messages come from a CSV with a `text` column; tools/lang_sample.csv is
+used by default, topped up with a few intent-heavy examples.
+
+    python tools/bench_intent_router.py
+    python tools/bench_intent_router.py --csv exported_messages.csv --repeat 20
+"""
+import argparse
+import csv
+import os
+import re
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from intent_router import INTENT_ROUTER, RULES, CAR_KEYWORDS, SHORT_ONLY, SHORT_MAX_WORDS
+
+EXTRA = [
+    "LA", "hi", "Hello, what is the price?", "berapa harga kommuassist", "office hours?",
+    "where is your office", "nak test drive", "device not blinking", "my relay needs replacement",
+    "is my HR-V 2019 supported?", "apa itu kommu", "how does it work", "resume", "thanks",
+]
+
+
+def load_messages(path: str) -> list:
+    with open(path, "r", encoding="utf-8") as f:
+        return [r["text"] for r in csv.DictReader(f) if r.get("text")] + EXTRA
+
+
+def legacy_classify(text: str) -> list:
+    """The pre-router approach: every rule checked separately, regexes built per call."""
+    lower = re.sub(r"\s+", " ", text.lower()).strip()
+    stripped = lower.strip("!?.,")
+    found = []
+    for name, phrases, exact in RULES:
+        if name in SHORT_ONLY and len(lower.split()) > SHORT_MAX_WORDS:
+            continue
+        if exact:
+            hit = stripped in set(phrases)
+        elif name == "car":
+            hit = any(k in lower for k in CAR_KEYWORDS)
+        else:
+            hit = any(re.search(rf"\b{re.escape(p.rstrip('*'))}", lower) for p in phrases)
+        if hit:
+            found.append(name)
+    return found
+
+
+def run(label, fn, messages, repeat):
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        out = [fn(m) for m in messages]
+    elapsed = time.perf_counter() - t0
+    n = len(messages) * repeat
+    print(f"{label:<10} {n / elapsed:12,.0f} msgs/s   {elapsed * 1e6 / n:8.2f} us/msg")
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark intent classification")
+    ap.add_argument("--csv", default=os.path.join(ROOT, "tools", "lang_sample.csv"))
+    ap.add_argument("--repeat", type=int, default=50)
+    ap.add_argument("--show-diff", action="store_true", help="print messages where the top intent differs")
+    args = ap.parse_args()
+
+    messages = load_messages(args.csv)
+    print(f"Messages: {len(messages)} x {args.repeat} passes, {len(RULES)} intents, "
+          f"{sum(len(p) for _, p, _ in RULES)} phrases")
+    legacy = run("legacy", legacy_classify, messages, args.repeat)
+    routed = run("router", INTENT_ROUTER.classify, messages, args.repeat)
+
+    top = lambda xs: xs[0] if xs else None
+    diffs = [(m, top(a), top(b)) for m, a, b in zip(messages, legacy, routed) if top(a) != top(b)]
+    print(f"Top intent agrees on {len(messages) - len(diffs)}/{len(messages)} messages")
+    if args.show_diff:
+        for m, a, b in diffs:
+            print(f"  {m!r}: legacy={a} router={b}")
+    matched = sum(1 for r in routed if r)
+    print(f"Router matched an intent for {matched}/{len(messages)} messages")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Compare lang_detect.detect_lang with raw langdetect on labelled messages.
+
+CSVs need `text,label` columns with BM/EN labels. Both defaults are small
+hand-labelled samples of typical customer messages:
+
+- tools/lang_sample.csv was looked at while choosing thresholds, so its
+  score is optimistic.
+- tools/lang_heldout.csv was never used to build the lexicon, the seed
+  lines or any threshold. Quote this one.
+
+    python tools/bench_lang_detect.py
+    python tools/bench_lang_detect.py --csv exported_messages.csv --repeat 5
+"""
+import argparse
+import csv
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import lang_detect
+
+
+def load_sample(path: str):
+    with open(path, "r", encoding="utf-8") as f:
+        return [(r["text"], r["label"].strip().upper()) for r in csv.DictReader(f) if r.get("text")]
+
+
+def run(label, fn, sample, repeat):
+    wrong = []
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        preds = [fn(text) for text, _ in sample]
+    us = (time.perf_counter() - t0) * 1e6 / (len(sample) * repeat)
+    for (text, gold), pred in zip(sample, preds):
+        if pred != gold:
+            wrong.append((text, gold, pred))
+    acc = 1 - len(wrong) / len(sample)
+    print(f"{label:<22} accuracy {acc:6.1%}   {us:9.1f} us/msg")
+    return wrong
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark BM/EN language detection")
+    ap.add_argument("--csv", nargs="+", default=[os.path.join(ROOT, "tools", "lang_sample.csv"),
+                                                 os.path.join(ROOT, "tools", "lang_heldout.csv")])
+    ap.add_argument("--repeat", type=int, default=3, help="passes over the sample (later passes hit the cache)")
+    ap.add_argument("--show-errors", action="store_true")
+    args = ap.parse_args()
+
+    for path in args.csv:
+        sample = load_sample(path)
+        print(f"\n{os.path.basename(path)}: {len(sample)} messages ({sum(g == 'BM' for _, g in sample)} BM)")
+
+        try:
+            from langdetect import detect, DetectorFactory
+            DetectorFactory.seed = 42
+
+            def langdetect_only(codes):
+                def fn(text):
+                    try:
+                        return "BM" if detect(text) in codes else "EN"
+                    except Exception:
+                        return "EN"
+                return fn
+            # The old is_malay accepted only "ms"; langdetect reports most Malay as "id"
+            run("langdetect (ms)", langdetect_only(("ms",)), sample, args.repeat)
+            errors = run("langdetect (ms|id)", langdetect_only(("ms", "id")), sample, args.repeat)
+            if args.show_errors:
+                for e in errors:
+                    print("   ", e)
+        except ImportError:
+            print("langdetect not installed; skipping baseline")
+
+        lang_detect._detect.cache_clear()
+        errors = run("detect_lang (cold)", lang_detect.detect_lang, sample, 1)
+        run("detect_lang (cached)", lang_detect.detect_lang, sample, args.repeat)
+        if args.show_errors:
+            for e in errors:
+                print("   ", e)
+    print(f"\nLayers: {lang_detect.stats()['layers']}")
+
+
+if __name__ == "__main__":
+    main()
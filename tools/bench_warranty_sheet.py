@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Benchmark warranty sheet indexing on a synthetic CSV.
+
+Compares the per-field header lookup (`_extract_field` for every candidate
+on every DictReader row) with the compiled column plan used by `_index_rows`
+on raw CSV records, and checks that both produce the same lookups.
+
+    python tools/bench_warranty_sheet.py --rows 200000
+    python tools/bench_warranty_sheet.py --csv path/to/export.csv
+"""
+import argparse
+import csv
+import io
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import google_sheets as gs
+
+HEADERS = [
+    "Timestamp", "Customer Name", "Phone", "Email", "Car Model", "Car Year",
+    "Dongle ID ", "Serial No", "Prod Date", "Date of Sale", "Installation Date",
+    "Warranty", "Warranty End", "Installer", "Branch", "Remarks",
+]
+
+
+def synth_csv(n_rows: int, seed: int = 7) -> str:
+    rnd = random.Random(seed)
+    buf = io.StringIO()
+    w = csv.writer(buf)
+    w.writerow(HEADERS)
+    for i in range(n_rows):
+        w.writerow([
+            f"2024-01-{1 + i % 28:02d} 10:00", f"Customer {i}", f"+601{rnd.randrange(10**8):08d}",
+            f"user{i}@example.com", rnd.choice(["Honda Civic", "Toyota Corolla", "Proton X50"]),
+            str(rnd.randrange(2016, 2025)), f"{rnd.getrandbits(64):016x}", f"SN{i:07d}",
+            "2023-11-02", "2024-01-15", "2024-01-20", rnd.choice(["Active", "Expired", ""]),
+            "2025-01-20", "Ali", "KL", "",
+        ])
+    return buf.getvalue()
+
+
+def legacy_merge(rows):
+    """The pre-plan loop: ~17 `_extract_field` calls per row."""
+    db, by_dongle = {}, {}
+    for r in rows:
+        phone_like = [gs._extract_field(r, c) for c in ("phone", "mobile", "whatsapp", "contact")]
+        serial_like = [gs._extract_field(r, c) for c in ("serial", "serial no", "serial_no", "device serial")]
+        dongle_like = [gs._extract_field(r, c) for c in gs._DONGLE_COLS]
+        for k in phone_like + serial_like:
+            k2 = gs._norm_key(k)
+            if k2:
+                db[k2] = r
+        for d in dongle_like:
+            d2 = gs._norm_dongle(d)
+            if d2:
+                by_dongle[d2] = r
+    return db, by_dongle
+
+
+def legacy_text(row):
+    status = gs._extract_field(row, "warranty", "warranty status", "subscription valid")
+    end = gs._extract_field(row, "warranty end", "warranty expiry", "subscription valid until")
+    return status, end
+
+
+def timed(label, fn, *args):
+    t0 = time.perf_counter()
+    out = fn(*args)
+    ms = (time.perf_counter() - t0) * 1000
+    print(f"{label:<28} {ms:10.1f} ms")
+    return out, ms
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark warranty sheet column mapping")
+    ap.add_argument("--rows", type=int, default=200_000, help="synthetic rows to generate")
+    ap.add_argument("--csv", help="use this CSV file instead of synthetic data")
+    args = ap.parse_args()
+
+    if args.csv:
+        with open(args.csv, "r", encoding="utf-8", errors="ignore") as f:
+            content = f.read()
+    else:
+        content = synth_csv(args.rows)
+    rows = list(csv.DictReader(io.StringIO(content)))
+    print(f"Rows: {len(rows)}  Columns: {len(rows[0]) if rows else 0}")
+
+    (old_db, old_dongle), old_ms = timed("legacy _extract_field", legacy_merge, rows)
+
+    part, new_ms = timed("compiled column plan", lambda: gs._index_rows(csv.reader(io.StringIO(content)), "bench"))
+    gs._install({"primary": part})
+
+    sample = rows[: min(len(rows), 20_000)]
+    compact = list(gs.WARRANTY_BY_DONGLE.values())[: len(sample)]
+    _, old_txt = timed(f"legacy text x{len(sample)}", lambda: [legacy_text(r) for r in sample])
+    _, new_txt = timed(f"plan text x{len(sample)}", lambda: [gs.warranty_text_from_row(r) for r in compact])
+
+    same = (
+        old_db.keys() == gs.WARRANTY_DB.keys() and old_dongle.keys() == gs.WARRANTY_BY_DONGLE.keys()
+        and all(gs.warranty_text_from_row(old_dongle[d]) == gs.warranty_text_from_row(row)
+                for d, row in gs.WARRANTY_BY_DONGLE.items())
+    )
+    print(f"Lookups identical: {same}")
+    print(f"Speed-up: merge x{old_ms / max(new_ms, 1e-6):.1f}, text x{old_txt / max(new_txt, 1e-6):.1f}")
+    return 0 if same else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
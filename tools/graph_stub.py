@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the WhatsApp Cloud (Graph) API send endpoint.
+
+Accepts POST /<version>/<phone_id>/messages, records each payload and can
+inject latency, rate limiting (429 + Retry-After) and random 5xx errors so
+the outbound sender's retries and throttling can be exercised offline.
+
+    python tools/graph_stub.py --port 9009 --rps 10 --fail-rate 0.1
+    GRAPH_API_BASE=http://127.0.0.1:9009/v17.0 uvicorn app:app --port 6090
+    curl http://127.0.0.1:9009/stats
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubState:
+    def __init__(self, rps: float, fail_rate: float, latency_ms: float):
+        self.rps = rps
+        self.fail_rate = fail_rate
+        self.latency_ms = latency_ms
+        self.lock = threading.Lock()
+        self.window = deque()
+        self.counts = Counter()
+        self.by_recipient = Counter()
+        self.last = deque(maxlen=50)
+
+    def admit(self) -> bool:
+        """Sliding one-second window; False means answer 429."""
+        if self.rps <= 0:
+            return True
+        now = time.monotonic()
+        with self.lock:
+            while self.window and now - self.window[0] > 1.0:
+                self.window.popleft()
+            if len(self.window) >= self.rps:
+                return False
+            self.window.append(now)
+            return True
+
+
+def make_handler(state: StubState):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, like the real endpoint
+
+        def _reply(self, code: int, body: dict, headers: dict | None = None):
+            raw = json.dumps(body).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(raw)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(raw)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            try:
+                payload = json.loads(self.rfile.read(length) or b"{}")
+            except ValueError:
+                return self._reply(400, {"error": {"message": "bad json", "code": 100}})
+            if not self.path.rstrip("/").endswith("/messages"):
+                return self._reply(404, {"error": {"message": "unknown path", "code": 803}})
+            if state.latency_ms:
+                time.sleep(state.latency_ms / 1000 * random.uniform(0.5, 1.5))
+            if not state.admit():
+                state.counts["429"] += 1
+                return self._reply(429, {"error": {"message": "rate limit hit", "code": 130429}},
+                                   {"Retry-After": "1"})
+            if random.random() < state.fail_rate:
+                state.counts["500"] += 1
+                return self._reply(500, {"error": {"message": "stub failure", "code": 1}})
+            with state.lock:
+                state.counts[payload.get("type", "unknown")] += 1
+                state.by_recipient[payload.get("to", "")] += 1
+                state.last.append(payload)
+            self._reply(200, {
+                "messaging_product": "whatsapp",
+                "contacts": [{"input": payload.get("to"), "wa_id": payload.get("to")}],
+                "messages": [{"id": f"wamid.stub.{uuid.uuid4().hex}"}],
+            })
+
+        def do_GET(self):
+            if self.path.startswith("/stats"):
+                with state.lock:
+                    return self._reply(200, {
+                        "counts": dict(state.counts),
+                        "recipients": len(state.by_recipient),
+                        "last": list(state.last)[-10:],
+                    })
+            self._reply(404, {"error": {"message": "unknown path", "code": 803}})
+
+        def log_message(self, fmt, *args):
+            pass
+
+    return Handler
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Stub WhatsApp Graph API send endpoint")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=9009)
+    ap.add_argument("--rps", type=float, default=0, help="requests/second before answering 429 (0 = unlimited)")
+    ap.add_argument("--fail-rate", type=float, default=0.0, help="fraction of requests answered with 500")
+    ap.add_argument("--latency-ms", type=float, default=0.0, help="mean artificial latency per request")
+    args = ap.parse_args()
+
+    state = StubState(args.rps, args.fail_rate, args.latency_ms)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(state))
+    print(f"Graph stub on http://{args.host}:{args.port}  (GRAPH_API_BASE=http://{args.host}:{args.port}/v17.0)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
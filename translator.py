@@ -0,0 +1,159 @@
+import os, time, sqlite3, hashlib, threading, logging
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from config import TRANSLATE_TIMEOUT, TRANSLATION_CACHE_TTL, TRANSLATION_CACHE_MAX
+from lang_detect import detect_lang
+
+log = logging.getLogger("kai")
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BASE_DIR, "data")
+os.makedirs(DATA_DIR, exist_ok=True)
+DB_PATH = os.getenv("TRANSLATION_CACHE_DB_PATH", os.path.join(DATA_DIR, "translations.db"))
+
+# deep-translator target codes for our reply languages
+_TARGETS = {"BM": "ms", "EN": "en"}
+
+
+class Translator:
+    """
+    Answer translation in three steps: skip text already in the target
+    language, reuse a stored translation of the same text, and only then
+    call Google Translate (bounded by `timeout`). Failures return the
+    original text, as before. Stored translations expire after `ttl`
+    seconds and are evicted least-recently-used past `max_entries`.
+    """
+
+    def __init__(self, db_path: str, timeout: float = 8.0, ttl: int = 30 * 86400, max_entries: int = 5000):
+        self.db_path = db_path
+        self.timeout = timeout
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="kai-translate")
+        self._lock = threading.Lock()
+        self.skipped = 0
+        self.hits = 0
+        self.misses = 0
+        self.failed = 0
+        self.timeouts = 0
+
+    def connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        # A connection opened before a fork (gunicorn --preload) belongs to the parent
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def init(self):
+        conn = self.connect()
+        with conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS translations (
+                    sha TEXT NOT NULL,
+                    target TEXT NOT NULL,
+                    translated TEXT NOT NULL,
+                    created_at REAL,
+                    hits INTEGER DEFAULT 0,
+                    PRIMARY KEY (sha, target)
+                )
+            """)
+            cols = {r[1] for r in conn.execute("PRAGMA table_info(translations)")}
+            if "last_used" not in cols:
+                conn.execute("ALTER TABLE translations ADD COLUMN last_used REAL")
+                conn.execute("UPDATE translations SET last_used = created_at")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_translations_last_used ON translations (last_used)")
+
+    def _bump(self, name: str):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    @staticmethod
+    def _remote(text: str, target: str) -> str:
+        from deep_translator import GoogleTranslator
+        return GoogleTranslator(source="auto", target=target).translate(text)
+
+    def translate(self, text: str, lang: str = "BM") -> str:
+        text = (text or "").strip()
+        target = _TARGETS.get(lang)
+        if not text or not target:
+            return text
+        if detect_lang(text) == lang:
+            self._bump("skipped")
+            return text
+
+        sha = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        conn = self.connect()
+        row = conn.execute("SELECT translated, created_at FROM translations WHERE sha=? AND target=?",
+                           (sha, target)).fetchone()
+        if row and time.time() - (row[1] or 0) <= self.ttl:
+            with conn:
+                conn.execute("UPDATE translations SET hits=hits+1, last_used=? WHERE sha=? AND target=?",
+                             (time.time(), sha, target))
+            self._bump("hits")
+            return row[0]
+
+        self._bump("misses")
+        future = self._executor.submit(self._remote, text, target)
+        try:
+            translated = (future.result(timeout=self.timeout) or "").strip()
+        except FutureTimeout:
+            self._bump("timeouts")
+            log.warning(f"[Translate] Timed out after {self.timeout}s; sending untranslated text")
+            # Keep the late result so the next asker doesn't wait again
+            future.add_done_callback(lambda f: self._store_late(f, sha, target))
+            return text
+        except Exception as e:
+            self._bump("failed")
+            log.warning(f"[Translate] {lang} translation failed: {e}")
+            return text
+        if not translated:
+            return text
+        self._store(sha, target, translated)
+        return translated
+
+    def _store(self, sha: str, target: str, translated: str):
+        now = time.time()
+        conn = self.connect()
+        with conn:
+            conn.execute(
+                "REPLACE INTO translations (sha, target, translated, created_at, last_used, hits) "
+                "VALUES (?,?,?,?,?,0)",
+                (sha, target, translated, now, now)
+            )
+            conn.execute("DELETE FROM translations WHERE created_at < ?", (now - self.ttl,))
+            conn.execute("""
+                DELETE FROM translations WHERE rowid IN (
+                    SELECT rowid FROM translations ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                )
+            """, (self.max_entries,))
+
+    def _store_late(self, future, sha: str, target: str):
+        try:
+            translated = (future.result() or "").strip()
+            if translated:
+                self._store(sha, target, translated)
+        except Exception:
+            pass
+
+    def stats(self) -> dict:
+        served = self.skipped + self.hits
+        total = served + self.misses
+        entries = self.connect().execute("SELECT COUNT(*) FROM translations").fetchone()[0]
+        return {
+            "entries": entries,
+            "skipped_already_target": self.skipped,
+            "cache_hits": self.hits,
+            "remote_calls": self.misses,
+            "failed": self.failed,
+            "timeouts": self.timeouts,
+            "hit_rate": round(served / total, 3) if total else 0.0,
+        }
+
+
+TRANSLATOR = Translator(DB_PATH, timeout=TRANSLATE_TIMEOUT, ttl=TRANSLATION_CACHE_TTL,
+                        max_entries=TRANSLATION_CACHE_MAX)
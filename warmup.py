@@ -0,0 +1,69 @@
+import time, threading, logging
+from collections import OrderedDict
+
+log = logging.getLogger("kai")
+
+
+class Warmup:
+    """
+    Tracks background startup stages. The app is `ready` once it can serve
+    from what is already on disk; `done` once every source refresh finished.
+    """
+
+    def __init__(self):
+        self.t0 = time.monotonic()
+        self.stages: OrderedDict[str, dict] = OrderedDict()
+        self.ready = False
+        self.done = False
+        self.ready_ms = None
+        self.total_ms = None
+        self._thread = None
+
+    def _elapsed_ms(self) -> float:
+        return round((time.monotonic() - self.t0) * 1000, 1)
+
+    def run_stage(self, name: str, fn, *args):
+        """Run one timed stage; failures are recorded and logged, never raised."""
+        info = self.stages[name] = {"status": "running"}
+        start = time.monotonic()
+        try:
+            result = fn(*args)
+            info["status"] = "ok"
+            return True, result
+        except (Exception, SystemExit) as e:
+            info["status"] = "failed"
+            info["error"] = str(e)
+            return False, None
+        finally:
+            info["ms"] = round((time.monotonic() - start) * 1000, 1)
+            log.info(f"[Startup] {name}: {info['status']} in {info['ms']} ms"
+                     + (f" ({info['error']})" if "error" in info else ""))
+
+    def mark_ready(self):
+        self.ready = True
+        self.ready_ms = self._elapsed_ms()
+        log.info(f"[Startup] Ready to serve after {self.ready_ms} ms")
+
+    def start(self, fn):
+        """Run `fn` on a daemon thread so the server accepts requests meanwhile."""
+        def _run():
+            try:
+                fn()
+            finally:
+                self.done = True
+                self.total_ms = self._elapsed_ms()
+                log.info(f"[Startup] Warm-up finished after {self.total_ms} ms")
+        self._thread = threading.Thread(target=_run, name="kai-warmup", daemon=True)
+        self._thread.start()
+
+    def snapshot(self) -> dict:
+        return {
+            "ready": self.ready,
+            "done": self.done,
+            "ready_ms": self.ready_ms,
+            "total_ms": self.total_ms,
+            "stages": dict(self.stages),
+        }
+
+
+WARMUP = Warmup()
@@ -0,0 +1,94 @@
+import asyncio, time, logging, zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger("kai")
+
+
+class WebhookQueue:
+    """
+    Bounded in-process queue for inbound webhook payloads.
+    Payloads are sharded by sender so one user's messages stay in order,
+    and each shard worker runs the blocking pipeline on a thread pool.
+    """
+
+    def __init__(self, handler, maxsize: int = 1000, workers: int = 4):
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.maxsize = max(self.workers, maxsize)
+        self._queues: list[asyncio.Queue] = []
+        self._tasks: list[asyncio.Task] = []
+        self._executor: ThreadPoolExecutor | None = None
+        self._waits = deque(maxlen=1000)
+        self.accepting = False
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    async def start(self):
+        per_shard = self.maxsize // self.workers
+        self._queues = [asyncio.Queue(maxsize=per_shard) for _ in range(self.workers)]
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="kai-webhook")
+        self._tasks = [asyncio.create_task(self._worker(q)) for q in self._queues]
+        self.accepting = True
+        log.info(f"[Queue] Started {self.workers} webhook workers (capacity {self.maxsize})")
+
+    def submit(self, shard_key: str, payload: dict) -> bool:
+        """Enqueue a payload; returns False when stopped or the shard is full."""
+        if not self.accepting:
+            self.rejected += 1
+            return False
+        q = self._queues[zlib.crc32((shard_key or "").encode()) % self.workers]
+        try:
+            q.put_nowait((time.monotonic(), payload))
+            return True
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return False
+
+    async def _worker(self, q: asyncio.Queue):
+        loop = asyncio.get_running_loop()
+        while True:
+            enqueued_at, payload = await q.get()
+            self._waits.append(time.monotonic() - enqueued_at)
+            try:
+                await loop.run_in_executor(self._executor, self.handler, payload)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                log.error(f"[Queue] Worker error: {e}", exc_info=True)
+            finally:
+                q.task_done()
+
+    async def drain(self, timeout: float = 30.0):
+        """Stop accepting, wait for queued payloads to finish, then stop workers."""
+        self.accepting = False
+        try:
+            await asyncio.wait_for(asyncio.gather(*(q.join() for q in self._queues)), timeout)
+        except asyncio.TimeoutError:
+            log.warning(f"[Queue] Drain timed out with {self.depth()} payloads left")
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._executor:
+            self._executor.shutdown(wait=True)
+        log.info(f"[Queue] Drained; processed={self.processed} failed={self.failed}")
+
+    def depth(self) -> int:
+        return sum(q.qsize() for q in self._queues)
+
+    def stats(self) -> dict:
+        waits = sorted(self._waits)
+        p95 = waits[max(0, int(len(waits) * 0.95) - 1)] if waits else 0.0
+        return {
+            "depth": self.depth(),
+            "capacity": self.maxsize,
+            "workers": self.workers,
+            "accepting": self.accepting,
+            "processed": self.processed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "wait_ms_avg": round(1000 * sum(waits) / len(waits), 1) if waits else 0.0,
+            "wait_ms_p95": round(1000 * p95, 1),
+            "wait_ms_max": round(1000 * waits[-1], 1) if waits else 0.0,
+        }
@@ -0,0 +1,283 @@
+import os, time, random, asyncio, threading, logging, zlib
+from collections import deque
+
+import httpx
+
+from config import (
+    GRAPH_API_BASE, WA_SEND_RATE, WA_SEND_BURST, WA_SEND_RETRIES, WA_SEND_WORKERS, WA_SEND_QUEUE_SIZE,
+    AGENT_TYPING_SECONDS, WORKERS
+)
+
+log = logging.getLogger("kai")
+# httpx logs every request at INFO; our own counters cover that
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+# Graph error codes that mean "slow down", even when sent with HTTP 400
+_THROTTLE_CODES = {4, 80007, 130429, 131056}
+
+
+class TokenBucket:
+    """Thread-safe token bucket; `reserve()` takes a token and returns how long to wait for it."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = max(rate, 0.001)
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+def _retryable(resp: httpx.Response) -> bool:
+    if resp.status_code == 429 or resp.status_code >= 500:
+        return True
+    if resp.status_code == 400:
+        try:
+            return resp.json().get("error", {}).get("code") in _THROTTLE_CODES
+        except ValueError:
+            return False
+    return False
+
+
+def _backoff(attempt: int, resp: httpx.Response | None = None) -> float:
+    """Full-jitter exponential backoff, honouring Retry-After when Graph sends it."""
+    if resp is not None:
+        try:
+            return min(60.0, float(resp.headers.get("Retry-After", "")))
+        except ValueError:
+            pass
+    return random.uniform(0, min(30.0, 0.5 * (2 ** attempt)))
+
+
+class WhatsAppSender:
+    """
+    Outbound Graph API sender: one keep-alive client, per-recipient shards
+    (so a user's messages stay in order), a shared token bucket and
+    jittered retries on 429/5xx. Before `start()` (scripts, CLI tools) sends
+    go out synchronously with the same retry policy.
+    """
+
+    def __init__(self, base_url: str = GRAPH_API_BASE, rate: float = WA_SEND_RATE, burst: int = WA_SEND_BURST,
+                 retries: int = WA_SEND_RETRIES, workers: int = WA_SEND_WORKERS, maxsize: int = WA_SEND_QUEUE_SIZE):
+        self.base_url = base_url.rstrip("/")
+        self.retries = max(0, retries)
+        self.workers = max(1, workers)
+        self.maxsize = max(self.workers, maxsize)
+        self.bucket = TokenBucket(rate, burst)
+        self._queues: list[asyncio.Queue] = []
+        self._tasks: list[asyncio.Task] = []
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._client: httpx.AsyncClient | None = None
+        self._sync_client: httpx.Client | None = None
+        self._sync_lock = threading.Lock()
+        self._latencies = deque(maxlen=1000)
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.rejected = 0
+        self.throttled_ms = 0.0
+
+    # ----------------- Request Plumbing -----------------
+    def _url(self) -> str:
+        return f"{self.base_url}/{os.getenv('META_PHONE_NUMBER_ID')}/messages"
+
+    def _headers(self) -> dict:
+        return {"Authorization": f"Bearer {os.getenv('META_PERMANENT_TOKEN', '')}".strip()}
+
+    def _limits(self) -> httpx.Limits:
+        return httpx.Limits(max_connections=self.workers * 2, max_keepalive_connections=self.workers * 2,
+                            keepalive_expiry=60)
+
+    def _record(self, ok: bool, kind: str, to: str, enqueued_at: float, resp=None, err=None):
+        if ok:
+            self.sent += 1
+            self._latencies.append(time.monotonic() - enqueued_at)
+            return
+        self.failed += 1
+        detail = f"{resp.status_code}: {resp.text[:300]}" if resp is not None else err
+        # Typing indicators are best-effort; only message failures are errors
+        (log.error if kind == "text" else log.warning)(f"[Sender] {kind} to {to} failed {detail}")
+
+    async def _post(self, job: tuple):
+        kind, to, payload, enqueued_at = job
+        resp, err = None, None
+        for attempt in range(self.retries + 1):
+            wait = self.bucket.reserve()
+            if wait:
+                self.throttled_ms += wait * 1000
+                await asyncio.sleep(wait)
+            try:
+                resp = await self._client.post(self._url(), headers=self._headers(), json=payload)
+                if resp.status_code < 400:
+                    return self._record(True, kind, to, enqueued_at)
+                if not _retryable(resp):
+                    break
+            except httpx.TransportError as e:
+                resp, err = None, str(e) or type(e).__name__
+            if attempt < self.retries:
+                self.retried += 1
+                await asyncio.sleep(_backoff(attempt, resp))
+        self._record(False, kind, to, enqueued_at, resp, err)
+
+    def _post_blocking(self, job: tuple):
+        kind, to, payload, enqueued_at = job
+        with self._sync_lock:
+            if self._sync_client is None:
+                self._sync_client = httpx.Client(timeout=10, limits=self._limits())
+        resp, err = None, None
+        for attempt in range(self.retries + 1):
+            time.sleep(self.bucket.reserve())
+            try:
+                resp = self._sync_client.post(self._url(), headers=self._headers(), json=payload)
+                if resp.status_code < 400:
+                    return self._record(True, kind, to, enqueued_at)
+                if not _retryable(resp):
+                    break
+            except httpx.TransportError as e:
+                resp, err = None, str(e) or type(e).__name__
+            if attempt < self.retries:
+                self.retried += 1
+                time.sleep(_backoff(attempt, resp))
+        self._record(False, kind, to, enqueued_at, resp, err)
+
+    # ----------------- Queue -----------------
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._client = httpx.AsyncClient(timeout=httpx.Timeout(10, connect=5), limits=self._limits())
+        per_shard = self.maxsize // self.workers
+        self._queues = [asyncio.Queue(maxsize=per_shard) for _ in range(self.workers)]
+        self._tasks = [asyncio.create_task(self._worker(q)) for q in self._queues]
+        log.info(f"[Sender] Started {self.workers} senders → {self.base_url}")
+
+    async def _worker(self, q: asyncio.Queue):
+        while True:
+            job = await q.get()
+            try:
+                await self._post(job)
+            except Exception as e:
+                self.failed += 1
+                log.error(f"[Sender] Worker error: {e}", exc_info=True)
+            finally:
+                q.task_done()
+
+    def _enqueue(self, job: tuple):
+        q = self._queues[zlib.crc32(job[1].encode()) % self.workers]
+        try:
+            q.put_nowait(job)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            log.error(f"[Sender] Queue full; dropped {job[0]} to {job[1]}")
+
+    def submit(self, kind: str, to: str, payload: dict):
+        """Queue one Graph call; safe from the event loop and from worker threads."""
+        job = (kind, to or "", payload, time.monotonic())
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return self._post_blocking(job)
+        try:
+            in_loop = asyncio.get_running_loop() is loop
+        except RuntimeError:
+            in_loop = False
+        if in_loop:
+            self._enqueue(job)
+        else:
+            loop.call_soon_threadsafe(self._enqueue, job)
+
+    def send_text(self, to: str, text: str):
+        self.submit("text", to, {"messaging_product": "whatsapp", "to": to, "type": "text", "text": {"body": text}})
+
+    def send_typing(self, to: str, on: bool):
+        self.submit("typing", to, {"messaging_product": "whatsapp", "to": to, "type": "action",
+                                   "action": {"typing": "on" if on else "off"}})
+
+    async def drain(self, timeout: float = 15.0):
+        """Flush queued sends, then close the client."""
+        if self._loop is None:
+            return
+        try:
+            await asyncio.wait_for(asyncio.gather(*(q.join() for q in self._queues)), timeout)
+        except asyncio.TimeoutError:
+            log.warning(f"[Sender] Drain timed out with {self.depth()} sends left")
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self._client.aclose()
+        self._loop = None
+        log.info(f"[Sender] Drained; sent={self.sent} failed={self.failed}")
+
+    def depth(self) -> int:
+        return sum(q.qsize() for q in self._queues)
+
+    def stats(self) -> dict:
+        lat = sorted(self._latencies)
+        p95 = lat[max(0, int(len(lat) * 0.95) - 1)] if lat else 0.0
+        return {
+            "depth": self.depth(),
+            "sent": self.sent,
+            "failed": self.failed,
+            "retried": self.retried,
+            "rejected": self.rejected,
+            "throttled_ms": round(self.throttled_ms, 1),
+            "latency_ms_avg": round(1000 * sum(lat) / len(lat), 1) if lat else 0.0,
+            "latency_ms_p95": round(1000 * p95, 1),
+            "latency_ms_max": round(1000 * lat[-1], 1) if lat else 0.0,
+        }
+
+
+class TypingScheduler:
+    """
+    Runs "typing… pause… message" sequences as event-loop tasks. A per-user
+    lock keeps one user's sequences in order; different users run concurrently.
+    """
+
+    def __init__(self, sender: WhatsAppSender, delay: float = AGENT_TYPING_SECONDS):
+        self.sender = sender
+        self.delay = delay
+        self._locks: dict[str, asyncio.Lock] = {}
+        self._pending: dict[str, int] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self.scheduled = 0
+        self.completed = 0
+
+    def schedule(self, to: str, text: str, delay: float | None = None) -> asyncio.Task:
+        """Start the sequence and return at once; must be called on the event loop."""
+        self._locks.setdefault(to, asyncio.Lock())
+        self._pending[to] = self._pending.get(to, 0) + 1
+        task = asyncio.create_task(self._run(to, text, self.delay if delay is None else delay))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        self.scheduled += 1
+        return task
+
+    async def _run(self, to: str, text: str, delay: float):
+        try:
+            async with self._locks[to]:
+                self.sender.send_typing(to, True)
+                await asyncio.sleep(delay)
+                self.sender.send_typing(to, False)
+                self.sender.send_text(to, text)
+                self.completed += 1
+        finally:
+            self._pending[to] -= 1
+            if not self._pending[to]:
+                del self._pending[to]
+                del self._locks[to]
+
+    async def drain(self, timeout: float = 10.0):
+        if self._tasks:
+            await asyncio.wait(set(self._tasks), timeout=timeout)
+
+    def stats(self) -> dict:
+        return {"scheduled": self.scheduled, "completed": self.completed, "in_flight": len(self._tasks)}
+
+
+# WA_SEND_RATE is the account-wide limit; each worker process gets its share
+WA_SENDER = WhatsAppSender(rate=WA_SEND_RATE / WORKERS, burst=max(1, WA_SEND_BURST // WORKERS))
+TYPING = TypingScheduler(WA_SENDER)
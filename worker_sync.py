@@ -0,0 +1,141 @@
+import os, time, threading, logging
+
+try:
+    import fcntl
+except ImportError:  # Windows dev setups run a single process; a thread lock is enough there
+    fcntl = None
+
+from config import STATE_SYNC_SECONDS
+
+log = logging.getLogger("kai")
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+LOCK_DIR = os.getenv("KAI_LOCK_DIR", os.path.join(BASE_DIR, "data", "locks"))
+
+
+class FileLock:
+    """
+    Exclusive lock shared by every worker process (flock on
+    data/locks/<name>.lock, dropped by the kernel if the holder dies) and
+    by threads within one process. May be released from another thread.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.path = os.path.join(LOCK_DIR, f"{name}.lock")
+        self._thread_lock = threading.Lock()
+        self._fd = None
+
+    def acquire(self, blocking: bool = True) -> bool:
+        if not self._thread_lock.acquire(blocking):
+            return False
+        try:
+            os.makedirs(LOCK_DIR, exist_ok=True)
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        except OSError:
+            self._thread_lock.release()
+            raise
+        if fcntl is not None:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                os.close(fd)
+                self._thread_lock.release()
+                return False
+        self._fd = fd
+        return True
+
+    def release(self):
+        fd, self._fd = self._fd, None
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+        self._thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def run_once(name: str, fn, since: float):
+    """
+    Run `fn` in one worker: skipped while another worker holds the lock or
+    when one already finished it after `since` (epoch seconds). Returns
+    (ran, result).
+    """
+    lock = FileLock(name)
+    if not lock.acquire(blocking=False):
+        log.info(f"[Sync] {name} already running in another worker; skipped")
+        return False, None
+    try:
+        stamp = os.path.join(LOCK_DIR, f"{name}.done")
+        if os.path.exists(stamp) and os.path.getmtime(stamp) >= since:
+            log.info(f"[Sync] {name} already done by another worker; skipped")
+            return False, None
+        result = fn()
+        with open(stamp, "w", encoding="utf-8") as f:
+            f.write(f"{os.getpid()} {time.time()}\n")
+        return True, result
+    finally:
+        lock.release()
+
+
+class StateWatcher:
+    """
+    Keeps this process's in-memory copies of shared on-disk state (live
+    index builds, warranty snapshot) current: every `interval` seconds
+    each `is_stale()` check runs and a stale copy is reloaded. That's how
+    a rebuild finished by one worker reaches the others.
+    """
+
+    def __init__(self, interval: float = STATE_SYNC_SECONDS):
+        self.interval = interval
+        self._watches: dict[str, tuple] = {}
+        self._thread = None
+        self._stop = threading.Event()
+        self.reloads: dict[str, int] = {}
+        self.failures: dict[str, int] = {}
+
+    def watch(self, name: str, is_stale, reload):
+        self._watches[name] = (is_stale, reload)
+        self.reloads.setdefault(name, 0)
+        self.failures.setdefault(name, 0)
+
+    def poll(self):
+        for name, (is_stale, reload) in self._watches.items():
+            try:
+                if is_stale():
+                    reload()
+                    self.reloads[name] += 1
+                    log.info(f"[Sync] Reloaded {name} published by another worker")
+            except Exception as e:
+                self.failures[name] += 1
+                log.warning(f"[Sync] Reloading {name} failed: {e}")
+
+    def start(self):
+        """Poll on a daemon thread (call in the worker, after fork)."""
+        if self._thread is not None:
+            return
+        def _run():
+            while not self._stop.wait(self.interval):
+                self.poll()
+        self._thread = threading.Thread(target=_run, name="kai-state-sync", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self) -> dict:
+        return {
+            "pid": os.getpid(),
+            "running": self._thread is not None,
+            "interval_s": self.interval,
+            "reloads": dict(self.reloads),
+            "failures": dict(self.failures),
+        }
+
+
+STATE_WATCHER = StateWatcher()